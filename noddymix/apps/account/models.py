@@ -1,5 +1,7 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, \
+    UserManager as BaseUserManager
+from django.db.models import F
 from django.db.models.signals import post_save
 from django.core.urlresolvers import reverse
 from django.conf import settings
@@ -7,6 +9,7 @@ from django.conf import settings
 from imagekit.models import ImageSpecField
 from imagekit.processors import SmartResize, Adjust
 from noddymix.utils import get_upload_path
+import redis
 
 
 # Create your models here.
@@ -19,6 +22,33 @@ def get_cover_path(instance, filename):
     return get_upload_path(instance, filename, 'img/c/')
 
 
+class UserManager(BaseUserManager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the User model.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def increment(self, field, user_ids, delta=1):
+        """
+        Description: Atomically add to a stats field of some users, with a
+                     single UPDATE query of just that column. Use this rather
+                     than adjusting the field and saving the User, which 
+                     rewrites every column and loses concurrent updates.
+        
+        Arguments:   - field:    name of field, `num_playlists`,
+                                 `num_followers` or `num_following`
+                     - user_ids: list of ids of User objects
+                     - delta:    amount to add (negative to subtract)
+        Return:      None
+          
+        Author:      Nnoduka Eruchalu
+        """
+        if user_ids and delta:
+            self.filter(id__in=user_ids).update(**{field: F(field) + delta})
+
+
 class User(AbstractUser):
     """
     Description: Extended User class
@@ -71,10 +101,11 @@ class User(AbstractUser):
         format='JPEG',
         options={'quality':90})
     
-    # this is used for tracking avatar/cover changes
+    # this is used for tracking avatar/cover/activity_public changes
     # ref: http://stackoverflow.com/a/1793323
     __original_avatar = None
     __original_cover = None
+    __original_activity_public = None
     
     
     # settings: make user's activity public
@@ -90,6 +121,11 @@ class User(AbstractUser):
                                         verbose_name="number of followers") 
     num_following = models.IntegerField(default=0,
                                         verbose_name="number following") 
+    # stats fields, which are only changed with UserManager.increment
+    STATS_FIELDS = ('num_playlists', 'num_followers', 'num_following')
+    
+    # custom manager
+    objects = UserManager()
 
     def get_account_name(self):
         """
@@ -181,6 +217,7 @@ class User(AbstractUser):
         super(User, self).__init__(*args, **kwargs)
         self.__original_avatar = self.avatar
         self.__original_cover = self.cover
+        self.__original_activity_public = self.activity_public
         
         
     def get_absolute_url(self):
@@ -193,43 +230,59 @@ class User(AbstractUser):
                      following.
                      Recent defined as the last `ACTIVITY_LIMIT` to have been
                      logged.
+                     These are read off the user's precomputed timeline if 
+                     possible, so it's one redis read and one query, plus one
+                     query per type of activity object and target.
                 
-        Arguments:   - instance: User object instance to have files deleted
-        Return:      None 
+        Arguments:   None
+        Return:      list of Activity objects, newest first
           
         Author:      Nnoduka Eruchalu
         """
         from noddymix.apps.activity.models import Activity
+        from noddymix.apps.activity.utils import prefetch_activities
+        from noddymix.apps.activity import timeline
         
-        activities = []
-        # can only pull activities for followings that make this public
-        followings = [rlp.followed for rlp in self.following.all() \
-                          if rlp.followed.activity_public]
-        
-        """
-        # alternative algorithm that works
-        for rlp in followings:
-            activities.extend(rlp.followed.activities.all())
-            if len(activities) > settings.ACTIVITY_LIMIT:
-                break
+        try:
+            activity_ids = timeline.activity_ids(self.id, 
+                                                 settings.ACTIVITY_LIMIT)
+        except redis.exceptions.RedisError:
+            # can only pull activities for followings that make this public
+            return prefetch_activities(
+                Activity.objects.select_related('actor').filter(
+                    actor__followers__follower=self,
+                    actor__activity_public=True)[:settings.ACTIVITY_LIMIT])
         
-        return activities[:settings.ACTIVITY_LIMIT]
-        """
-        activities = Activity.objects.filter(
-            actor__in=followings)[:settings.ACTIVITY_LIMIT]
-        return activities
+        activities = Activity.objects.select_related('actor').in_bulk(
+            activity_ids)
+        # can only pull activities for followings that make this public
+        return prefetch_activities(
+            [activities[activity_id] for activity_id in activity_ids
+             if activity_id in activities and 
+             activities[activity_id].actor.activity_public])
         
     
     def save(self, *args, **kwargs):
         """
         Description: On instance save ensure image files are deleted if images
                      are updated.
+                     Changing the activity_public setting drops the timelines
+                     of the user's followers, so they are rebuilt with or
+                     without the user's activities.
+                     Saving an existing user never writes the stats fields, as
+                     the copies on this instance could be stale.
                             
         Arguments:   *args, **kwargs
         Return:      None 
           
         Author:      Nnoduka Eruchalu
         """
+        if self.pk is not None and kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields 
+                if not f.primary_key and f.name not in self.STATS_FIELDS]
+        
         if self.__original_avatar and self.avatar != self.__original_avatar:
             # not new cover and cover changed, so delete old files
             orig = User.objects.get(pk=self.pk)
@@ -240,10 +293,21 @@ class User(AbstractUser):
             orig = User.objects.get(pk=self.pk)
             self.delete_cover_files(orig)
                     
+        is_new = self.pk is None
         super(User, self).save(*args, **kwargs)
-        # update the image file tracking properties
+        
+        if not is_new and \
+                self.activity_public != self.__original_activity_public:
+            from noddymix.apps.activity import timeline
+            try:
+                timeline.invalidate_followers(self.id)
+            except redis.exceptions.RedisError:
+                pass
+        
+        # update the image file and setting tracking properties
         self.__original_avatar = self.avatar
         self.__original_cover = self.cover
+        self.__original_activity_public = self.activity_public
         
     
     def delete(self, *args, **kwargs):
@@ -265,22 +329,26 @@ class User(AbstractUser):
         if self.cover:
             self.delete_cover_files(self)
         
+        from noddymix.apps.relationship import graph
+        
         # all users this user followed now have 1 less follower
-        followings = self.following.all()
-        for following in followings:
-            following.followed.num_followers -= 1
-            following.followed.save()
+        following_ids = list(self.following.values_list('followed', flat=True))
+        User.objects.increment('num_followers', following_ids, -1)
         
         # all users following this user now have 1 less follow
-        followers = self.followers.all()
-        for follower in followers:
-            follower.follower.num_following -= 1
-            follower.follower.save()
-            
+        follower_ids = list(self.followers.values_list('follower', flat=True))
+        User.objects.increment('num_following', follower_ids, -1)
+        
         # all playlists this user subscribed to now have 1 less subscriber
-        playlists = self.subscriptions.all()
-        for playlist in playlists:
-            playlist.num_subscribers -= 1
-            playlist.save(refresh_num_subscribers=False)
-            
+        self.subscriptions.model.objects.increment(
+            'num_subscribers', 
+            list(self.subscriptions.values_list('id', flat=True)), -1)
+        
+        user_id = self.id
         super(User, self).delete(*args, **kwargs)
+        
+        # and this user's follows are gone from the graph cache
+        try:
+            graph.remove_user(user_id, following_ids, follower_ids)
+        except redis.exceptions.RedisError:
+            pass
@@ -3,6 +3,7 @@ from django.contrib.auth import views as auth_views
 from noddymix.apps.account import views
 from noddymix.apps.relationship import views as rlp_views
 from noddymix.apps.audio import views as audio_views
+from noddymix.apps.activity import views as activity_views
 
 urlpatterns = patterns('',
                        url(r'^logout/$', auth_views.logout,
@@ -17,6 +18,9 @@ urlpatterns = patterns('',
                            name="userpage"),
                        url(r'^u/(?P<id>\d+)/playlists/$',
                            audio_views.userplaylists, name="userplaylists"),
+                       url(r'^u/(?P<id>\d+)/activities/$',
+                           activity_views.activities_user,
+                           name="activities_user"),
                        url(r'^u/(?P<id>\d+)/followers/$', rlp_views.followers,
                            name="followers"),
                        url(r'^u/(?P<id>\d+)/following/$', rlp_views.following,
@@ -322,7 +322,8 @@ def userpage(request, id):
         
         else:
             # get user's playlists
-            playlists_list = Playlist.objects.filter(owner=user)
+            playlists_list = Playlist.objects.filter(owner=user).select_related(
+                'owner', 'cover_album')
             playlists_context = playlists_helper(request, playlists_list)
             playlists_context['content'] = render_to_string(
                 'account/content.html',
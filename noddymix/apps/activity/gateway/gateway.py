@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+Description:
+  Server-Sent Events gateway for the realtime activity feed.
+
+  This does the job of nodejs/feed.js for browsers that use a plain
+  EventSource instead of socket.io. It subscribes to the redis channel that
+  activities are published to (see publisher.py) and streams each activity's
+  html to the users following its actor:
+    GET /feed?token=<feed token>
+  The token is the signed token of /activity/feed-token/ (see make_feed_token
+  in utils.py). It lists the ids of the users followed, so the gateway needs
+  no database. Those ids are the connection's subscription set, and the
+  gateway indexes connections by followed user id, so each message is only
+  looked at by the connections in its room. Each message is formatted once
+  and the same bytes are queued on all of them.
+
+  Follows and unfollows are published to the same channel (see
+  publish_follow in graph.py) as {"follower": id, "followed": id,
+  "following": true/false}, and are applied to the subscription sets of the
+  follower's open connections.
+
+  A connection only lasts as long as its token: once the token expires the
+  gateway sends an "expired" event and closes the stream, and the browser
+  reconnects with a fresh token (see static/js/global.js). A browser left
+  reconnecting with the expired token gets a 403.
+
+  Each connection has a bounded queue and a writer task:
+    - bursts are coalesced: once a message is queued, the writer waits
+      `--coalesce` seconds and sends everything queued in one write.
+    - slow clients get backpressure: the writer waits for the socket's buffer
+      to drain before writing again, and messages queue up meanwhile. Once the
+      queue is full its oldest messages are dropped, and a client that drops
+      more than `--max-drops` messages between two writes is disconnected.
+  An idle connection is a socket, an empty queue and a parked task, so one
+  process holds tens of thousands of them. Keepalive comments for every
+  connection come from one timer, not a timer per connection.
+
+  GET /status returns the gateway's counters as JSON.
+
+  Unlike the Django project this is Python 3 (3.7 or later) and only uses
+  the standard library. Run it with:
+    python3 gateway.py --secret <FEED_TOKEN_SECRET>
+  or with the secret in the FEED_TOKEN_SECRET environment variable. It
+  connects to the project's redis server on port 25373 (REDIS_PORT of the
+  Django settings), unless told otherwise by --redis-host and --redis-port or
+  the REDIS_HOST and REDIS_PORT environment variables.
+
+Table Of Contents:
+  - verify_feed_token: get the payload of a valid feed token
+  - read_reply:        read a reply from redis
+  - Client:            an event stream connection
+  - Gateway:           the gateway server
+  - raise_file_limit:  allow as many open sockets as possible
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from urllib.parse import parse_qs, urlsplit
+import argparse, asyncio, base64, binascii, collections, hashlib, hmac, \
+    json, os, resource, time
+
+# comment line sent to idle connections, so proxies don't close them
+KEEPALIVE = b':\n\n'
+
+# event sent to a connection before it is closed for its expired token
+EXPIRED = b'event: expired\ndata: \n\n'
+
+
+def verify_feed_token(token, secret):
+    """
+    Description: Check a feed token made by make_feed_token is signed with the
+                 secret and hasn't expired.
+
+    Arguments:   - token:  (str) feed token
+                 - secret: (bytes) FEED_TOKEN_SECRET
+    Return:      dict payload {"u": user id, "f": [followed ids], "e": expiry}
+                 or None if the token isn't valid
+
+    Author:      Nnoduka Eruchalu
+    """
+    try:
+        payload, signature = token.split('.')
+        expected = hmac.new(secret, payload.encode('ascii'),
+                            hashlib.sha256).hexdigest()
+        # compare in constant time, so the signature can't be guessed by timing
+        if not hmac.compare_digest(expected, signature):
+            return None
+        payload = json.loads(base64.urlsafe_b64decode(payload.encode('ascii')))
+        if payload['e'] < time.time():
+            return None
+        payload['u'] = int(payload['u'])
+        payload['f'] = [int(user_id) for user_id in payload['f']]
+        return payload
+    except (ValueError, TypeError, KeyError, AttributeError, binascii.Error):
+        return None
+
+
+async def read_reply(reader):
+    """
+    Description: Read one reply of the redis protocol
+
+    Arguments:   - reader: asyncio.StreamReader of redis connection
+    Return:      reply: bytes, int, list of replies or None
+
+    Author:      Nnoduka Eruchalu
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('redis closed the connection')
+    prefix, rest = line[:1], line[1:-2]
+    if prefix == b'+':
+        return rest
+    if prefix == b':':
+        return int(rest)
+    if prefix == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b'*':
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    if prefix == b'-':
+        raise ConnectionError('redis error: %s' % rest.decode())
+    raise ConnectionError('bad redis reply: %r' % line)
+
+
+def format_event(html):
+    """
+    Description: Format an activity's html as a "feedupdate" event stream
+                 event
+
+    Arguments:   - html: (str) activity html
+    Return:      (bytes) event
+
+    Author:      Nnoduka Eruchalu
+    """
+    lines = [b'event: feedupdate\n']
+    for line in html.encode('utf-8').splitlines() or [b'']:
+        lines.append(b'data: ' + line + b'\n')
+    lines.append(b'\n')
+    return b''.join(lines)
+
+
+class Client(object):
+    """
+    Description: An event stream connection, with its subscription set,
+                 token expiry and queue of events waiting to be written.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    # keep instances small, there are tens of thousands of them
+    __slots__ = ('writer', 'user_id', 'rooms', 'expires', 'queue', 'pending',
+                 'drops', 'max_drops', 'slow', 'closed')
+
+    def __init__(self, writer, user_id, rooms, expires, queue_size,
+                 max_drops):
+        self.writer = writer
+        self.user_id = user_id
+        self.rooms = set(rooms)
+        # unix time the connection's token expires
+        self.expires = expires
+        self.queue = collections.deque(maxlen=queue_size)
+        self.pending = asyncio.Event()
+        # events dropped since the last write
+        self.drops = 0
+        self.max_drops = max_drops
+        self.slow = False
+        self.closed = False
+
+
+    def send(self, event):
+        """
+        Description: Queue an event to be written. If the queue is full its
+                     oldest event is dropped, and a client that has dropped
+                     more than `max_drops` events since its last write is
+                     disconnected.
+
+        Arguments:   - event: (bytes) formatted event
+        Return:      (bool) True if an event was dropped
+
+        Author:      Nnoduka Eruchalu
+        """
+        dropped = len(self.queue) == self.queue.maxlen
+        if dropped:
+            self.drops += 1
+            if self.drops > self.max_drops and not self.slow:
+                # the writer is stuck draining, so cut the connection under it
+                self.slow = True
+                self.writer.transport.abort()
+        self.queue.append(event)
+        self.pending.set()
+        return dropped
+
+
+    async def run(self, coalesce):
+        """
+        Description: Write queued events until the connection is closed or
+                     lost, or its token has expired.
+
+        Arguments:   - coalesce: seconds to wait for more events before a write
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        while not self.closed:
+            await self.pending.wait()
+            if coalesce:
+                await asyncio.sleep(coalesce)
+            self.pending.clear()
+            data = b''.join(self.queue)
+            self.queue.clear()
+            self.drops = 0
+            self.writer.write(data)
+            # backpressure: new events queue up (or drop) until the client has
+            # taken this write
+            await self.writer.drain()
+            if self.expires <= time.time():
+                break
+
+
+    def close(self):
+        self.closed = True
+        self.pending.set()
+
+
+class Gateway(object):
+    """
+    Description: Server-Sent Events gateway: subscribes to the feed's redis
+                 channel and passes each message to the connections
+                 subscribed to its room.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.secret = options.secret.encode('utf-8')
+        # room (followed user id) -> set of Clients subscribed to it
+        self.rooms = collections.defaultdict(set)
+        # user id -> set of Clients of that user
+        self.users = collections.defaultdict(set)
+        self.clients = set()
+        self.stats = collections.Counter()
+
+
+    def add_client(self, client):
+        self.clients.add(client)
+        self.users[client.user_id].add(client)
+        for room in client.rooms:
+            self.rooms[room].add(client)
+
+
+    def leave_room(self, client, room):
+        subscribers = self.rooms.get(room)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.rooms[room]
+
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+        clients = self.users.get(client.user_id)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self.users[client.user_id]
+        for room in client.rooms:
+            self.leave_room(client, room)
+
+
+    def follow(self, follower_id, followed_id, following):
+        """
+        Description: Apply a follow or unfollow to the subscription sets of
+                     the follower's connections
+
+        Arguments:   - follower_id: id of user doing the following
+                     - followed_id: id of user being followed
+                     - following:   True for a follow, False for an unfollow
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        for client in self.users.get(follower_id, ()):
+            if following:
+                client.rooms.add(followed_id)
+                self.rooms[followed_id].add(client)
+            else:
+                client.rooms.discard(followed_id)
+                self.leave_room(client, followed_id)
+
+
+    def dispatch(self, message):
+        """
+        Description: Pass a feed message to the connections subscribed to its
+                     room, or apply a follow message to the connections of its
+                     follower
+
+        Arguments:   - message: (bytes) JSON encoded {"room": actor id,
+                                                      "data": activity html}
+                                or {"follower": id, "followed": id,
+                                    "following": true/false}
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        try:
+            message = json.loads(message)
+            if 'follower' in message:
+                self.follow(int(message['follower']), int(message['followed']),
+                            bool(message['following']))
+                self.stats['follows'] += 1
+                return
+            subscribers = self.rooms.get(int(message['room']))
+            html = message['data']
+        except (ValueError, TypeError, KeyError):
+            self.stats['bad_messages'] += 1
+            return
+
+        self.stats['messages'] += 1
+        if not subscribers:
+            return
+        event = format_event(html)
+        for client in subscribers:
+            if client.send(event):
+                self.stats['dropped'] += 1
+        self.stats['events'] += len(subscribers)
+
+
+    async def subscribe(self):
+        """
+        Description: Subscribe to the feed's redis channel and dispatch its
+                     messages, forever. Lost connections are retried with
+                     backoff.
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        channel = self.options.channel.encode('utf-8')
+        delay = 0.5
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(
+                    self.options.redis_host, self.options.redis_port)
+                writer.write(b'*2\r\n$9\r\nSUBSCRIBE\r\n$%d\r\n%s\r\n' %
+                             (len(channel), channel))
+                await writer.drain()
+                while True:
+                    reply = await read_reply(reader)
+                    if reply[0] == b'subscribe':
+                        delay = 0.5
+                    elif reply[0] == b'message':
+                        self.dispatch(reply[2])
+            except (OSError, ConnectionError, asyncio.IncompleteReadError,
+                    ValueError, IndexError, TypeError) as err:
+                print('redis subscription lost (%s), retrying in %.1fs' %
+                      (err, delay), flush=True)
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+    async def keepalive(self):
+        """
+        Description: Send a keepalive comment to idle connections every
+                     `--keepalive` seconds, and an expired event to those
+                     whose token has expired, which closes them once written
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        while True:
+            await asyncio.sleep(self.options.keepalive)
+            now = time.time()
+            for client in list(self.clients):
+                if client.expires <= now:
+                    client.send(EXPIRED)
+                    self.stats['expired'] += 1
+                elif not client.queue:
+                    client.send(KEEPALIVE)
+
+
+    def respond(self, writer, status, body, content_type='application/json'):
+        writer.write(('HTTP/1.1 %s\r\n'
+                      'Content-Type: %s\r\n'
+                      'Content-Length: %d\r\n'
+                      'Access-Control-Allow-Origin: %s\r\n'
+                      'Connection: close\r\n\r\n' %
+                      (status, content_type, len(body),
+                       self.options.allow_origin)).encode('ascii') + body)
+
+
+    async def handle(self, reader, writer):
+        """
+        Description: Serve an HTTP connection: an event stream on /feed, the
+                     gateway's counters on /status.
+
+        Arguments:   - reader: asyncio.StreamReader of connection
+                     - writer: asyncio.StreamWriter of connection
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        client = None
+        try:
+            # the request line and headers, ending with a blank line
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          self.options.request_timeout)
+            method, target = head.split(b'\r\n', 1)[0].decode('latin-1') \
+                .split(' ')[:2]
+            url = urlsplit(target)
+            if method != 'GET':
+                self.respond(writer, '405 Method Not Allowed', b'')
+            elif url.path == '/status':
+                self.respond(writer, '200 OK', json.dumps(dict(
+                    self.stats, connections=len(self.clients),
+                    rooms=len(self.rooms))).encode('ascii'))
+            elif url.path == '/feed':
+                token = parse_qs(url.query).get('token', [''])[0]
+                payload = verify_feed_token(token, self.secret)
+                if payload is None:
+                    self.stats['rejected'] += 1
+                    self.respond(writer, '403 Forbidden', b'')
+                else:
+                    client = Client(writer, payload['u'], payload['f'],
+                                    payload['e'], self.options.queue_size,
+                                    self.options.max_drops)
+                    writer.write(('HTTP/1.1 200 OK\r\n'
+                                  'Content-Type: text/event-stream\r\n'
+                                  'Cache-Control: no-cache\r\n'
+                                  'Access-Control-Allow-Origin: %s\r\n'
+                                  'X-Accel-Buffering: no\r\n'
+                                  'Connection: keep-alive\r\n\r\n'
+                                  'retry: %d\n\n' %
+                                  (self.options.allow_origin,
+                                   self.options.retry)).encode('ascii'))
+                    self.add_client(client)
+                    self.stats['connected'] += 1
+                    await client.run(self.options.coalesce)
+            else:
+                self.respond(writer, '404 Not Found', b'')
+            await writer.drain()
+        except (OSError, ConnectionError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError, UnicodeError):
+            # bad requests and clients that went away
+            pass
+        finally:
+            if client is not None:
+                client.close()
+                self.remove_client(client)
+                if client.slow:
+                    self.stats['slow_disconnects'] += 1
+            writer.close()
+
+
+    async def serve(self):
+        """
+        Description: Serve event streams and dispatch feed messages forever
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        server = await asyncio.start_server(
+            self.handle, self.options.host, self.options.port,
+            backlog=self.options.backlog, limit=8192)
+        print('feed gateway listening on %s:%d' %
+              (self.options.host, self.options.port), flush=True)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.subscribe(),
+                                 self.keepalive())
+
+
+def raise_file_limit():
+    """
+    Description: Raise this process' open files limit to its hard limit, each
+                 connection is a file descriptor.
+
+    Arguments:   None
+    Return:      (int) open files limit
+
+    Author:      Nnoduka Eruchalu
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Server-Sent Events gateway for the realtime feed')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--backlog', type=int, default=1024,
+                        help='listen backlog, for bursts of connections')
+    parser.add_argument('--secret', default=os.environ.get('FEED_TOKEN_SECRET'),
+                        help='FEED_TOKEN_SECRET of the Django settings')
+    # REDIS_HOST and REDIS_PORT of the Django settings
+    parser.add_argument('--redis-host',
+                        default=os.environ.get('REDIS_HOST', '127.0.0.1'))
+    parser.add_argument('--redis-port', type=int,
+                        default=int(os.environ.get('REDIS_PORT', 25373)))
+    parser.add_argument('--channel', default='feed',
+                        help='ACTIVITY_REDIS_CHANNEL of the Django settings')
+    parser.add_argument('--allow-origin', default='*',
+                        help='origin allowed to read the event streams')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='max events queued per connection')
+    parser.add_argument('--max-drops', type=int, default=256,
+                        help='events a connection can drop between writes '
+                        'before it is disconnected')
+    parser.add_argument('--coalesce', type=float, default=0.05,
+                        help='seconds to wait for more events before a write')
+    parser.add_argument('--keepalive', type=float, default=25,
+                        help='seconds between keepalives on idle connections')
+    parser.add_argument('--retry', type=int, default=5000,
+                        help='milliseconds browsers wait to reconnect')
+    parser.add_argument('--request-timeout', type=float, default=10,
+                        help='seconds to wait for a request')
+    options = parser.parse_args(args)
+    if not options.secret:
+        parser.error('--secret or FEED_TOKEN_SECRET is required')
+    return options
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    print('open files limit: %d' % raise_file_limit(), flush=True)
+    try:
+        asyncio.run(Gateway(options).serve())
+    except KeyboardInterrupt:
+        pass
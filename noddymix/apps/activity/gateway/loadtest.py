@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Description:
+  Load test of the Server-Sent Events feed gateway (gateway.py).
+
+  Opens `--connections` event streams to the gateway, each with a feed token
+  for a user following `--follows` random users out of `--users`, then
+  publishes activity messages to the feed's redis channel at `--rate`
+  messages a second for `--duration` seconds. Every message's data is the
+  time it was published, so each event received gives a delivery latency.
+
+  Reports how many streams connected, how many events were expected and
+  received, the delivery latency percentiles and the gateway's counters.
+  Expected events that weren't received were dropped by the gateway for a
+  slow client, or were still on their way when the test stopped.
+
+  Most systems limit a process to 1024 open files, so raise it first, for
+  both the gateway and this script:
+    ulimit -n 65536
+    python3 loadtest.py --secret <FEED_TOKEN_SECRET> --connections 20000
+  Past ~28000 connections from one address the client runs out of local
+  ports; spread them over addresses with `--source` (e.g. 127.0.0.2,
+  127.0.0.3 on linux's loopback).
+
+Table Of Contents:
+  - make_feed_token: make a feed token, like make_feed_token in utils.py
+  - LoadTest:        the load test
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from gateway import raise_file_limit
+import argparse, asyncio, base64, collections, hashlib, hmac, json, os, \
+    random, time
+
+
+def make_feed_token(user_id, followed_ids, secret, timeout=3600):
+    """
+    Description: Make a signed feed token, the same as make_feed_token of the
+                 Django app
+
+    Arguments:   - user_id:      id of subscribing user
+                 - followed_ids: ids of users they follow
+                 - secret:       (bytes) FEED_TOKEN_SECRET
+                 - timeout:      seconds the token is valid for
+    Return:      (str) token
+
+    Author:      Nnoduka Eruchalu
+    """
+    payload = base64.urlsafe_b64encode(json.dumps(
+            {'u':user_id,
+             'f':sorted(followed_ids),
+             'e':int(time.time()) + timeout},
+            separators=(',', ':')).encode('utf-8'))
+    signature = hmac.new(secret, payload, hashlib.sha256).hexdigest()
+    return '%s.%s' % (payload.decode('ascii'), signature)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class LoadTest(object):
+    """
+    Description: Load test of the feed gateway
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.secret = options.secret.encode('utf-8')
+        # room (followed user id) -> number of streams subscribed to it
+        self.subscribers = collections.Counter()
+        self.connected = 0
+        self.failed = 0
+        self.closed = 0
+        self.expected = 0
+        self.latencies = []
+
+
+    async def stream(self, index, ready):
+        """
+        Description: Open one event stream and record the latency of each
+                     event it receives
+
+        Arguments:   - index: index of stream, used as its user id
+                     - ready: asyncio.Semaphore limiting concurrent connects
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        rooms = random.sample(range(1, self.options.users + 1),
+                              min(self.options.follows, self.options.users))
+        token = make_feed_token(index, rooms, self.secret)
+        sources = self.options.source
+        source = (sources[index % len(sources)], 0) if sources else None
+
+        writer = None
+        try:
+            async with ready:
+                reader, writer = await asyncio.open_connection(
+                    self.options.host, self.options.port, local_addr=source)
+                writer.write(('GET /feed?token=%s HTTP/1.1\r\n'
+                              'Host: %s\r\n'
+                              'Accept: text/event-stream\r\n\r\n' %
+                              (token, self.options.host)).encode('ascii'))
+                head = await reader.readuntil(b'\r\n\r\n')
+            if not head.startswith(b'HTTP/1.1 200'):
+                raise ConnectionError(head.split(b'\r\n', 1)[0].decode())
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            self.failed += 1
+            if writer is not None:
+                writer.close()
+            return
+
+        self.connected += 1
+        self.subscribers.update(rooms)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    self.closed += 1
+                    break
+                if line.startswith(b'data: '):
+                    self.latencies.append(time.time() - float(line[6:]))
+        except (OSError, ConnectionError, ValueError):
+            self.closed += 1
+        finally:
+            writer.close()
+
+
+    async def publish(self):
+        """
+        Description: Publish timestamped messages to random rooms at the
+                     test's rate, for the test's duration
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        reader, writer = await asyncio.open_connection(
+            self.options.redis_host, self.options.redis_port)
+        channel = self.options.channel.encode('utf-8')
+        interval = 1.0 / self.options.rate
+        deadline = time.time() + self.options.duration
+        next_at = time.time()
+        while time.time() < deadline:
+            room = random.randint(1, self.options.users)
+            message = json.dumps({'room':room,
+                                  'data':repr(time.time())}).encode('utf-8')
+            writer.write(b'*3\r\n$7\r\nPUBLISH\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n'
+                         % (len(channel), channel, len(message), message))
+            await writer.drain()
+            # PUBLISH replies with the number of redis subscribers
+            await reader.readline()
+            self.expected += self.subscribers[room]
+
+            next_at += interval
+            await asyncio.sleep(max(0, next_at - time.time()))
+        writer.close()
+
+
+    async def status(self):
+        reader, writer = await asyncio.open_connection(self.options.host,
+                                                       self.options.port)
+        writer.write(b'GET /status HTTP/1.1\r\nHost: gateway\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+    async def run(self):
+        """
+        Description: Run the load test and print its report
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        ready = asyncio.Semaphore(self.options.concurrency)
+        started = time.time()
+        streams = [asyncio.ensure_future(self.stream(index, ready))
+                   for index in range(1, self.options.connections + 1)]
+        while self.connected + self.failed < self.options.connections:
+            await asyncio.sleep(0.5)
+        print('connected %d streams (%d failed) in %.1fs' %
+              (self.connected, self.failed, time.time() - started), flush=True)
+
+        await self.publish()
+        # let the last events arrive
+        await asyncio.sleep(self.options.settle)
+        gateway_stats = await self.status()
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+        latencies = sorted(self.latencies)
+        print('streams closed by gateway: %d' % self.closed)
+        print('events expected: %d, received: %d' % (self.expected,
+                                                      len(latencies)))
+        print('latency ms: p50 %.1f, p90 %.1f, p99 %.1f, max %.1f' %
+              tuple(1000 * percentile(latencies, fraction)
+                    for fraction in (0.5, 0.9, 0.99, 1)))
+        print('gateway: %s' % json.dumps(gateway_stats, sort_keys=True))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Load test of the realtime feed gateway')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--source', action='append',
+                        help='local address to connect from, repeatable')
+    parser.add_argument('--secret', required=True,
+                        help='FEED_TOKEN_SECRET the gateway was started with')
+    # REDIS_HOST and REDIS_PORT of the Django settings
+    parser.add_argument('--redis-host',
+                        default=os.environ.get('REDIS_HOST', '127.0.0.1'))
+    parser.add_argument('--redis-port', type=int,
+                        default=int(os.environ.get('REDIS_PORT', 25373)))
+    parser.add_argument('--channel', default='feed')
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=500,
+                        help='max connections being opened at once')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='number of users that can be followed')
+    parser.add_argument('--follows', type=int, default=20,
+                        help='number of users each stream follows')
+    parser.add_argument('--rate', type=float, default=100,
+                        help='messages published a second')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to publish for')
+    parser.add_argument('--settle', type=float, default=2,
+                        help='seconds to wait for events after publishing')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    print('open files limit: %d' % raise_file_limit(), flush=True)
+    asyncio.run(LoadTest(options).run())
@@ -83,6 +83,8 @@ class Activity(models.Model):
     
     class Meta:
         ordering=('-date_added',)
+        # a user's activities are listed newest first
+        index_together=[('actor', 'date_added')]
     
     
     def __unicode__(self):
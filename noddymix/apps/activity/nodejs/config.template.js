@@ -14,4 +14,8 @@ config.db.database = 'mysql_db_name';
 config.db.user = 'mysql_db_username';
 config.db.password = 'mysql_db_password';
 
+// key verifying feed subscription tokens. This must match FEED_TOKEN_SECRET in
+// settings_secret.py
+config.feed_token_secret = 'random string shared with Django';
+
 module.exports = config;
\ No newline at end of file
@@ -9,7 +9,9 @@ var app = require('http').createServer().listen(16637);
 var io = require('socket.io').listen(app);
 var redis = require('redis');
 var mysql = require('mysql');
-var exec = require('child_process').exec;
+var spawn = require('child_process').spawn;
+var readline = require('readline');
+var crypto = require('crypto');
 var cwd = require('path').dirname(require.main.filename);
 var config = require('./config')
 
@@ -38,6 +40,136 @@ sub.on('ready', function() {
     sub.subscribe('feed');
 });
 
+// a subscribed client can't run other commands, so use another client for 
+// reading the social graph cache [see apps/relationship/graph.py]. 
+var graph = redis.createClient(redis_connection.port, 
+                               redis_connection.hostname);
+graph.on('error', function(err) {
+    // fall back to the database while redis is unavailable
+});
+
+// key of the set of ids of users followed by a user
+function following_key(user_id) {
+    return 'graph:following:' + user_id;
+}
+
+
+// session_data is decoded by a long-lived python process [see session_decode.py]
+// instead of starting an interpreter for each subscribe. Decode requests made
+// within `decode_batch_wait` ms of each other are sent as one batch.
+var decoder = null;
+var decode_batch_wait = 5;
+var decode_batch = [];      // [session_key, session_data, callback] of each
+var decode_pending = {};    // request id -> decode batch awaiting response
+var decode_next_id = 1;
+
+// fail the pending decode requests with ids below `max_id` (all of them if
+// it's null), so their callbacks release their mysql connections
+function fail_pending(max_id, err) {
+    for (var id in decode_pending) {
+        if (max_id !== null && Number(id) >= max_id) continue;
+        var batch = decode_pending[id];
+        delete decode_pending[id];
+        for (var i=0; i<batch.length; i++) {
+            batch[i][2](err);
+        }
+    }
+}
+
+// start the session decoding process, and hook up its responses
+function start_decoder() {
+    var proc = spawn('python2.7', [cwd+'/session_decode.py', '--serve']);
+    decoder = proc;
+    
+    // the process answers requests in order, so a response also means any
+    // older request still pending never got its answer
+    readline.createInterface({input:proc.stdout, terminal:false})
+    .on('line', function(line) {
+        try {
+            var response = JSON.parse(line);
+        } catch (err) {
+            response = null;
+        }
+        var batch = response ? decode_pending[response.id] : null;
+        if (!batch || !response.user_ids) {
+            fail_pending(null, new Error('bad session decoder response'));
+            return;
+        }
+        delete decode_pending[response.id];
+        fail_pending(response.id, new Error('session decode request lost'));
+        for (var i=0; i<batch.length; i++) {
+            var user_id = response.user_ids[batch[i][0]];
+            batch[i][2](null, user_id ? user_id : null);
+        }
+    });
+    
+    // if the process dies, fail its pending requests. It's restarted on the
+    // next request.
+    var stop = function() {
+        if (decoder !== proc) return;
+        decoder = null;
+        fail_pending(null, new Error('session decoder stopped'));
+    };
+    proc.on('exit', stop);
+    proc.on('error', stop);
+    proc.stdin.on('error', stop);
+}
+
+// send the batched decode requests to the session decoding process
+function send_decode_batch() {
+    var batch = decode_batch;
+    decode_batch = [];
+    if (!decoder) start_decoder();
+    
+    var id = decode_next_id++;
+    var sessions = [];
+    for (var i=0; i<batch.length; i++) {
+        sessions.push([batch[i][0], batch[i][1]]);
+    }
+    decode_pending[id] = batch;
+    decoder.stdin.write(JSON.stringify({id:id, sessions:sessions}) + '\n');
+}
+
+// get the id of the user of a session, or null if the user isn't logged in.
+// callback is called as callback(err, user_id)
+function decode_session(session_key, session_data, callback) {
+    decode_batch.push([session_key, session_data, callback]);
+    if (decode_batch.length == 1) {
+        setTimeout(send_decode_batch, decode_batch_wait);
+    }
+}
+
+
+// verify a feed subscription token signed by Django [see make_feed_token in
+// apps/activity/utils.py]. Returns the token's payload,
+//   {u: user id, f: [ids of followed users], e: expiry unix time}
+// or null if the token is forged or expired.
+function verify_feed_token(token) {
+    if (typeof token !== 'string') return null;
+    var parts = token.split('.');
+    if (parts.length != 2) return null;
+    
+    var signature = crypto.createHmac('sha256', config.feed_token_secret)
+        .update(parts[0]).digest('hex');
+    // compare in constant time, so the signature can't be guessed by timing
+    if (signature.length != parts[1].length) return null;
+    var diff = 0;
+    for (var i=0; i<signature.length; i++) {
+        diff |= signature.charCodeAt(i) ^ parts[1].charCodeAt(i);
+    }
+    if (diff) return null;
+    
+    try {
+        var payload = JSON.parse(new Buffer(
+            parts[0].replace(/-/g, '+').replace(/_/g, '/'), 'base64')
+                                 .toString());
+    } catch (err) {
+        return null;
+    }
+    if (!payload.e || payload.e*1000 < Date.now()) return null;
+    return payload;
+}
+
 
 // Configure socket.io
 io.configure(function(){
@@ -68,7 +200,18 @@ var iofeed = io.of('/feed')
     // when client is ready to subscribe to rooms of user's followings,
     // get those channels, and join this socket to them.
     socket.on('subscribe', function(data) {
-    if ('sessionid' in data) {        
+    if ('token' in data) {
+        // a signed token lists the rooms to join, so no lookups are needed
+        var payload = verify_feed_token(data.token);
+        if (payload) {
+            for (var i=0; i<payload.f.length; i++) {
+                socket.join(payload.f[i]);
+            }
+        }
+        
+    } else if ('sessionid' in data) {
+        // older clients identify themselves by session, so look up the
+        // session's user and their followings
         var session_key = data.sessionid;
         
         // session key needs to be mapped to a user id
@@ -90,16 +233,15 @@ var iofeed = io.of('/feed')
                     // this session
                     if ((rows.length >= 1) && ('session_data' in rows[0])) {
                     // decode this session_data and get the user_id
-                    exec('python2.7 '+ cwd+'/session_decode.py ' 
-                         +rows[0].session_data,
-                         function (err, stdout, stderr) {
+                    decode_session(session_key, rows[0].session_data,
+                         function (err, user_id) {
                              if (err) {
+                                 // can't tell who this is, so no feed
                                  connection.release();
-                                 throw err;
+                                 return;
                              }
                              
-                             user_id = parseInt(stdout);
-                             // if user_id is NaN, then user isn't logged in
+                             // if user_id is null, then user isn't logged in
                              // so do nothing
                              if (user_id) { // note that user_id is 1-indexed
                                  // subscribe this socket, now identified by
@@ -107,7 +249,24 @@ var iofeed = io.of('/feed')
                                  // follows
                                  
                                  // first get all the ids of use followed by
-                                 // `user_id`
+                                 // `user_id`, from the graph cache if it
+                                 // has them. A cached set always holds the
+                                 // id 0, so an empty set means it's cold.
+                                 graph.smembers(
+                                     following_key(user_id),
+                                     function(err, members) {
+                                     if (!err && members.length) {
+                                         connection.release();
+                                         for (var i=0; i<members.length; i++) {
+                                             var followed_id = 
+                                                 parseInt(members[i]);
+                                             if (followed_id) {
+                                                 socket.join(followed_id);
+                                             }
+                                         }
+                                         return;
+                                     }
+                                     
                                  connection.query(
                                      "SELECT followed_id " +
                                          "FROM relationship_following "+
@@ -124,11 +283,12 @@ var iofeed = io.of('/feed')
                                              socket.join(rows[i].followed_id);
                                          }
                                      }); // end connection.query()
+                                 }); // end graph.smembers()
                                  
                              } else { // user isn't logged in so end
                                  connection.release();
                              } // end if-else(user_id)
-                         }); // end exec()
+                         }); // end decode_session()
                         
                     } else { // no session_data associated with session, so end
                         connection.release();
@@ -148,8 +308,12 @@ sub.on('message', function(channel, message) {
     //iofeed.volatile.emit('feedupdate', message);
     // only send update to sockets in the user's channel
     // use volatile because it's ok if messages are dropped
-    message = JSON.parse(message);
-    if (message.room) {
+    try {
+        message = JSON.parse(message);
+    } catch (err) {
+        return;
+    }
+    if (message && message.room) {
         iofeed.in(message.room).volatile.emit('feedupdate', message.data);
     }
 });
\ No newline at end of file
@@ -1,23 +1,146 @@
 """
 Description:
-  Decode Django's session_data which is passed in as first argument to script
- 
+  Decode Django's session_data to get the id of the session's user.
+
+  Run with `--serve` this is a long-lived service for feed.js, so a python
+  interpreter isn't started for every socket that subscribes. It reads one
+  JSON request per line on stdin and writes one JSON response per line on
+  stdout:
+    request:  {"id": <request id>, "sessions": [[session_key, session_data],..]}
+    response: {"id": <request id>, "user_ids": {session_key: user id or null}}
+  Decoded user ids are cached per session key for `--ttl` seconds, and reused
+  as long as the session_data is unchanged.
+
+  Run with session_data as first argument, this decodes that one session and
+  writes its user id to stdout.
+
+Table Of Contents:
+  - decode_user_id: get user id from session_data
+  - UserIdCache:    cache of user ids by session key
+  - serve:          run the line protocol service
+
 Author:
   Nnoduka Eruchalu
 """
 
-import base64
-from django.utils.encoding import force_bytes
-from django.utils.six.moves import cPickle as pickle
-import sys, getopt
+from collections import OrderedDict
+import cPickle as pickle
+import base64, json, sys, time, optparse
+
+
+def decode_user_id(session_data):
+    """
+    Description: Get the id of the user of a session from its session_data
+
+    Arguments:   - session_data: encoded session data from django_session
+    Return:      (int) user id, or None if the user isn't logged in or the
+                 session_data can't be decoded
+
+    Author:      Nnoduka Eruchalu
+    """
+    try:
+        encoded_data = base64.b64decode(session_data.encode('ascii'))
+        hash, serialized = encoded_data.split(b':', 1)
+        # sessions are JSON (see noddymix.sessions), or pickles if JSON
+        # couldn't represent them
+        if serialized[:1] == b'{':
+            res = json.loads(serialized)
+        else:
+            res = pickle.loads(serialized)
+        user_id = res.get('_auth_user_id')
+        return int(user_id) if user_id is not None else None
+    except Exception:
+        return None
+
+
+class UserIdCache(object):
+    """
+    Description: Cache of decoded user ids by session key. Entries expire
+                 after `ttl` seconds, are only used if the session_data is
+                 unchanged, and the oldest entries are dropped past
+                 `max_entries`.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # session key -> (session_data, user id, expiry time)
+        self.entries = OrderedDict()
+
+    def get_user_id(self, session_key, session_data):
+        """
+        Description: Get the user id of a session, decoding it if it isn't
+                     cached
+
+        Arguments:   - session_key:  key of session
+                     - session_data: encoded session data
+        Return:      (int) user id or None
+
+        Author:      Nnoduka Eruchalu
+        """
+        now = time.time()
+        entry = self.entries.get(session_key)
+        if entry is not None and entry[0] == session_data and entry[2] > now:
+            return entry[1]
+
+        user_id = decode_user_id(session_data)
+        self.entries.pop(session_key, None)
+        self.entries[session_key] = (session_data, user_id, now + self.ttl)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return user_id
+
+
+def serve(cache, stdin, stdout):
+    """
+    Description: Answer decode requests, one JSON object per line, until
+                 stdin is closed.
+
+    Arguments:   - cache:  UserIdCache
+                 - stdin:  file to read requests from
+                 - stdout: file to write responses to
+    Return:      None
 
-session_data = sys.argv[1:]
+    Author:      Nnoduka Eruchalu
+    """
+    # readline instead of iterating over the file, which reads ahead and would
+    # hold back requests
+    for line in iter(stdin.readline, ''):
+        request = None
+        try:
+            request = json.loads(line)
+            user_ids = {}
+            for session_key, session_data in request['sessions']:
+                user_ids[session_key] = cache.get_user_id(session_key,
+                                                          session_data)
+            response = {'id':request['id'], 'user_ids':user_ids}
+        except (ValueError, KeyError, TypeError):
+            # a bad request still gets an answer, if it can be matched up
+            response = {'id':request.get('id') if isinstance(request, dict) 
+                        else None,
+                        'user_ids':{}}
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
 
-encoded_data = base64.b64decode(force_bytes(session_data))
-hash, pickled = encoded_data.split(b':', 1)
-res = pickle.loads(pickled)
-user_id = res.get('_auth_user_id')
 
-sys.stdout.write(str(user_id))
-sys.stdout.close()
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [--serve | session_data]')
+    parser.add_option('--serve', action='store_true', default=False,
+                      help='decode sessions read from stdin, one JSON '
+                      'request per line')
+    parser.add_option('--ttl', type='float', default=300,
+                      help='seconds decoded user ids are cached for')
+    parser.add_option('--max-entries', type='int', default=100000,
+                      help='max number of session keys cached')
+    options, args = parser.parse_args()
 
+    if options.serve:
+        serve(UserIdCache(options.ttl, options.max_entries),
+              sys.stdin, sys.stdout)
+    elif args:
+        sys.stdout.write(str(decode_user_id(args[0])))
+        sys.stdout.close()
+    else:
+        parser.error('session_data or --serve is required')
@@ -0,0 +1,382 @@
+"""
+Description:
+  Background publisher of realtime activity feed messages.
+
+  Requests only put the ids of new activities on a bounded in-process queue,
+  so they never touch redis or load an activity's actor, object or target. A
+  daemon thread takes batches of them off the queue, fans them out to
+  followers' timelines, loads them, and renders the html of those whose actor
+  makes their activity public and publishes it to the redis channel of the
+  realtime feed, over the process-wide redis connection pool.
+
+  Messages that can't be published, because redis is down or because the
+  queue is full, are appended to a spool file of this process in
+  `ACTIVITY_SPOOL_DIR`. While redis is down the thread doesn't try it for every
+  message, but pings it every `ACTIVITY_PUBLISH_RETRY_INTERVAL` seconds. Once
+  it's back every spool file is replayed, including those left by processes
+  that have since exited. Spooled messages older than `ACTIVITY_SPOOL_MAX_AGE`
+  seconds are stale for a realtime feed, so they are dropped on replay.
+
+  Spool files hold one JSON encoded list per line: [unix timestamp, message]
+  Activities that arrive while the queue is full are rendered and spooled in
+  the request, and miss their fan-out: timelines catch up on them when they
+  expire and are rebuilt.
+
+  Errors fanning out or rendering activities are logged. Each activity is
+  rendered on its own, so one that fails doesn't keep the rest of its batch
+  off the feed.
+
+Table Of Contents:
+  - render_message: render the feed message of an activity
+  - render_messages: render the feed messages of public activities
+  - Publisher:      background publisher thread
+  - get_publisher:  get the publisher thread of this process
+  - enqueue:        queue an activity to be published
+  - wait:           wait for queued activities to be published
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.template.loader import render_to_string
+from noddymix.utils import get_redis
+import Queue, glob, json, logging, os, threading, time, redis
+
+logger = logging.getLogger(__name__)
+
+# max number of queued activities handled together
+BATCH_SIZE = 100
+
+
+def render_message(act):
+    """
+    Description: Render the message of an activity published to the realtime
+                 feed
+
+    Arguments:   - act: Activity object instance
+    Return:      (str) JSON encoded message
+
+    Author:      Nnoduka Eruchalu
+    """
+    activity_html = render_to_string("activity/activity.html",
+                                     {'activity':act,
+                                      'no_activity_time':True,
+                                      'STATIC_URL':settings.STATIC_URL})
+    return json.dumps({"room":act.actor_id, "data":activity_html})
+
+
+def render_messages(activity_ids):
+    """
+    Description: Render the messages of activities published to the realtime
+                 feed, skipping those whose actor doesn't allow this.
+                 Activities are loaded with one query each for them and their
+                 actors, and one per type of object and target. Activities
+                 that fail to render are logged and skipped.
+
+    Arguments:   - activity_ids: list of ids of Activity objects
+    Return:      list of JSON encoded messages
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.activity.models import Activity
+    from noddymix.apps.activity.utils import prefetch_activities
+
+    activities = Activity.objects.select_related('actor').in_bulk(
+        activity_ids)
+    # only publish to live stream if actor allows this
+    messages = []
+    for act in prefetch_activities(
+        [activities[activity_id] for activity_id in activity_ids
+         if activity_id in activities and
+         activities[activity_id].actor.activity_public]):
+        try:
+            messages.append(render_message(act))
+        except Exception:
+            logger.exception('failed to render activity %d', act.id)
+    return messages
+
+
+class Publisher(threading.Thread):
+    """
+    Description: Daemon thread fanning out queued activities and publishing
+                 them to the realtime feed, and spooling those it can't
+                 publish.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self):
+        super(Publisher, self).__init__(name='activity-publisher')
+        self.daemon = True
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(settings.ACTIVITY_PUBLISH_QUEUE_SIZE)
+        self.conn = get_redis()
+        # time to next try redis, or None if it isn't known to be down
+        self.retry_at = None
+        # spool writes come from both requests and this thread
+        self.spool_lock = threading.Lock()
+
+
+    def spool_path(self):
+        return os.path.join(settings.ACTIVITY_SPOOL_DIR,
+                            'activity-%d.spool' % self.pid)
+
+
+    def spool(self, lines):
+        """
+        Description: Append messages to this process' spool file
+
+        Arguments:   - lines: list of spool file lines
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        with self.spool_lock:
+            if not os.path.isdir(settings.ACTIVITY_SPOOL_DIR):
+                os.makedirs(settings.ACTIVITY_SPOOL_DIR)
+            with open(self.spool_path(), 'a') as spool_file:
+                spool_file.writelines(lines)
+
+
+    def spool_message(self, message):
+        self.spool([json.dumps([time.time(), message]) + '\n'])
+
+
+    def put(self, activity):
+        """
+        Description: Queue an activity to be fanned out and published. If the
+                     queue is full the activity's message is spooled instead.
+
+        Arguments:   - activity: tuple of (activity id, actor id, date_added)
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        try:
+            self.queue.put_nowait(activity)
+        except Queue.Full:
+            for message in render_messages([activity[0]]):
+                self.spool_message(message)
+
+
+    def is_up(self):
+        """
+        Description: Is redis up? If it's known to be down, only ping it once
+                     it's time to retry, and replay the spool if it's back.
+
+        Arguments:   None
+        Return:      Boolean: True/False
+
+        Author:      Nnoduka Eruchalu
+        """
+        if self.retry_at is None:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        try:
+            self.conn.ping()
+        except redis.exceptions.RedisError:
+            self.down()
+            return False
+
+        self.retry_at = None
+        self.replay()
+        return self.retry_at is None
+
+
+    def down(self):
+        self.retry_at = time.time() + settings.ACTIVITY_PUBLISH_RETRY_INTERVAL
+
+
+    def publish(self, message):
+        """
+        Description: Publish a message to the realtime feed, spooling it if
+                     redis is down.
+
+        Arguments:   - message: JSON encoded message
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        if self.is_up():
+            try:
+                self.conn.publish(settings.ACTIVITY_REDIS_CHANNEL, message)
+                return
+            except redis.exceptions.RedisError:
+                self.down()
+        self.spool_message(message)
+
+
+    def replay(self):
+        """
+        Description: Publish the messages of every spool file. Each file is
+                     first claimed by renaming it, so a spool is only replayed
+                     by one process. If redis goes down again, the messages
+                     left are spooled again.
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        cutoff = time.time() - settings.ACTIVITY_SPOOL_MAX_AGE
+        for path in glob.glob(os.path.join(settings.ACTIVITY_SPOOL_DIR,
+                                           '*.spool')):
+            claimed_path = '%s.%d' % (path, self.pid)
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                # another process got to it first
+                continue
+
+            with open(claimed_path) as spool_file:
+                lines = spool_file.readlines()
+            for index, line in enumerate(lines):
+                try:
+                    spooled_at, message = json.loads(line)
+                except ValueError:
+                    continue
+                if spooled_at < cutoff:
+                    continue
+                try:
+                    self.conn.publish(settings.ACTIVITY_REDIS_CHANNEL, message)
+                except redis.exceptions.RedisError:
+                    self.down()
+                    self.spool(lines[index:])
+                    break
+            os.remove(claimed_path)
+
+            if self.retry_at is not None:
+                break
+
+
+    def handle(self, activities):
+        """
+        Description: Fan out a batch of activities to followers' timelines and
+                     publish their messages to the realtime feed. If the batch
+                     can't be loaded, its activities are loaded one at a time
+                     so only those that fail are skipped.
+
+        Arguments:   - activities: list of (activity id, actor id, date_added)
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        from noddymix.apps.activity.utils import fan_out
+        try:
+            fan_out(activities)
+        except Exception:
+            logger.exception('failed to fan out %d activities',
+                             len(activities))
+
+        activity_ids = [activity_id for activity_id, actor_id, date_added in
+                        activities]
+        try:
+            messages = render_messages(activity_ids)
+        except Exception:
+            logger.exception('failed to load %d activities', len(activities))
+            messages = []
+            for activity_id in activity_ids:
+                try:
+                    messages.extend(render_messages([activity_id]))
+                except Exception:
+                    logger.exception('failed to load activity %d',
+                                     activity_id)
+
+        for message in messages:
+            self.publish(message)
+
+
+    def run(self):
+        """
+        Description: Handle queued activities forever, in batches of those
+                     queued by the time the last batch is done. Spools left by
+                     earlier processes are replayed on start.
+
+        Arguments:   None
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        self.replay()
+        while True:
+            activities = [self.queue.get()]
+            while len(activities) < BATCH_SIZE:
+                try:
+                    activities.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                self.handle(activities)
+            except Exception:
+                # a bad activity mustn't stop the publisher
+                logger.exception('failed to publish %d activities',
+                                 len(activities))
+            finally:
+                for activity in activities:
+                    self.queue.task_done()
+
+            if self.queue.empty():
+                # don't hold on to a db connection while idle
+                connection.close()
+
+
+# publisher thread of this process, started on first use
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    """
+    Description: Get the publisher thread of this process, starting it if it
+                 isn't running. A forked process gets a thread of its own.
+
+    Arguments:   None
+    Return:      Publisher thread
+
+    Author:      Nnoduka Eruchalu
+    """
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None or _publisher.pid != os.getpid() or \
+                not _publisher.is_alive():
+            _publisher = Publisher()
+            _publisher.start()
+    return _publisher
+
+
+def enqueue(act):
+    """
+    Description: Queue an activity to be fanned out to followers' timelines
+                 and published to the realtime feed. This never blocks on
+                 redis, and only uses the activity's ids.
+
+    Arguments:   - act: Activity object instance
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    get_publisher().put((act.id, act.actor_id, act.date_added))
+
+
+def wait(timeout=None):
+    """
+    Description: Wait for the queued activities to be fanned out and
+                 published (or spooled).
+                 Short-lived processes, such as management commands, call this
+                 before exiting so their messages aren't lost with the thread.
+
+    Arguments:   - timeout: max seconds to wait, None to wait however long
+    Return:      Boolean: True if the queue was emptied
+
+    Author:      Nnoduka Eruchalu
+    """
+    if _publisher is None or _publisher.pid != os.getpid():
+        return True
+    deadline = None if timeout is None else time.time() + timeout
+    while _publisher.queue.unfinished_tasks:
+        if deadline is not None and time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
@@ -1,11 +1,27 @@
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
+Description:
+  Tests of the activity app.
 
-Replace this with more appropriate tests for your application.
+  Tests of the activity timelines use the local redis server (`REDIS_HOST`,
+  `REDIS_PORT`) as a stand-in for the production one, with their keys under a
+  `test:` prefix. They are skipped if it isn't running.
+
+Table Of Contents:
+  - SimpleTest:   demo test
+  - TimelineTest: precomputed activity timelines
+
+Author:
+  Nnoduka Eruchalu
 """
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from noddymix.apps.account.models import User
+from noddymix.apps.activity.models import Activity
+from noddymix.apps.activity import timeline
+from noddymix.apps.relationship.models import Following
+from datetime import datetime, timedelta
+import redis
 
 
 class SimpleTest(TestCase):
@@ -14,3 +30,124 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+@override_settings(TIMELINE_REDIS_KEY='test:timeline',
+                   RELATIONSHIP_REDIS_KEY='test:graph')
+class TimelineTest(TestCase):
+    """
+    Description: Tests of the precomputed activity timelines (timeline.py)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        try:
+            timeline.conn.ping()
+        except redis.exceptions.RedisError:
+            self.skipTest('local redis server is not running')
+        self.clear()
+        self.one, self.two, self.three = [
+            User.objects.create(username=username)
+            for username in ('one', 'two', 'three')]
+        # two and three follow one
+        Following.objects.follow(self.two, self.one)
+        Following.objects.follow(self.three, self.one)
+        self.now = datetime.now().replace(microsecond=0)
+
+    def tearDown(self):
+        self.clear()
+
+    def clear(self):
+        keys = timeline.conn.keys('test:timeline:*') + \
+            timeline.conn.keys('test:graph:*')
+        if keys:
+            timeline.conn.delete(*keys)
+
+    def act(self, actor, minutes_ago=0):
+        """
+        Description: Create an activity and fan it out, as the publisher does
+        """
+        act = Activity.objects.create(
+            actor=actor, verb='played',
+            date_added=self.now - timedelta(minutes=minutes_ago))
+        timeline.push([(act.id, act.actor_id, act.date_added)])
+        return act.id
+
+    def cached_ids(self, user_id):
+        return [int(activity_id) for activity_id in timeline.conn.zrevrange(
+                timeline.timeline_key(user_id), 0, -1)
+                if int(activity_id) != timeline.SENTINEL]
+
+
+    def test_cold_timeline_loads_from_db(self):
+        old = self.act(self.one, minutes_ago=2)
+        new = self.act(self.one, minutes_ago=1)
+        self.assertEqual(timeline.activity_ids(self.two.id, 10), [new, old])
+        self.assertTrue(timeline.conn.exists(
+                timeline.timeline_key(self.two.id)))
+
+    def test_fan_out_only_to_cached_timelines(self):
+        """
+        New activities are added to cached timelines, and cold ones are left
+        cold
+        """
+        timeline.ensure(self.two.id)
+        act = self.act(self.one)
+        self.assertEqual(self.cached_ids(self.two.id), [act])
+        self.assertFalse(timeline.conn.exists(
+                timeline.timeline_key(self.three.id)))
+        self.assertEqual(timeline.activity_ids(self.two.id, 10), [act])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_timeline_is_trimmed(self):
+        """
+        Timelines only keep their latest `TIMELINE_LENGTH` activities, and the
+        sentinel
+        """
+        timeline.ensure(self.two.id)
+        acts = [self.act(self.one, minutes_ago) for minutes_ago in (3, 2, 1)]
+        self.assertEqual(self.cached_ids(self.two.id), [acts[2], acts[1]])
+        self.assertEqual(timeline.conn.zscore(
+                timeline.timeline_key(self.two.id), timeline.SENTINEL), 0)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_celebrities_merged_on_read(self):
+        """
+        Activities of actors with too many followers aren't fanned out, but
+        are merged into timelines on read
+        """
+        Following.objects.follow(self.two, self.three)
+        timeline.ensure(self.two.id)
+        old = self.act(self.one, minutes_ago=2)
+        mid = self.act(self.three, minutes_ago=1)
+        new = self.act(self.one)
+        self.assertTrue(timeline.conn.sismember(timeline.celebrities_key(),
+                                                self.one.id))
+        self.assertEqual(self.cached_ids(self.two.id), [mid])
+        self.assertEqual(timeline.activity_ids(self.two.id, 10),
+                         [new, mid, old])
+        self.assertEqual(timeline.activity_ids(self.two.id, 2), [new, mid])
+
+    def test_private_actors_skipped(self):
+        """
+        Activities of actors that don't make their activity public are
+        neither fanned out nor loaded from the db
+        """
+        User.objects.filter(id=self.one.id).update(activity_public=False)
+        timeline.ensure(self.two.id)
+        self.act(self.one)
+        self.assertEqual(self.cached_ids(self.two.id), [])
+        self.assertEqual(timeline.activity_ids(self.two.id, 10), [])
+
+        timeline.invalidate(self.two.id)
+        self.assertEqual(timeline.activity_ids(self.two.id, 10), [])
+
+    def test_invalidate_followers(self):
+        timeline.ensure(self.two.id)
+        timeline.ensure(self.three.id)
+        timeline.invalidate_followers(self.one.id)
+        self.assertFalse(timeline.conn.exists(
+                timeline.timeline_key(self.two.id)))
+        self.assertFalse(timeline.conn.exists(
+                timeline.timeline_key(self.three.id)))
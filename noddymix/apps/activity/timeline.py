@@ -0,0 +1,217 @@
+"""
+Description:
+  Precomputed activity timelines kept in redis.
+
+  A user's timeline holds the ids of the latest activities of the users they
+  follow, so their recent activities feed is one range read of redis and one
+  multi-get of the Activity table instead of a scan over all their followings.
+  Timelines are redis sorted sets:
+    - `<key>:<user id>`: activity ids scored by the unix time they happened
+  Every cached timeline also holds the id 0 with a score of 0, so a user with
+  an empty timeline still has a set and a missing set means the timeline is
+  cold. Cold timelines are built from the db on first read, and expire after
+  `TIMELINE_CACHE_TIMEOUT` seconds.
+
+  New activities are fanned out on write to the timelines of the actor's
+  followers that are cached, and each timeline is capped at `TIMELINE_LENGTH`
+  activities. Actors with more than `TIMELINE_FANOUT_LIMIT` followers are too
+  costly to fan out, so they are added to the `<key>:celebrities` set instead
+  and their activities are merged into timelines on read.
+
+  Only activities of actors that make their activity public are put on
+  timelines. Following or unfollowing a user changes whose activities belong
+  on a timeline, so the follower's timeline is dropped and rebuilt on next
+  read, and a user changing their activity_public setting has the timelines
+  of all their followers dropped.
+
+Table Of Contents:
+  - push:         fan out new activities to followers' timelines
+  - invalidate:   drop a user's timeline
+  - invalidate_followers: drop the timelines of a user's followers
+  - activity_ids: ids of latest activities of users a user follows
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis
+from noddymix.apps.relationship import graph
+import time
+
+# redis connection used for timelines
+conn = get_redis()
+
+# id cached with every timeline, marking it as loaded
+SENTINEL = 0
+
+# add an activity to those of the given timelines that are cached, then trim
+# each to its latest activities (and the sentinel, which always ranks first)
+# KEYS: timelines, ARGV: score, activity id, timeline length
+zadd_if_cached = conn.register_script("""
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 1, -tonumber(ARGV[3])-1)
+    end
+end
+""")
+
+
+def timeline_key(user_id):
+    return '%s:%d' % (settings.TIMELINE_REDIS_KEY, user_id)
+
+def celebrities_key():
+    return '%s:celebrities' % settings.TIMELINE_REDIS_KEY
+
+
+def score(date_added):
+    """
+    Description: Get the timeline score of an activity
+
+    Arguments:   - date_added: datetime.datetime the activity happened
+    Return:      (float) unix time
+
+    Author:      Nnoduka Eruchalu
+    """
+    return time.mktime(date_added.timetuple())
+
+
+def push(activities):
+    """
+    Description: Fan out new activities to the cached timelines of their
+                 actors' followers. Activities of actors that don't make
+                 their activity public are skipped, and those of actors with
+                 too many followers are left to be merged in on read.
+
+    Arguments:   - activities: list of (activity id, actor id, date_added)
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.account.models import User
+    by_actor = {}
+    for activity_id, actor_id, date_added in activities:
+        by_actor.setdefault(actor_id, []).append((activity_id, date_added))
+    if not by_actor:
+        return
+    public_ids = set(User.objects.filter(
+            id__in=by_actor.keys(), activity_public=True).values_list(
+            'id', flat=True))
+
+    pipe = conn.pipeline(transaction=False)
+    for actor_id, actor_activities in by_actor.items():
+        if actor_id not in public_ids:
+            continue
+        if graph.num_followers(actor_id) > settings.TIMELINE_FANOUT_LIMIT:
+            conn.sadd(celebrities_key(), actor_id)
+            continue
+
+        keys = [timeline_key(user_id) for user_id in
+                graph.follower_ids(actor_id)]
+        if not keys:
+            continue
+        for activity_id, date_added in actor_activities:
+            zadd_if_cached(keys=keys, args=[score(date_added), activity_id,
+                                            settings.TIMELINE_LENGTH],
+                           client=pipe)
+    pipe.execute()
+
+
+def invalidate(user_id):
+    """
+    Description: Drop a user's timeline, so it is rebuilt on next read
+
+    Arguments:   - user_id: id of User
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    conn.delete(timeline_key(user_id))
+
+
+def invalidate_followers(user_id):
+    """
+    Description: Drop the timelines of a user's followers, such as when the
+                 user's activities stop or start belonging on them
+
+    Arguments:   - user_id: id of User
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    keys = [timeline_key(follower_id) for follower_id in
+            graph.follower_ids(user_id)]
+    if keys:
+        conn.delete(*keys)
+
+
+def latest(actor_ids, count):
+    """
+    Description: Get the latest activities of some users from the db, of
+                 those that make their activity public
+
+    Arguments:   - actor_ids: list of ids of Users that performed the activities
+                 - count:     max number of activities
+    Return:      list of (activity id, score) tuples
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.activity.models import Activity
+    if not actor_ids:
+        return []
+    return [(activity_id, score(date_added)) for activity_id, date_added in
+            Activity.objects.filter(
+            actor__in=actor_ids, actor__activity_public=True).values_list(
+            'id', 'date_added')[:count]]
+
+
+def ensure(user_id):
+    """
+    Description: Make sure a user's timeline is cached
+
+    Arguments:   - user_id: id of User
+    Return:      (str) key of timeline
+
+    Author:      Nnoduka Eruchalu
+    """
+    key = timeline_key(user_id)
+    if not conn.exists(key):
+        entries = latest(list(graph.following_ids(user_id)),
+                         settings.TIMELINE_LENGTH)
+        pipe = conn.pipeline()
+        pipe.delete(key)
+        pipe.zadd(key, 0, SENTINEL)
+        for activity_id, activity_score in entries:
+            pipe.zadd(key, activity_score, activity_id)
+        pipe.expire(key, settings.TIMELINE_CACHE_TIMEOUT)
+        pipe.execute()
+    return key
+
+
+def activity_ids(user_id, count):
+    """
+    Description: Get the ids of the latest activities of the users a user
+                 follows, newest first. The timeline is merged with the latest
+                 activities of followed users that aren't fanned out.
+
+    Arguments:   - user_id: id of User
+                 - count:   max number of activities
+    Return:      list of Activity ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    key = ensure(user_id)
+    pipe = conn.pipeline(transaction=False)
+    pipe.zrevrange(key, 0, count-1, withscores=True)
+    pipe.sinter(graph.ensure_following(user_id), celebrities_key())
+    entries, celebrities = pipe.execute()
+
+    entries = [(int(activity_id), activity_score) for activity_id,
+               activity_score in entries if int(activity_id) != SENTINEL]
+    if celebrities:
+        entries = dict(entries + latest([int(actor_id) for actor_id in
+                                         celebrities], count)).items()
+        entries.sort(key=lambda entry: (entry[1], entry[0]), reverse=True)
+
+    return [activity_id for activity_id, activity_score in entries[:count]]
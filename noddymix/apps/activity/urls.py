@@ -8,4 +8,8 @@ urlpatterns = patterns('',
                        #    name="activity"),
                        #url(r'^(?P<id>\d+)/delete/$', views.delete,
                        #    name='activity_delete'),
+                       url(r'^export/$', views.export,
+                           name="activity_export"),
+                       url(r'^feed-token/$', views.feed_token,
+                           name="feed_token"),
                        )
@@ -4,20 +4,24 @@ Description:
 
 Table Of Contents:
   - activity_handler: create activity instance on triggered by signal call
+  - fan_out:          add activities to the timelines of their actors' followers
+  - publish_activity: fan out and publish an activity in the background
+  - prefetch_activities: load the actors, objects and targets of activities
+  - make_feed_token:  sign a realtime feed subscription token
   
 Author: 
   Nnoduka Eruchalu
 """
 
-from django.template.loader import render_to_string
 from django.conf import settings
-import json, redis
+import base64, hashlib, hmac, json, time, redis
 
 def activity_handler(sender, **kwargs):
     """
     Description: Receiver function for activity signal. This callback creates an
-                 Activity object instance and publishes its details to the redis
-                 channel. This is start of the realtime activity stream pipeline
+                 Activity object instance and queues it to be fanned out to
+                 followers' timelines and published to the redis channel.
+                 This is start of the realtime activity stream pipeline
     
     Arguments:   - sender: signal sender
                  - **kwargs
@@ -45,20 +49,129 @@ def activity_handler(sender, **kwargs):
         act = Activity.objects.create(actor=actor, verb=verb, 
                                       object=object, target=target)
     
-    # Activity instance created... so publish to redis channel if possible
-    try:
-        if actor.activity_public:
-            # only publish to live stream if actor allows this
-            pub = redis.StrictRedis(host=settings.REDIS_HOST, 
-                                    port=settings.REDIS_PORT)
-            activity_html = render_to_string("activity/activity.html", 
-                                             {'activity':act, 
-                                              'no_activity_time':True,
-                                              'STATIC_URL':settings.STATIC_URL})
-            pub.publish(
-                settings.ACTIVITY_REDIS_CHANNEL,
-                json.dumps({"room":actor.id, "data":activity_html}))
+    # Activity instance created... so add it to followers' timelines and
+    # publish to redis channel if possible
+    publish_activity(act)
+
+
+def fan_out(activities):
+    """
+    Description: Add new activities to the precomputed timelines of their
+                 actors' followers, if redis is up. Timelines that miss an
+                 activity catch up when they expire and are rebuilt.
     
-    except redis.exceptions.ConnectionError:
+    Arguments:   - activities: list of (activity id, actor id, date_added)
+    Return:      None
+        
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.activity import timeline
+    try:
+        timeline.push(activities)
+    except redis.exceptions.RedisError:
         pass
-            
+
+
+def publish_activity(act):
+    """
+    Description: Queue an activity to be added to followers' timelines and
+                 published to the redis channel of the realtime activity
+                 stream, if the actor allows this. Fan-out, rendering and
+                 publishing happen on a background thread so the request never
+                 waits on redis, and only the activity's ids are queued.
+    
+    Arguments:   - act: Activity object instance
+    Return:      None
+        
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.activity import publisher
+    publisher.enqueue(act)
+
+
+def prefetch_activities(activities):
+    """
+    Description: Load the actors, objects and targets of a list of activities
+                 with one in_bulk query per model, instead of one query per
+                 activity for each. Activities are grouped by the content type
+                 of their objects and targets, and the loaded instances are
+                 attached to the activities' generic foreign key caches.
+                 Actors that are users also share a query with objects and
+                 targets that are users.
+                 Relations already loaded, such as with select_related, are
+                 left as is.
+    
+    Arguments:   - activities: list or QuerySet of Activity objects
+    Return:      list of Activity objects
+        
+    Author:      Nnoduka Eruchalu
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from noddymix.apps.account.models import User
+    
+    activities = list(activities)
+    
+    # gather ids of each model to load
+    ids_by_model = {}
+    generic_relations = []
+    for act in activities:
+        if not hasattr(act, '_actor_cache'):
+            ids_by_model.setdefault(User, set()).add(act.actor_id)
+        for name in ('object', 'target'):
+            content_type_id = getattr(act, name + '_content_type_id')
+            object_id = getattr(act, name + '_id')
+            cache_name = '_%s_cache' % name
+            if content_type_id is None or object_id is None or \
+                    hasattr(act, cache_name):
+                continue
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            if model is None:
+                # stale content type, so leave it to the generic foreign key
+                continue
+            ids_by_model.setdefault(model, set()).add(object_id)
+            generic_relations.append((act, cache_name, model, object_id))
+    
+    # one query per model
+    objects = {}
+    for model, ids in ids_by_model.items():
+        objects[model] = model._default_manager.in_bulk(list(ids))
+    
+    # attach them. Objects that no longer exist are None, as they would be
+    # when loaded one by one.
+    for act in activities:
+        if not hasattr(act, '_actor_cache') and \
+                act.actor_id in objects[User]:
+            act._actor_cache = objects[User][act.actor_id]
+    for act, cache_name, model, object_id in generic_relations:
+        setattr(act, cache_name, objects[model].get(object_id))
+    
+    return activities
+
+
+def make_feed_token(user_id, followed_ids):
+    """
+    Description: Make a signed token that lets a user subscribe to the realtime
+                 feed of the users they follow, without the feed server having
+                 to look the user up. The token is:
+                     <payload>.<signature>
+                 where payload is the url-safe base64 encoded JSON
+                     {"u": user id, "f": [followed user ids], "e": expiry}
+                 expiry is a unix time `FEED_TOKEN_TIMEOUT` seconds from now,
+                 and signature is the hex HMAC-SHA256 of payload keyed with
+                 `FEED_TOKEN_SECRET`, which the feed server also has.
+    
+    Arguments:   - user_id:      id of User subscribing
+                 - followed_ids: ids of Users they follow
+    Return:      (str) token
+        
+    Author:      Nnoduka Eruchalu
+    """
+    payload = base64.urlsafe_b64encode(json.dumps(
+            {'u':user_id,
+             'f':sorted(followed_ids),
+             'e':int(time.time()) + settings.FEED_TOKEN_TIMEOUT},
+            separators=(',', ':')))
+    signature = hmac.new(settings.FEED_TOKEN_SECRET, payload,
+                         hashlib.sha256).hexdigest()
+    return '%s.%s' % (payload, signature)
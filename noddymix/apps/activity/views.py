@@ -4,11 +4,20 @@ from django.template import RequestContext
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.contrib.auth.decorators import login_required
 from django.template.loader import render_to_string
-import urllib, json
+from django.http import StreamingHttpResponse
+from django.conf import settings
+import urllib, json, csv, redis
 
 from noddymix.apps.activity.models import Activity
 from noddymix.apps.account.models import User
 from noddymix.apps.audio.models import Song
+from noddymix.apps.activity.utils import prefetch_activities, make_feed_token
+from noddymix.apps.relationship.models import Following
+from noddymix.apps.relationship import graph
+from noddymix.utils import keyset_filter, keyset_helper
+
+# activities are listed newest first, and paginated by cursor on this ordering
+ACTIVITY_ORDERING = ['-date_added', '-id']
 
 def setup_activity_json(activity):
     """
@@ -51,6 +60,8 @@ def setup_activities_json(activities):
     """
     Description: Convert a querset of activities into a list of activities
                  where each activity is a json-formatted dictionary
+                 The activities' actors, objects and targets are loaded in
+                 bulk first.
     
     Arguments:   - activities: A QuerySet of activities
     Return:      a list of json representations of the passed in activities
@@ -58,7 +69,7 @@ def setup_activities_json(activities):
     Author:      Nnoduka Eruchalu
     """
     activities_json = []
-    for activity in activities:
+    for activity in prefetch_activities(activities):
         activities_json.append(setup_activity_json(activity))
     return activities_json
 
@@ -87,24 +98,171 @@ def activity(request, id):
 def activities_user(request, id):
     """
     Description: Render activities of a given user, where user is an actor.
-                 Mobile requests will be redirected to the home page.
+                 Activities are paginated by cursor (GET param `cursor`) so
+                 each page costs the same however long the user's history is,
+                 and can be limited to a verb (GET param `verb`).
+                 Ajax requests get a page of activities as json, for infinite
+                 scrolling. Mobile clients get json-formatted activities and
+                 desktop clients get rendered html.
+                 Mobile non-ajax requests will be redirected to the home page.
+                 Users that don't make their activity public only have it
+                 shown to themselves.
                  
     Arguments:   - request: HttpRequest object
                  - id:      Id of User of interest
-    Return:      HttpResponse object with activities page text
+    Return:      HttpResponse object with activities page text, or for ajax
+                 requests json data with keys:
+                 - activities:  json-formatted activities [mobile only]
+                 - content:     rendered activities [desktop only]
+                 - next_cursor: cursor of next page ['' if on last page]
     
     Todo:        Include activities when given user is the target
     Author:      Nnoduka Eruchalu
     """
     # a mobile page shouldn't make a direct request here
-    if request.mobile:
+    if request.mobile and not request.is_ajax():
         return HttpResponseRedirect('/')
     
     user = get_object_or_404(User, id=id)
+    if not user.activity_public and user != request.user:
+        raise Http404
+    
+    activities_list = user.activities.all()
+    verb = request.GET.get('verb', '')
+    if verb:
+        activities_list = activities_list.filter(verb=verb)
+    
+    context = keyset_helper(request, activities_list, ACTIVITY_ORDERING,
+                            settings.ACTIVITIES_PER_PAGE)
+    for activity in context['objects']:
+        activity._actor_cache = user
+    activities = prefetch_activities(context['objects'])
+    template_context = {'profile':user,
+                        'activities':activities,
+                        'next_cursor':context['next_cursor'],
+                        'verb':verb}
+    
+    if request.is_ajax():
+        data = {'next_cursor':context['next_cursor']}
+        if request.mobile:
+            data['activities'] = setup_activities_json(activities)
+        else:
+            data['content'] = render_to_string(
+                'activity/content_activities.html',
+                template_context,
+                context_instance=RequestContext(request))
+        json_response = json.dumps(data)
+        return HttpResponse(json_response, content_type="application/json")
+    
     return render_to_response('activity/activities.html',
-                              {'activities':user.activities.all()},
+                              template_context,
                               context_instance=RequestContext(request))
+
+
+class Echo(object):
+    """
+    Description: File-like object that returns what is written to it, so
+                 csv.writer rows can be streamed instead of buffered.
     
+    Author:      Nnoduka Eruchalu
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(user, activities_list):
+    """
+    Description: Generate the csv rows of a user's activities, newest first.
+                 Activities are read in batches of `ACTIVITY_EXPORT_BATCH_SIZE`
+                 using keyset pagination, so memory use doesn't grow with the
+                 size of the history.
+    
+    Arguments:   - user:            User that is the actor of the activities
+                 - activities_list: QuerySet of user's activities
+    Return:      generator of csv formatted lines
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(['date', 'verb', 'object', 'target'])
+    
+    activities_list = activities_list.order_by(*ACTIVITY_ORDERING)
+    batch_size = settings.ACTIVITY_EXPORT_BATCH_SIZE
+    batch_list = activities_list
+    while True:
+        activities = list(batch_list[:batch_size])
+        for activity in activities:
+            activity._actor_cache = user
+        for activity in prefetch_activities(activities):
+            obj, target = activity.object, activity.target
+            yield writer.writerow([
+                    activity.date_added.isoformat(),
+                    activity.verb.encode('utf-8'),
+                    unicode(obj).encode('utf-8') if obj is not None else '',
+                    unicode(target).encode('utf-8') if target is not None \
+                        else ''])
+        
+        if len(activities) < batch_size:
+            break
+        batch_list = keyset_filter(
+            activities_list, ACTIVITY_ORDERING,
+            [activities[-1].date_added, activities[-1].id])
+
+
+@login_required
+def export(request):
+    """
+    Description: Export the requesting user's activities as a csv file.
+                 The response is streamed, so it can be any size without 
+                 holding the user's whole history in memory.
+                 Can be limited to a verb (GET param `verb`).
+                 
+    Arguments:   - request: HttpRequest object
+    Return:      StreamingHttpResponse object with csv data
+    
+    Author:      Nnoduka Eruchalu
+    """
+    activities_list = request.user.activities.all()
+    verb = request.GET.get('verb', '')
+    if verb:
+        activities_list = activities_list.filter(verb=verb)
+    
+    response = StreamingHttpResponse(export_rows(request.user, activities_list),
+                                     content_type="text/csv")
+    response['Content-Disposition'] = \
+        'attachment; filename="noddymix-activities.csv"'
+    return response
+    
+
+def feed_token(request):
+    """
+    Description: Get a signed token for subscribing to the realtime feed of the
+                 requesting user's followings (see make_feed_token).
+                 The feed server verifies it with no database access.
+                 Should only be called via ajax.
+                 
+    Arguments:   - request: HttpRequest object
+    Return:      HttpResponse object with json data with key:
+                 - token: signed token ['' for anonymous users, who have no
+                          followings]
+    
+    Author:      Nnoduka Eruchalu
+    """
+    if not request.is_ajax():
+        raise Http404
+    
+    token = ''
+    if request.user.is_authenticated():
+        try:
+            followed_ids = graph.following_ids(request.user.id)
+        except redis.exceptions.RedisError:
+            followed_ids = Following.objects.filter(
+                follower=request.user).values_list('followed', flat=True)
+        token = make_feed_token(request.user.id, list(followed_ids))
+    
+    json_response = json.dumps({'token':token})
+    return HttpResponse(json_response, content_type="application/json")
+
 
 @login_required
 def delete(request, id):
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.conf import settings
 from django import forms
 from noddymix.apps.audio.models import Song, Album, Artist, Playlist, \
-    Playlist_Songs, SongPlay, SongRank
+    Playlist_Songs, SongPlay, SongPlayHour, SongRank
 
 
 def delete_selected_s(modeladmin, request, queryset):
@@ -261,6 +261,29 @@ class SongPlayAdmin(admin.ModelAdmin):
         return False
     
 
+class SongPlayHourAdmin(admin.ModelAdmin):
+    """
+    Description: Representation of the SongPlayHour model in the admin 
+                 interface.
+                                                      
+    Author:      Nnoduka Eruchalu
+    """
+    search_fields = ('song__title',)
+    list_display = ('song', 'hour', 'num_plays')
+    readonly_fields = ('song', 'hour', 'num_plays', 'last_play')
+
+    def has_add_permission(self, request): 
+        """
+        Description: Don't want users adding SongPlayHours through admin 
+          
+        Arguments:   - request: HttpRequest object representing current request
+        Return:      Boolean: False
+                    
+        Author:      Nnoduka Eruchalu
+        """
+        return False
+    
+
 class SongRankAdmin(admin.ModelAdmin):
     """
     Description: Representation of the SongRank model in the admin interface.
@@ -289,4 +312,5 @@ admin.site.register(Artist, ArtistAdmin)
 admin.site.register(Playlist, PlaylistAdmin)
 admin.site.register(Playlist_Songs, Playlist_SongsAdmin)
 admin.site.register(SongPlay, SongPlayAdmin)
+admin.site.register(SongPlayHour, SongPlayHourAdmin)
 admin.site.register(SongRank, SongRankAdmin)
@@ -0,0 +1,168 @@
+"""
+Description:
+  Album art derivatives generated ahead of page renders.
+
+  Saving an album's art doesn't generate its derivatives (imagekit specs) in
+  the request: the art file is only added to the `ALBUM_ART_REDIS_KEY` redis
+  set of pending art. The generate_albumart command, run every few minutes by
+  cron with --pending, then generates their derivatives in a pool of worker
+  processes, so no request waits on image processing and web processes never
+  fork workers. Run without --pending it backfills any derivatives that are
+  missing, such as those of art saved while redis was down.
+
+  Until then, derivatives of queued art are checked for on storage, and
+  generated in-process if missing, so pages rendered right after a save don't
+  link to derivatives that don't exist yet.
+
+  Workers are only handed the art file's name: the derivatives' names and
+  contents only depend on the source file, so workers never touch the db and
+  never see an uncommitted album.
+
+Table Of Contents:
+  - DeferredStrategy: imagekit cachefile strategy that leaves generation to
+                      the generate_albumart command
+  - generate_art:     generate derivatives of an album art file
+  - queue_art:        queue an album art file to have its derivatives
+                      generated
+  - is_pending:       check if an art file is queued
+  - pending_art:      names of art files queued
+  - done_art:         take art files off the queue
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis
+import redis
+
+# names of the Album imagekit specs
+ART_SPECS = ('art_small', 'art_thumbnail', 'art_mobile_small',
+             'art_mobile_thumbnail', 'art_display')
+
+# redis connection used for the queue of pending art
+conn = get_redis()
+
+
+class DeferredStrategy(object):
+    """
+    Description: imagekit cachefile strategy for album art derivatives.
+                 Like the Optimistic strategy, derivatives are assumed to
+                 exist, but they aren't generated on source save as the Album
+                 model queues them for the generate_albumart command.
+                 Derivatives of art still on the queue are checked for, and
+                 generated in-process if missing, as are derivatives whose
+                 content is actually needed.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def on_content_required(self, file):
+        file.generate()
+
+    def on_existence_required(self, file):
+        if self.source_pending(file):
+            file.generate()
+
+    def should_verify_existence(self, file):
+        return self.source_pending(file)
+
+    def source_pending(self, file):
+        """
+        Description: Check if a derivative's art file is still queued, only
+                     asking redis once per derivative file.
+
+        Arguments:   - file: imagekit ImageCacheFile of the derivative
+        Return:      Boolean
+
+        Author:      Nnoduka Eruchalu
+        """
+        pending = getattr(file, '_source_pending', None)
+        if pending is None:
+            try:
+                pending = is_pending(file.generator.source.name)
+            except redis.exceptions.RedisError:
+                # assume the derivatives exist, as the Optimistic strategy does
+                pending = False
+            file._source_pending = pending
+        return pending
+
+
+def generate_art(art_name, force=False):
+    """
+    Description: Generate the derivatives of an album art file that don't
+                 exist yet on storage.
+
+    Arguments:   - art_name: name of the art file on storage
+                 - force:    regenerate derivatives even if they exist
+    Return:      tuple of (art file name, number of derivatives generated,
+                 error message or None)
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.audio.models import Album
+
+    # an unsaved album is enough to name and build the derivatives
+    album = Album(art=art_name)
+    num_generated = 0
+    try:
+        for spec in ART_SPECS:
+            art_file = getattr(album, spec)
+            if force or not art_file.storage.exists(art_file.name):
+                art_file.generate(force=True)
+                num_generated += 1
+    except Exception as e:
+        return art_name, num_generated, str(e)
+
+    return art_name, num_generated, None
+
+
+def queue_art(art_name):
+    """
+    Description: Queue an album art file to have its derivatives generated by
+                 the generate_albumart command.
+
+    Arguments:   - art_name: name of the art file on storage
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    conn.sadd(settings.ALBUM_ART_REDIS_KEY, art_name)
+
+
+def is_pending(art_name):
+    """
+    Description: Check if an album art file is queued by queue_art
+
+    Arguments:   - art_name: name of the art file on storage
+    Return:      Boolean
+
+    Author:      Nnoduka Eruchalu
+    """
+    return bool(conn.sismember(settings.ALBUM_ART_REDIS_KEY, art_name))
+
+
+def pending_art():
+    """
+    Description: Get the names of album art files queued by queue_art
+
+    Arguments:   None
+    Return:      list of art file names
+
+    Author:      Nnoduka Eruchalu
+    """
+    return list(conn.smembers(settings.ALBUM_ART_REDIS_KEY))
+
+
+def done_art(art_names):
+    """
+    Description: Take album art files off the queue, once their derivatives
+                 have been generated.
+
+    Arguments:   - art_names: list of art file names
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    if art_names:
+        conn.srem(settings.ALBUM_ART_REDIS_KEY, *art_names)
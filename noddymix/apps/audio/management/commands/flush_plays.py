@@ -0,0 +1,97 @@
+"""
+Description:
+  Manangement command module for writing the song plays buffered in redis to
+  the db. Runs forever, flushing every `PLAY_BUFFER_FLUSH_INTERVAL` seconds,
+  unless told to flush once.
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from noddymix.apps.audio import playbuffer
+from noddymix.apps.activity import publisher
+from django.conf import settings
+from optparse import make_option
+import time, redis
+
+
+class Command(BaseCommand):
+    help = 'write buffered song plays to the db'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='Flush all buffered song plays then exit'),
+        make_option('--interval',
+                    type='float',
+                    dest='interval',
+                    default=settings.PLAY_BUFFER_FLUSH_INTERVAL,
+                    help='Seconds between flushes'),
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=settings.PLAY_BUFFER_BATCH_SIZE,
+                    help='Max song plays written in one transaction'),
+        )
+
+    def handle(self, *args, **options):
+        """
+        Description: Drain the song play buffer in batches, reporting the
+                     number of song plays flushed, how long that took and the
+                     number of song plays still queued.
+
+        Arguments:   *args, **options
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        # the last run could have been stopped in the middle of a flush
+        try:
+            num_events = playbuffer.recover()
+            if num_events:
+                self.stdout.write('recovered %d song plays' % num_events)
+        except redis.exceptions.RedisError:
+            raise CommandError('redis server is unavailable')
+
+        while True:
+            try:
+                self.drain(options['batch_size'])
+            except redis.exceptions.RedisError:
+                if options['once']:
+                    raise CommandError('redis server is unavailable')
+                self.stderr.write('redis server is unavailable')
+
+            if options['once']:
+                # let the realtime feed messages go out before exiting
+                publisher.wait()
+                break
+
+            # don't hold on to a db connection while idle
+            connection.close()
+            time.sleep(options['interval'])
+
+
+    def drain(self, batch_size):
+        """
+        Description: Flush batches of buffered song plays until the buffer is
+                     empty.
+
+        Arguments:   - batch_size: max number of song plays per batch
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        while True:
+            start = time.time()
+            num_plays = playbuffer.flush(batch_size)
+            if not num_plays:
+                break
+
+            self.stdout.write('flushed %d song plays in %.1fms, %d queued' % (
+                    num_plays, (time.time() - start)*1000, playbuffer.depth()))
+            if num_plays < batch_size:
+                break
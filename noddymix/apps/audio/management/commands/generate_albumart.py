@@ -0,0 +1,114 @@
+"""
+Description:
+  Manangement command module for generating the art derivatives (thumbnails
+  etc) of each Album object in db, or of the album art queued by Album saves
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from noddymix.apps.audio.models import Album
+from noddymix.apps.audio.artwork import generate_art, pending_art, done_art
+from django.conf import settings
+from optparse import make_option
+import multiprocessing, redis
+
+
+def generate_art_star(args):
+    """
+    Description: Pool.imap_unordered only passes one argument to its function,
+                 so unpack arguments for generate_art.
+
+    Arguments:   - args: tuple of generate_art arguments
+    Return:      generate_art return value
+
+    Author:      Nnoduka Eruchalu
+    """
+    return generate_art(*args)
+
+
+class Command(BaseCommand):
+    args = '[album_id album_id ...]'
+    help = 'generate missing album art derivatives'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Regenerate derivatives that already exist'),
+        make_option('--pending',
+                    action='store_true',
+                    dest='pending',
+                    default=False,
+                    help='Only generate derivatives of queued album art'),
+        make_option('--workers',
+                    type='int',
+                    dest='workers',
+                    default=settings.ALBUM_ART_WORKERS,
+                    help='Number of worker processes'),
+        )
+
+    def handle(self, *args, **options):
+        """
+        Description: Generate the art derivatives of all albums, or those with
+                     given ids, that don't exist yet on storage, in a pool of
+                     worker processes.
+                     With --pending only generate the derivatives of art
+                     queued by Album saves, and take it off the queue. Run
+                     this every few minutes by cron.
+                     Run this without options to backfill the catalog after
+                     deploying.
+
+        Arguments:   *args, **options
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        if options['pending']:
+            try:
+                queued = pending_art()
+            except redis.exceptions.RedisError as e:
+                raise CommandError('redis is unavailable: %s' % e)
+        else:
+            albums = Album.objects.exclude(art='')
+            if args:
+                try:
+                    albums = albums.filter(id__in=[int(arg) for arg in args])
+                except ValueError:
+                    raise CommandError('album ids must be integers')
+            queued = albums.values_list('art', flat=True).order_by()
+
+        art_names = [(art_name, options['force']) for art_name in queued]
+        if not art_names:
+            return
+
+        art_storage = Album._meta.get_field('art').storage
+        pool = multiprocessing.Pool(max(1, options['workers']))
+        try:
+            num_generated = 0
+            done = []
+            for art_name, generated, error in pool.imap_unordered(
+                generate_art_star, art_names):
+                if error is None:
+                    done.append(art_name)
+                elif options['pending'] and not art_storage.exists(art_name):
+                    # art replaced or deleted before its derivatives were
+                    # generated, so there is nothing left to retry
+                    self.stderr.write('dropped: %s: art no longer exists' %
+                                      art_name)
+                    done.append(art_name)
+                else:
+                    self.stderr.write('error: %s: %s' % (art_name, error))
+                num_generated += generated
+        finally:
+            pool.close()
+            pool.join()
+
+        # art that failed stays queued, to be retried on the next run
+        if options['pending']:
+            done_art(done)
+
+        self.stdout.write('generated %d art derivatives of %d albums' % (
+                num_generated, len(art_names)))
@@ -8,19 +8,29 @@ Author:
 """
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
 from noddymix.apps.audio.models import Song, SongPlay, SongRank
 from django.conf import settings
+from optparse import make_option
 import datetime
-from collections import Counter
 
 
 class Command(BaseCommand):
     help = 'update all song rank scores'
     
+    option_list = BaseCommand.option_list + (
+        make_option('--incremental',
+                    action='store_true',
+                    dest='incremental',
+                    default=False,
+                    help='Only recount songs played since the last run'),
+        )
+    
     def handle(self, *args, **options):
         """
-        Description: Clear all song ranks, get all songs played in the time
-                     range used for heavy rotation and set their new scores.
+        Description: Get all songs played in the time range used for heavy
+                     rotation and set their new scores.
                      The algorithm is somewhat based on the ranking performed by
                      Hacker News where each song played in the last 
                      `HEAVY_ROTATION_DAYS` days is scored using the formula:
@@ -30,42 +40,62 @@ class Command(BaseCommand):
                        T = time since last song play
                        G = Gravity
                      Reference: http://amix.dk/blog/post/19574
+                     
+                     Play counts and last play times are aggregated by the
+                     database, and the new song ranks replace the old ones in
+                     a single transaction so heavy rotation is never empty
+                     while this runs.
+                     
+                     With --incremental only the play counts of songs with
+                     plays recorded since the last run are recounted. Every
+                     other song rank is rescored from its stored play count
+                     and last play time, and dropped once its last play leaves
+                     heavy rotation. Plays aging out of the window aren't
+                     taken off the stored counts, so this should still be run
+                     without --incremental every so often.
                                  
         Arguments:   *args, **options
         Return:      None
         
         Author:      Nnoduka Eruchalu
         """
-        # clear all song ranks
-        SongRank.objects.all().delete()
-        
         # want to use same value of now() everywhere
         now = datetime.datetime.now() 
         
         # heavily rotated songs are those with top scores in the last few days
         start_date = now - datetime.timedelta(days=settings.HEAVY_ROTATION_DAYS)
     
+        # newest song play being counted. This is by id rather than date, as
+        # buffered plays (see playbuffer.py) are recorded after they happen
+        last_songplay_id = SongPlay.objects.aggregate(Max('id'))['id__max'] or 0
+        
+        # songs with plays recorded since the last run are the ones to recount
+        song_ids = None
+        if options['incremental']:
+            last_run = SongRank.objects.aggregate(Max('last_songplay_id'))[
+                'last_songplay_id__max']
+            if last_run is not None:
+                song_ids = list(SongPlay.objects.filter(
+                    id__gt=last_run, id__lte=last_songplay_id).values_list(
+                    'song', flat=True).distinct().order_by())
+        
         # get all songs played over the last few days, with their play counts
-        songplays = SongPlay.objects.filter(date_added__gte=start_date)
+        # and last play times
+        songranks = []
+        for play_count in SongPlay.objects.play_counts(start_date, song_ids):
+            songrank = SongRank(song_id=play_count['song'],
+                                last_songplay_id=last_songplay_id)
+            songrank.set_score(play_count['num_plays'], now,
+                               play_count['last_play'])
+            songranks.append(songrank)
         
-        # populate dictionary where keys are Song objects and values are 
-        # 2-element lists of play count and hours since last play
-        songs_playcnt_playtime = {}
-        for songplay in songplays:
-            song = songplay.song
-            # if song not already in dictionary then this is most recent play
-            # time and first acknowledged play.
-            if song not in songs_playcnt_playtime:
-                # remember we actually want time since last play in hours
-                time_since_play = now - songplay.date_added
-                time_since_play = time_since_play.seconds/3600.0
-                songs_playcnt_playtime[song] = [1, time_since_play]
-            
-            # else song is already in dictionary, so account for one extra play
+        # swap in the new song ranks
+        with transaction.atomic():
+            if song_ids is None:
+                SongRank.objects.all().delete()
             else:
-                songs_playcnt_playtime[song][0] += 1
-        
-        # create SongRank objects using appropriate scores
-        for k, v in songs_playcnt_playtime.items():
-            rank = v[0] / ((v[1] + 2.0)**settings.SONG_RANK_GRAVITY) 
-            SongRank.objects.create(song=k, score=rank)
+                SongRank.objects.filter(song__in=song_ids).delete()
+            SongRank.objects.bulk_create(songranks, batch_size=1000)
+            if song_ids is not None:
+                # the other song ranks' scores were computed at an older now
+                SongRank.objects.decay(now, start_date)
@@ -0,0 +1,42 @@
+"""
+Description:
+  Manangement command module for rebuilding the realtime heavy rotation scores
+  (kept in redis) from the song plays in db
+  
+Author: 
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from noddymix.apps.audio.models import SongPlay
+from noddymix.apps.audio import trending
+from django.conf import settings
+import datetime, redis
+
+
+class Command(BaseCommand):
+    help = 'rebuild realtime song trending scores from song plays'
+    
+    def handle(self, *args, **options):
+        """
+        Description: Recount the plays of all songs played in the time range
+                     used for heavy rotation and replace the realtime trending
+                     scores with ones computed from these counts.
+                     This drops plays that have aged out of the time range, and
+                     reconciles any plays that didn't make it to redis.
+                                 
+        Arguments:   *args, **options
+        Return:      None
+        
+        Author:      Nnoduka Eruchalu
+        """
+        now = datetime.datetime.now() 
+        start_date = now - datetime.timedelta(days=settings.HEAVY_ROTATION_DAYS)
+        
+        try:
+            num_songs = trending.rebuild(
+                SongPlay.objects.play_counts(start_date))
+        except redis.exceptions.RedisError:
+            raise CommandError('redis server is unavailable')
+        
+        self.stdout.write('rebuilt trending scores of %d songs' % num_songs)
@@ -0,0 +1,43 @@
+"""
+Description:
+  Manangement command module for recounting the stats (number of songs, number
+  of subscribers and cover album) of each Playlist object in db
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from noddymix.apps.audio.models import Playlist
+
+
+class Command(BaseCommand):
+    args = '[playlist_id playlist_id ...]'
+    help = 'recount all playlist stats'
+
+    def handle(self, *args, **options):
+        """
+        Description: Playlist stats are kept up to date incrementally, so this
+                     is only needed if they drift, such as after songs are
+                     deleted along with their album. Recount the stats of all
+                     playlists, or those with given ids, and fix those that
+                     are off.
+
+        Arguments:   *args, **options
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        playlists = Playlist.objects.all()
+        if args:
+            try:
+                playlists = playlists.filter(id__in=[int(arg) for arg in args])
+            except ValueError:
+                raise CommandError('playlist ids must be integers')
+
+        num_repaired = 0
+        for playlist in playlists.iterator():
+            if playlist.recount():
+                num_repaired += 1
+
+        self.stdout.write('repaired %d playlists' % num_repaired)
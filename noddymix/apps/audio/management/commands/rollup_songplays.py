@@ -0,0 +1,180 @@
+"""
+Description:
+  Manangement command module for rolling up song plays in db into hourly play
+  counts, and pruning song plays older than `SONGPLAY_RETENTION_DAYS` days.
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min
+from noddymix.apps.audio.models import SongPlay, SongPlayHour
+from django.conf import settings
+from optparse import make_option
+import datetime
+
+
+class Command(BaseCommand):
+    help = 'roll up song plays into hourly play counts and prune old song plays'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--no-prune',
+                    action='store_false',
+                    dest='prune',
+                    default=True,
+                    help='Keep song plays older than the retention window'),
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=10000,
+                    help='Max song plays deleted in one query'),
+        )
+
+    def handle(self, *args, **options):
+        """
+        Description: Roll up every complete hour of song plays since the last
+                     rolled up hour into SongPlayHour objects, then prune the
+                     song plays that are older than the retention window.
+
+                     Song plays that make it to the db after their hour was
+                     rolled up (see flush_plays) are found by id: the rollups
+                     keep the id of the newest song play they have counted,
+                     and song plays above it in rolled up hours are added to
+                     those hours' counts. Only song plays at or below it are
+                     ever pruned, so no play is pruned before it is counted.
+
+        Arguments:   *args, **options
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        one_hour = datetime.timedelta(hours=1)
+        now = datetime.datetime.now()
+
+        # only roll up complete hours
+        end = SongPlayHour.objects.hour_of(now)
+
+        # newest song play being rolled up. Song plays recorded while this
+        # runs are left to the next run.
+        last_songplay_id = SongPlay.objects.aggregate(Max('id'))['id__max'] or 0
+
+        rolled_up_until = SongPlayHour.objects.rolled_up_until()
+        if rolled_up_until is not None:
+            rolled_up_to_id = SongPlayHour.objects.rolled_up_to_id()
+            if not rolled_up_to_id:
+                # rollups written before the high-water mark was kept counted
+                # the song plays of their hours
+                rolled_up_to_id = SongPlay.objects.filter(
+                    date_added__lt=rolled_up_until).aggregate(Max('id'))[
+                    'id__max'] or 0
+            num_late = self.add_late_plays(rolled_up_to_id, last_songplay_id,
+                                           rolled_up_until)
+            self.stdout.write('rolled up %d late song plays' % num_late)
+            hour = rolled_up_until
+        else:
+            first_play = SongPlay.objects.aggregate(Min('date_added'))[
+                'date_added__min']
+            hour = end if first_play is None else \
+                SongPlayHour.objects.hour_of(first_play)
+
+        num_hours = 0
+        while hour < end:
+            songplayhours = [
+                SongPlayHour(song_id=play_count['song'], hour=hour,
+                             num_plays=play_count['num_plays'],
+                             last_play=play_count['last_play'],
+                             last_songplay_id=last_songplay_id)
+                for play_count in
+                SongPlay.objects.raw_play_counts(hour, hour + one_hour,
+                                                 until_id=last_songplay_id)]
+
+            with transaction.atomic():
+                SongPlayHour.objects.filter(hour=hour).delete()
+                SongPlayHour.objects.bulk_create(songplayhours)
+
+            hour += one_hour
+            num_hours += 1
+
+        self.stdout.write('rolled up %d hours of song plays' % num_hours)
+
+        if not options['prune']:
+            return
+
+        # only prune song plays that have been rolled up
+        rolled_up_until = SongPlayHour.objects.rolled_up_until()
+        if rolled_up_until is None:
+            return
+        rolled_up_to_id = SongPlayHour.objects.rolled_up_to_id()
+        cutoff = min(
+            now - datetime.timedelta(days=settings.SONGPLAY_RETENTION_DAYS),
+            rolled_up_until)
+
+        # delete in batches so no single query holds locks on the table for
+        # too long
+        num_pruned = 0
+        while True:
+            songplay_ids = list(SongPlay.objects.filter(
+                    date_added__lt=cutoff, id__lte=rolled_up_to_id).order_by(
+                    ).values_list('id', flat=True)[:options['batch_size']])
+            if not songplay_ids:
+                break
+
+            SongPlay.objects.filter(id__in=songplay_ids).delete()
+            num_pruned += len(songplay_ids)
+
+        self.stdout.write('pruned %d song plays' % num_pruned)
+
+
+    def add_late_plays(self, rolled_up_to_id, last_songplay_id,
+                       rolled_up_until):
+        """
+        Description: Add the song plays recorded since the last run, in hours
+                     that are already rolled up, to those hours' counts. This
+                     is one transaction, so the new high-water mark is only
+                     stored once every late play has been counted.
+
+        Arguments:   - rolled_up_to_id:  id of newest song play rolled up
+                     - last_songplay_id: id of newest song play to roll up
+                     - rolled_up_until:  end of last rolled up hour
+        Return:      (int) number of late song plays
+
+        Author:      Nnoduka Eruchalu
+        """
+        one_hour = datetime.timedelta(hours=1)
+        late_hours = SongPlay.objects.filter(
+            id__gt=rolled_up_to_id, id__lte=last_songplay_id,
+            date_added__lt=rolled_up_until).datetimes('date_added', 'hour')
+
+        num_late = 0
+        with transaction.atomic():
+            for hour in late_hours:
+                play_counts = list(SongPlay.objects.raw_play_counts(
+                        hour, hour + one_hour, after_id=rolled_up_to_id,
+                        until_id=last_songplay_id))
+                songplayhours = dict(
+                    (songplayhour.song_id, songplayhour) for songplayhour in
+                    SongPlayHour.objects.select_for_update().filter(
+                        hour=hour, song__in=[play_count['song'] for
+                                             play_count in play_counts]))
+
+                new_songplayhours = []
+                for play_count in play_counts:
+                    songplayhour = songplayhours.get(play_count['song'])
+                    if songplayhour is None:
+                        new_songplayhours.append(SongPlayHour(
+                                song_id=play_count['song'], hour=hour,
+                                num_plays=play_count['num_plays'],
+                                last_play=play_count['last_play'],
+                                last_songplay_id=last_songplay_id))
+                    else:
+                        SongPlayHour.objects.filter(
+                            id=songplayhour.id).update(
+                            num_plays=F('num_plays') + play_count['num_plays'],
+                            last_play=max(songplayhour.last_play,
+                                          play_count['last_play']),
+                            last_songplay_id=last_songplay_id)
+                    num_late += play_count['num_plays']
+                SongPlayHour.objects.bulk_create(new_songplayhours)
+        return num_late
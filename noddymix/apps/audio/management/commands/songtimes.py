@@ -9,33 +9,94 @@ Author:
 
 from django.core.management.base import BaseCommand, CommandError
 from noddymix.apps.audio.models import Song
-from mutagen.mp3 import MP3
-from tempfile import NamedTemporaryFile
-from urllib2 import urlopen
+from noddymix.apps.audio.mp3info import mp3_length
+from noddymix.apps.audio.utils import invalidate_song_json
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+
+def song_length(song):
+    """
+    Description: Get the length of a song's mp3 file. This runs in the thread
+                 pool so doesn't touch the db.
+
+    Arguments:   - song: tuple of (song id, song title, mp3 file URL, timeout)
+    Return:      tuple of (song id, song title, length in seconds or None,
+                 error or None)
+
+    Author:      Nnoduka Eruchalu
+    """
+    song_id, title, url, timeout = song
+    try:
+        return song_id, title, int(mp3_length(url, timeout)), None
+    except Exception as e:
+        return song_id, title, None, e
+
 
 class Command(BaseCommand):
+    args = '[song_id song_id ...]'
     help = 'update all song time lengths (in seconds)'
     
+    option_list = BaseCommand.option_list + (
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Update songs that already have a length'),
+        make_option('--workers',
+                    type='int',
+                    dest='workers',
+                    default=8,
+                    help='Number of songs to fetch concurrently'),
+        make_option('--timeout',
+                    type='float',
+                    dest='timeout',
+                    default=30,
+                    help='Seconds to wait on the file server'),
+        )
+
     def handle(self, *args, **options):
         """
-        Description: download all songs (to temporary local files), extract
-                     song length (in seconds) and save this info to db.
+        Description: get song lengths (in seconds) of all songs, or those with
+                     given ids, and save this info to db.
+                     Songs whose length is already set are skipped unless
+                     --force is given.
+                     Only the leading bytes of each mp3 file are fetched where
+                     possible (see mp3info), and several files are fetched
+                     concurrently by a thread pool. The db is only updated
+                     from this thread.
                                  
         Arguments:   *args, **options
         Return:      None
         
         Author:      Nnoduka Eruchalu
         """
-        for song in Song.objects.all():
+        songs = Song.objects.all()
+        if args:
             try:
-                response = urlopen(song.mp3.url)
-                local_file = NamedTemporaryFile()
-                local_file.write(response.read())
-                audio = MP3(local_file.name)
-                song.length = int(audio.info.length)
-                song.save()
-                print song.title, ': ', song.length
-                local_file.close() # this deletes the temp file
-            except:
-                print 'error: ', song.title
-        
+                songs = songs.filter(id__in=[int(arg) for arg in args])
+            except ValueError:
+                raise CommandError('song ids must be integers')
+        if not options['force']:
+            songs = songs.filter(length=0)
+
+        songs = [(song.id, song.title, song.mp3.url, options['timeout'])
+                 for song in songs.only('id', 'title', 'mp3')]
+        if not songs:
+            return
+
+        pool = ThreadPool(max(1, min(options['workers'], len(songs))))
+        try:
+            for song_id, title, length, error in pool.imap_unordered(
+                song_length, songs):
+                if error is not None:
+                    self.stderr.write('error: %s: %s' % (title, error))
+                    continue
+
+                # update directly so only the length column is written
+                Song.objects.filter(id=song_id).update(length=length)
+                invalidate_song_json([song_id])
+                self.stdout.write('%s: %d' % (title, length))
+        finally:
+            pool.close()
+            pool.join()
@@ -1,14 +1,21 @@
-from django.db import models
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Q, F, Count, Max, Min, Sum
+from django.db.models.signals import m2m_changed
 
 from django.core.urlresolvers import reverse
 from imagekit.models import ImageSpecField
 from imagekit.processors import SmartResize, Adjust
-from noddymix.utils import get_upload_path
+from noddymix.utils import get_upload_path, list_dedup
+from noddymix.apps.audio.utils import invalidate_song_json, \
+    song_featuring_handler
+from noddymix.apps.audio.artwork import DeferredStrategy, ART_SPECS, \
+    queue_art, done_art
 from noddymix.apps.account.models import User
 from django.conf import settings
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from mutagen.mp3 import MP3
+import bisect, redis
 
 # Create your models here.
 
@@ -67,14 +74,16 @@ class Album(models.Model):
         processors=[SmartResize(width=132, height=132),
                     Adjust(contrast = 1.2, sharpness=1.1)],
         format='JPEG',
-        options={'quality':90})
+        options={'quality':90},
+        cachefile_strategy=DeferredStrategy)
     # imagekit spec for art shown with music player bar of desktop view.
     art_thumbnail = ImageSpecField(
         source='art',
         processors=[SmartResize(width=60, height=60),
                     Adjust(contrast = 1.2, sharpness=1.1)],
         format='JPEG',
-        options={'quality':90})
+        options={'quality':90},
+        cachefile_strategy=DeferredStrategy)
     
     # imagekit specs for art shown on mobile view of album/playlist collections
     art_mobile_small = ImageSpecField(
@@ -82,14 +91,16 @@ class Album(models.Model):
         processors=[SmartResize(width=70, height=70),
                     Adjust(contrast = 1.2, sharpness=1.1)],
         format='JPEG',
-        options={'quality':90})
+        options={'quality':90},
+        cachefile_strategy=DeferredStrategy)
     # imagekit spec for art shown with music player bar of desktop view
     art_mobile_thumbnail = ImageSpecField(
         source='art',
         processors=[SmartResize(width=39, height=39),
                     Adjust(contrast = 1.2, sharpness=1.1)],
         format='JPEG',
-        options={'quality':90})
+        options={'quality':90},
+        cachefile_strategy=DeferredStrategy)
     
     # imagekit spec for art shown as desktop view's og:image (facebook sharing)
     # and mobile view's (now playing) song-details poster.
@@ -98,7 +109,8 @@ class Album(models.Model):
         processors=[SmartResize(width=320, height=320),
                     Adjust(contrast = 1.2, sharpness=1.1)],
         format='JPEG',
-        options={'quality':90})
+        options={'quality':90},
+        cachefile_strategy=DeferredStrategy)
     
     # this is used for tracking album art changes
     # ref: http://stackoverflow.com/a/1793323
@@ -130,31 +142,51 @@ class Album(models.Model):
           
         Author:      Nnoduka Eruchalu
         """
-        # get art_thumbnail location and delete it
-        instance.art_thumbnail.storage.delete(instance.art_thumbnail.name)
-        # do same for art_small
-        instance.art_small.storage.delete(instance.art_small.name)
+        # delete all derivatives of the art
+        for spec in ART_SPECS:
+            art_file = getattr(instance, spec)
+            art_file.storage.delete(art_file.name)
+        # art that is still queued no longer needs its derivatives
+        try:
+            done_art([instance.art.name])
+        except redis.exceptions.RedisError:
+            # generate_albumart --pending drops art that no longer exists
+            pass
         # delete art
         instance.art.delete()
+        # songs on this album will now need a different poster
+        invalidate_song_json(instance.songs.values_list('id', flat=True))
 
     
     def save(self, *args, **kwargs):
         """
         Description: On instance save ensure art files are deleted if art is
-                     updated.
+                     updated, and new art is queued to have its derivatives
+                     generated in the background.
+                     The album title and art are part of each of its songs'
+                     cached json so invalidate those.
                             
         Arguments:   *args, **kwargs
         Return:      None 
           
         Author:      Nnoduka Eruchalu
         """
-        if self.__original_art and self.art != self.__original_art:
+        is_new = self.pk is None
+        art_changed = (self.art != self.__original_art)
+        if self.__original_art and art_changed:
             # not new art and art changed, so delete old files
             orig = Album.objects.get(pk=self.pk)
             self.delete_art_files(orig)
                                     
         super(Album, self).save(*args, **kwargs)
         self.__original_art = self.art
+        if self.art and (art_changed or is_new):
+            try:
+                queue_art(self.art.name)
+            except redis.exceptions.RedisError:
+                # generate_albumart backfills art that missed the queue
+                pass
+        invalidate_song_json(self.songs.values_list('id', flat=True))
             
     
     def delete(self, *args, **kwargs):
@@ -187,6 +219,22 @@ class Artist(models.Model):
 
     def __unicode__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        """
+        Description: On instance save invalidate the cached json of all songs
+                     this artist performs or is featured on, as the artist's
+                     name is part of it.
+                            
+        Arguments:   *args, **kwargs
+        Return:      None 
+          
+        Author:      Nnoduka Eruchalu
+        """
+        super(Artist, self).save(*args, **kwargs)
+        invalidate_song_json(
+            Song.objects.filter(Q(artist=self) | Q(featuring=self))
+            .values_list('id', flat=True).distinct())
 
 
 class Song(models.Model):
@@ -231,6 +279,7 @@ class Song(models.Model):
                       one from storage.
                       If any mp3 file is being added (new or update), update
                       associated song length
+                      Finally invalidate the song's cached json.
                                                  
         Arguments:   *args, **kwargs
         Return:      None 
@@ -251,6 +300,7 @@ class Song(models.Model):
                     
         super(Song, self).save(*args, **kwargs)
         self.__original_mp3 = self.mp3
+        invalidate_song_json([self.pk])
                 
     
     def delete(self, *args, **kwargs):
@@ -266,25 +316,57 @@ class Song(models.Model):
           
         Author:      Nnoduka Eruchalu
         """
-        # decrement all associated playlist's song counts. Be sure that when
-        # the playlist is saved it doesn't try to refresh number of songs
-        # because this song object hasnt been deleted yet.
-        # probably could have just let it refresh num songs if this for-loop
-        # was run after super(Song, self).delete()... but it's nice to try
-        # something else.
-        playlist_songs = Playlist_Songs.objects.filter(song=self)
-        for playlist_song in playlist_songs:
-            playlist_song.playlist.num_songs -= 1
-            playlist_song.playlist.save(refresh_num_songs=False)
+        # grab the playlists this song is on before they lose it
+        playlist_ids = list(Playlist_Songs.objects.filter(
+                song=self).values_list('playlist', flat=True))
             
         self.mp3.delete()
         
+        invalidate_song_json([self.pk])
         super(Song, self).delete(*args, **kwargs)
+        
+        # decrement all associated playlist's song counts, and find new covers
+        # for those that could have had this song first
+        Playlist.objects.increment('num_songs', playlist_ids, -1)
+        for playlist in Playlist.objects.filter(id__in=playlist_ids,
+                                                cover_album=self.album_id):
+            playlist.refresh_cover_album()
+
+
+class PlaylistManager(models.Manager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the Playlist model.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def increment(self, field, playlist_ids, delta=1):
+        """
+        Description: Atomically add to a stats field of some playlists, with
+                     a single UPDATE query.
+        
+        Arguments:   - field:        name of field, `num_songs` or 
+                                     `num_subscribers`
+                     - playlist_ids: list of ids of Playlist objects
+                     - delta:        amount to add (negative to subtract)
+        Return:      None
+          
+        Author:      Nnoduka Eruchalu
+        """
+        if playlist_ids and delta:
+            self.filter(id__in=playlist_ids).update(
+                **{field: F(field) + delta})
 
 
 class Playlist(models.Model):
     """
     Description: Users can have multiple and named playlists
+                 
+                 The `num_songs`, `num_subscribers` and `cover_album` stats are
+                 updated where songs and subscribers are added and removed,
+                 and never recounted on save. The repair_playlists command
+                 recounts them if they ever drift.
                                                       
     Author:      Nnoduka Eruchalu
     """
@@ -311,6 +393,8 @@ class Playlist(models.Model):
                                     verbose_name="number of songs")
     num_subscribers = models.IntegerField(default=0,
                                           verbose_name="number of subscribers")
+    # custom manager
+    objects = PlaylistManager()
     
     class Meta:
         ordering = ('-date_added',)
@@ -345,39 +429,120 @@ class Playlist(models.Model):
     def save(self, *args, **kwargs):
         """
         Description: On a Playlist save, update owner's number of playlists if
-                     it's new. If however this is just a playlist update, 
-                     update number of songs, number of subscribers (unless 
-                     explicitly not allowed), and cover album.
+                     it's new.
+                     Stats aren't recounted here, and a full save would
+                     overwrite concurrent updates of the stats, so updates of
+                     an existing playlist should pass `update_fields`.
         
         Arguments:   *args, **kwargs
-                     Boolean kwargs of interest are:
-                     - refresh_num_songs:       Refresh song count
-                     - refresh_num_subscribers: Refresh # of subscribers
         Return:      None 
           
         Author:      Nnoduka Eruchalu
         """
-        refresh_num_songs = kwargs.pop('refresh_num_songs', True)
-        refresh_num_subscribers = kwargs.pop('refresh_num_subscribers', True)
         if self.pk is None:
             # on save, update owner's number of playlists if it's new
+            User.objects.increment('num_playlists', [self.owner_id])
             self.owner.num_playlists += 1
-            self.owner.save()
-        else:
-            if refresh_num_songs==True:
-                # on update of a playlist, refresh songs count if desired
-                self.num_songs = self.songs.count()
-            if refresh_num_subscribers==True:
-                # on update of a playlist, refresh subscribers count if desired
-                self.num_subscribers = self.subscribers.count()
-            # refresh associated album
-            qs = self.songs.all().order_by("playlist_songs", "-date_added")
-            try:
-                self.cover_album = qs[0].album
-            except IndexError:
-                self.cover_album = None
         
         super(Playlist, self).save(*args, **kwargs)
+    
+    
+    def subscribe(self, user):
+        """
+        Description: Subscribe a user to this playlist, with one row insert and
+                     one atomic update of the subscribers count.
+        
+        Arguments:   - user: User object
+        Return:      (bool) True if user wasn't already subscribed
+          
+        Author:      Nnoduka Eruchalu
+        """
+        try:
+            with transaction.atomic():
+                self.subscribers.through.objects.create(playlist=self, 
+                                                        user=user)
+        except IntegrityError:
+            # already subscribed
+            return False
+        
+        Playlist.objects.increment('num_subscribers', [self.id])
+        self.num_subscribers += 1
+        return True
+    
+    
+    def unsubscribe(self, user):
+        """
+        Description: Unsubscribe a user from this playlist, with one row delete
+                     and one atomic update of the subscribers count.
+        
+        Arguments:   - user: User object
+        Return:      (bool) True if user was subscribed
+          
+        Author:      Nnoduka Eruchalu
+        """
+        through = self.subscribers.through
+        qn = connection.ops.quote_name
+        # delete directly so the number of deleted rows is known
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE %s = %%s AND %s = %%s" % (
+                qn(through._meta.db_table), 
+                qn(through._meta.get_field('playlist').column),
+                qn(through._meta.get_field('user').column)), 
+                       [self.id, user.id])
+        if not cursor.rowcount:
+            return False
+        
+        Playlist.objects.increment('num_subscribers', [self.id], -1)
+        self.num_subscribers -= 1
+        return True
+    
+    
+    def recount(self):
+        """
+        Description: Recount the playlist's stats from scratch. This is only
+                     needed for repairs, see the repair_playlists command.
+        
+        Arguments:   None
+        Return:      (bool) True if any stats were off
+          
+        Author:      Nnoduka Eruchalu
+        """
+        num_songs = self.songs.count()
+        num_subscribers = self.subscribers.count()
+        cover_album_id = self.cover_album_id
+        self.refresh_cover_album()
+        
+        if (num_songs, num_subscribers) == (self.num_songs, 
+                                            self.num_subscribers):
+            return cover_album_id != self.cover_album_id
+        
+        Playlist.objects.filter(id=self.id).update(
+            num_songs=num_songs, num_subscribers=num_subscribers)
+        self.num_songs = num_songs
+        self.num_subscribers = num_subscribers
+        return True
+    
+    
+    def refresh_cover_album(self):
+        """
+        Description: Set the playlist's cover album to the album of its first
+                     song, without going through save() and its recounts.
+        
+        Arguments:   None
+        Return:      None 
+          
+        Author:      Nnoduka Eruchalu
+        """
+        qs = self.songs.all().order_by("playlist_songs", "-date_added")
+        try:
+            cover_album_id = qs.values_list('album', flat=True)[0]
+        except IndexError:
+            cover_album_id = None
+        
+        if cover_album_id != self.cover_album_id:
+            Playlist.objects.filter(id=self.id).update(
+                cover_album=cover_album_id)
+            self.cover_album_id = cover_album_id
 
     
     def delete(self, *args, **kwargs):
@@ -391,11 +556,288 @@ class Playlist(models.Model):
           
         Author:      Nnoduka Eruchalu
         """
-        self.owner.num_playlists -= 1
-        self.owner.save()
+        User.objects.increment('num_playlists', [self.owner_id], -1)
         super(Playlist, self).delete(*args, **kwargs)
 
 
+class Playlist_SongsManager(models.Manager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the Playlist_Songs model.
+                 
+                 Playlist entries are ordered by sparse `order` keys, spaced
+                 `PLAYLIST_ORDER_GAP` apart, so an entry can be moved by giving
+                 it a key between those of its new neighbours. Only entries
+                 that moved are written. When there's no room left between
+                 two keys, the playlist's keys are spread out again by a
+                 rebalancing pass in the same transaction.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def add_songs(self, playlist, song_ids):
+        """
+        Description: Append songs to a playlist, in the given order, with one
+                     query to filter out songs already in the playlist and one
+                     bulk insert. Songs that don't exist are ignored.
+        
+        Arguments:   - playlist: Playlist object
+                     - song_ids: list of ids of songs to add
+        Return:      list of ids of songs added
+          
+        Author:      Nnoduka Eruchalu
+        """
+        song_ids = list_dedup(song_ids)
+        # songs could be added to the same playlist concurrently, so try
+        # again if another request beat this one to some of the songs.
+        for attempt in range(2):
+            existing = set(self.filter(
+                    playlist=playlist, song__in=song_ids).values_list(
+                    'song', flat=True))
+            new_song_ids = set(Song.objects.filter(
+                    id__in=[s for s in song_ids if s not in existing]
+                    ).values_list('id', flat=True))
+            added = [s for s in song_ids if s in new_song_ids]
+            if not added:
+                return added
+            
+            # new songs take consecutive positions at the end of the playlist
+            max_order = self.filter(playlist=playlist).aggregate(
+                Max('order'))['order__max']
+            order = 0 if max_order is None else \
+                max_order + settings.PLAYLIST_ORDER_GAP
+            entries = []
+            for song_id in added:
+                entries.append(self.model(playlist=playlist, song_id=song_id,
+                                          order=order))
+                order += settings.PLAYLIST_ORDER_GAP
+            
+            try:
+                with transaction.atomic():
+                    self.bulk_create(entries)
+                return added
+            except IntegrityError:
+                if attempt:
+                    raise
+    
+    
+    def remove_songs(self, playlist, song_ids):
+        """
+        Description: Remove songs from a playlist with one DELETE query.
+        
+        Arguments:   - playlist: Playlist object
+                     - song_ids: list of ids of songs to remove
+        Return:      (int) number of songs removed
+          
+        Author:      Nnoduka Eruchalu
+        """
+        if not song_ids:
+            return 0
+        
+        qn = connection.ops.quote_name
+        # delete directly so the number of deleted rows is known
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE %s = %%s AND %s IN (%s)" % (
+                qn(self.model._meta.db_table),
+                qn(self.model._meta.get_field('playlist').column),
+                qn(self.model._meta.get_field('song').column),
+                ", ".join(["%s"] * len(song_ids))),
+                       [playlist.id] + list(song_ids))
+        return cursor.rowcount
+    
+    
+    def reorder(self, playlist, song_ids):
+        """
+        Description: Reorder a run of a playlist's songs (such as a page of
+                     them) to match a given order of song ids. The songs keep
+                     the positions they occupy in the playlist as a group, and
+                     the rest of the playlist is left alone.
+                     
+                     The longest run of songs already in order stays put, and
+                     every other song gets a new key between its new
+                     neighbours, so moving one song is a single row update.
+        
+        Arguments:   - playlist: Playlist object
+                     - song_ids: list of ids of songs in their new order.
+                                 Songs not in playlist are ignored.
+        Return:      (int) number of playlist entries moved
+          
+        Author:      Nnoduka Eruchalu
+        """
+        with transaction.atomic():
+            for attempt in range(2):
+                # lock the entries so they aren't reordered concurrently
+                entries = dict(
+                    (song_id, (pk, order)) for pk, song_id, order in
+                    self.filter(playlist=playlist, song__in=song_ids
+                                ).select_for_update().values_list(
+                        'id', 'song', 'order'))
+                
+                # entries in their new order, with (pk, old order) of each
+                seq = []
+                for song_id in song_ids:
+                    if song_id in entries:
+                        seq.append(entries.pop(song_id))
+                if not seq:
+                    return 0
+                
+                # find the keys bounding this run of entries
+                orders = [order for pk, order in seq]
+                others = self.filter(playlist=playlist).exclude(
+                    id__in=[pk for pk, order in seq])
+                lo = others.filter(order__lt=min(orders)).aggregate(
+                    Max('order'))['order__max']
+                hi = others.filter(order__gt=max(orders)).aggregate(
+                    Min('order'))['order__min']
+                gap = settings.PLAYLIST_ORDER_GAP * (len(seq) + 1)
+                if lo is None:
+                    lo = min(orders) - gap
+                if hi is None:
+                    hi = max(orders) + gap
+                
+                keep = self._increasing_subsequence(
+                    [(order, pk) for pk, order in seq])
+                new_orders = self._fill_gaps(orders, keep, lo, hi)
+                if new_orders is not None or attempt:
+                    break
+                # no room between keys, so spread out the playlist's keys in
+                # this transaction and work out the new keys again
+                self.rebalance(playlist.id)
+            
+            if new_orders is None:
+                # still no room, so shuffle the run's keys around instead
+                new_orders = sorted(orders)
+            
+            changes = [(pk, new_order) for (pk, order), new_order in 
+                       zip(seq, new_orders) if order != new_order]
+            self._set_orders(changes)
+        return len(changes)
+    
+    
+    def rebalance(self, playlist_id):
+        """
+        Description: Spread out the `order` keys of a playlist's entries so 
+                     they are `PLAYLIST_ORDER_GAP` apart, keeping their order.
+        
+        Arguments:   - playlist_id: id of Playlist object
+        Return:      None
+          
+        Author:      Nnoduka Eruchalu
+        """
+        with transaction.atomic():
+            # lock the entries so they aren't reordered while at this
+            entries = self.filter(playlist=playlist_id).order_by(
+                'order', 'id').select_for_update().values_list('id', 'order')
+            changes = []
+            for index, (pk, order) in enumerate(entries):
+                new_order = index * settings.PLAYLIST_ORDER_GAP
+                if order != new_order:
+                    changes.append((pk, new_order))
+            self._set_orders(changes)
+    
+    
+    def _increasing_subsequence(self, keys):
+        """
+        Description: Find a longest strictly increasing subsequence of keys
+                     (patience sorting), in O(n log n).
+        
+        Arguments:   - keys: list of comparable keys
+        Return:      set of indices of keys in the subsequence
+          
+        Author:      Nnoduka Eruchalu
+        """
+        tails = []         # smallest tail key of subsequences of each length
+        tail_indices = []  # index of each of those tail keys
+        previous = [None] * len(keys)
+        for index, key in enumerate(keys):
+            length = bisect.bisect_left(tails, key)
+            if length == len(tails):
+                tails.append(key)
+                tail_indices.append(index)
+            else:
+                tails[length] = key
+                tail_indices[length] = index
+            previous[index] = tail_indices[length-1] if length else None
+        
+        subsequence = set()
+        index = tail_indices[-1] if tail_indices else None
+        while index is not None:
+            subsequence.add(index)
+            index = previous[index]
+        return subsequence
+    
+    
+    def _fill_gaps(self, orders, keep, lo, hi):
+        """
+        Description: Get new `order` keys for a run of entries, where the
+                     entries at some indices keep their keys and the others
+                     are spread out evenly between their neighbours' keys.
+        
+        Arguments:   - orders: list of current keys of entries in new order
+                     - keep:   set of indices of entries keeping their keys.
+                               These keys must be increasing.
+                     - lo:     key that all keys must be greater than
+                     - hi:     key that all keys must be less than
+        Return:      list of new keys, or None if there isn't enough room
+                     between the kept keys
+          
+        Author:      Nnoduka Eruchalu
+        """
+        new_orders = list(orders)
+        prev_order = lo
+        index = 0
+        while index < len(orders):
+            if index in keep:
+                prev_order = orders[index]
+                index += 1
+                continue
+            
+            # find the run of entries that have to move and their next
+            # neighbour that stays put
+            end = index
+            while end < len(orders) and end not in keep:
+                end += 1
+            next_order = orders[end] if end < len(orders) else hi
+            num_moved = end - index
+            if next_order - prev_order <= num_moved:
+                return None
+            
+            for offset in range(num_moved):
+                new_orders[index + offset] = prev_order + \
+                    (next_order - prev_order) * (offset + 1) // (num_moved + 1)
+            index = end
+        
+        return new_orders
+    
+    
+    def _set_orders(self, changes):
+        """
+        Description: Update the `order` keys of playlist entries with one
+                     UPDATE statement per batch of entries.
+        
+        Arguments:   - changes: list of tuples of (pk, new order)
+        Return:      None
+          
+        Author:      Nnoduka Eruchalu
+        """
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for start in range(0, len(changes), 500):
+                batch = changes[start:start+500]
+                params = []
+                for pk, order in batch:
+                    params.extend([pk, order])
+                params.extend([pk for pk, order in batch])
+                cursor.execute(
+                    "UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % (
+                        table, qn('order'), qn('id'),
+                        " ".join(["WHEN %s THEN %s"] * len(batch)),
+                        qn('id'), ", ".join(["%s"] * len(batch))),
+                    params)
+
+
 class Playlist_Songs(models.Model):
     """
     Description: Table used for defining the many-to-many relationship between 
@@ -403,8 +845,9 @@ class Playlist_Songs(models.Model):
                  
                  It has an `order` field to enable the functionality to reorder
                  songs within a playlist. This is a new features users will
-                 appreciate. This order field is 0-indexed where 0 is the
-                 highest rank and a larger `order` means a lower rank.
+                 appreciate. A smaller `order` means a higher rank. The
+                 `order` keys are sparse (see Playlist_SongsManager) so songs
+                 can be moved without renumbering the whole playlist.
                  
                  This table is usually auto-generated but I needed to add an
                  `order` field. I specifically use both camel case and 
@@ -416,7 +859,9 @@ class Playlist_Songs(models.Model):
     
     playlist = models.ForeignKey(Playlist)  # the 1 foreign key to source model
     song = models.ForeignKey(Song)          # the 1 foreign key to target model
-    order = models.IntegerField(blank=True) # 0-indexed order; 0 is highest rank
+    order = models.IntegerField(blank=True) # sparse order; smallest is highest rank
+    # custom manager
+    objects = Playlist_SongsManager()
     
     class Meta:
         unique_together = ("playlist", "song")
@@ -435,7 +880,8 @@ class Playlist_Songs(models.Model):
                      If there is no other song in the playlist, this entry will
                      have the highest rank of 0. If however there are other
                      songs in the playlist, this entry will have the lowest rank
-                     in the playlist (playlist's max order + 1)
+                     in the playlist (playlist's max order + 
+                     `PLAYLIST_ORDER_GAP`)
         
         Arguments:   *args, **kwargs
         Return:      None 
@@ -448,7 +894,7 @@ class Playlist_Songs(models.Model):
             # if a new item is being created, it's order will be next up in
             # playlist
             try:
-                self.order = qs[0].order + 1
+                self.order = qs[0].order + settings.PLAYLIST_ORDER_GAP
             except IndexError:
                 # but if this new item is also the first object in the model
                 # start it off with a 0-based index. 
@@ -457,6 +903,97 @@ class Playlist_Songs(models.Model):
         super(Playlist_Songs, self).save(*args, **kwargs) # call "real" save()
 
 
+class SongPlayManager(models.Manager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the SongPlay model.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def raw_play_counts(self, start, end=None, song_ids=None, after_id=None,
+                        until_id=None):
+        """
+        Description: Get the number of plays and last play time of each song
+                     played in a given time range, counted from the raw
+                     SongPlay rows. This is aggregated by the database so only
+                     one row per song is ever loaded.
+        
+        Arguments:   - start:    datetime to start counting plays from
+                     - end:      datetime to stop counting plays at (excluded),
+                                 optional
+                     - song_ids: only count plays of these songs, optional
+                     - after_id: only count plays with greater ids, optional
+                     - until_id: only count plays with ids up to this one,
+                                 optional
+        Return:      ValuesQuerySet of dictionaries with keys:
+                     - song:      id of Song object
+                     - num_plays: number of plays since `start`
+                     - last_play: datetime of last play
+          
+        Author:      Nnoduka Eruchalu
+        """
+        songplays = self.filter(date_added__gte=start)
+        if end is not None:
+            songplays = songplays.filter(date_added__lt=end)
+        if song_ids is not None:
+            songplays = songplays.filter(song__in=song_ids)
+        if after_id is not None:
+            songplays = songplays.filter(id__gt=after_id)
+        if until_id is not None:
+            songplays = songplays.filter(id__lte=until_id)
+        
+        # clear the default ordering, or it ends up in the GROUP BY clause
+        return songplays.values('song').annotate(
+            num_plays=Count('id'), last_play=Max('date_added')).order_by()
+    
+    
+    def play_counts(self, start, song_ids=None):
+        """
+        Description: Get the number of plays and last play time of each song
+                     played since a given time.
+                     Hours that have been rolled up are counted from the
+                     SongPlayHour rows, so only the partial hour at `start` and
+                     the plays since the last rollup are counted from the raw
+                     SongPlay rows.
+        
+        Arguments:   - start:    datetime to start counting plays from
+                     - song_ids: only count plays of these songs, optional
+        Return:      list of dictionaries with keys:
+                     - song:      id of Song object
+                     - num_plays: number of plays since `start`
+                     - last_play: datetime of last play
+          
+        Author:      Nnoduka Eruchalu
+        """
+        rollup_start = SongPlayHour.objects.hour_of(start)
+        if rollup_start < start:
+            rollup_start += timedelta(hours=1)
+        rollup_end = SongPlayHour.objects.rolled_up_until()
+        
+        if rollup_end is None or rollup_end <= rollup_start:
+            # nothing to read from the rollups
+            return list(self.raw_play_counts(start, song_ids=song_ids))
+        
+        play_counts = {}
+        for play_count in (
+            list(self.raw_play_counts(start, rollup_start, song_ids)) +
+            list(SongPlayHour.objects.play_counts(rollup_start, rollup_end,
+                                                  song_ids)) +
+            list(self.raw_play_counts(rollup_end, song_ids=song_ids))):
+            
+            song_id = play_count['song']
+            if song_id not in play_counts:
+                play_counts[song_id] = play_count
+            else:
+                merged = play_counts[song_id]
+                merged['num_plays'] += play_count['num_plays']
+                merged['last_play'] = max(merged['last_play'],
+                                          play_count['last_play'])
+        
+        return play_counts.values()
+
+
 class SongPlay(models.Model):
     """
     Description: These are the representations of song plays across all users, 
@@ -469,7 +1006,10 @@ class SongPlay(models.Model):
     """
     
     song = models.ForeignKey(Song, related_name="plays", editable=False)
-    date_added = models.DateTimeField(default=datetime.now, editable=False)
+    date_added = models.DateTimeField(default=datetime.now, editable=False,
+                                      db_index=True)
+    # custom manager
+    objects = SongPlayManager()
     
     class Meta:
         ordering = ['-date_added']
@@ -479,6 +1019,143 @@ class SongPlay(models.Model):
         return self.song.title + " play at: " + unicode(self.date_added)
     
     
+class SongPlayHourManager(models.Manager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the SongPlayHour model.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def hour_of(self, date):
+        """
+        Description: Get the start of the hour a datetime falls in
+        
+        Arguments:   - date: datetime object
+        Return:      datetime object
+          
+        Author:      Nnoduka Eruchalu
+        """
+        return date.replace(minute=0, second=0, microsecond=0)
+    
+    
+    def rolled_up_to_id(self):
+        """
+        Description: Get the id of the newest song play that has been rolled
+                     up. Every song play with a greater id, whenever it
+                     happened, is yet to be rolled up.
+        
+        Arguments:   None
+        Return:      (int) SongPlay id, 0 if nothing has been rolled up
+          
+        Author:      Nnoduka Eruchalu
+        """
+        return self.aggregate(Max('last_songplay_id'))[
+            'last_songplay_id__max'] or 0
+    
+    
+    def rolled_up_until(self):
+        """
+        Description: Get the end of the last hour of song plays that has been
+                     rolled up.
+        
+        Arguments:   None
+        Return:      datetime object or None if nothing has been rolled up
+          
+        Author:      Nnoduka Eruchalu
+        """
+        last_hour = self.aggregate(Max('hour'))['hour__max']
+        return None if last_hour is None else last_hour + timedelta(hours=1)
+    
+    
+    def play_counts(self, start, end, song_ids=None):
+        """
+        Description: Get the number of plays and last play time of each song
+                     played in a range of rolled up hours.
+        
+        Arguments:   - start:    start of first hour to count plays from
+                     - end:      end of last hour to count plays from
+                     - song_ids: only count plays of these songs, optional
+        Return:      ValuesQuerySet of dictionaries with keys:
+                     - song:      id of Song object
+                     - num_plays: number of plays in the hours
+                     - last_play: datetime of last play
+          
+        Author:      Nnoduka Eruchalu
+        """
+        songplayhours = self.filter(hour__gte=start, hour__lt=end)
+        if song_ids is not None:
+            songplayhours = songplayhours.filter(song__in=song_ids)
+        
+        # clear the default ordering, or it ends up in the GROUP BY clause
+        return songplayhours.values('song').annotate(
+            num_plays=Sum('num_plays'), last_play=Max('last_play')).order_by()
+
+
+class SongPlayHour(models.Model):
+    """
+    Description: Hourly rollups of SongPlay objects, holding the number of plays
+                 of a song in an hour. These are maintained by the
+                 rollup_songplays command, which also prunes old SongPlay
+                 objects, so code counting song plays over long time periods
+                 should read these instead.
+                                                      
+    Author:      Nnoduka Eruchalu
+    """
+    
+    song = models.ForeignKey(Song, related_name="hourly_plays", editable=False)
+    # start of the hour
+    hour = models.DateTimeField(editable=False, db_index=True)
+    num_plays = models.IntegerField(default=0, editable=False)
+    # last play in the hour
+    last_play = models.DateTimeField(editable=False)
+    # id of newest SongPlay rolled up when this was last written
+    last_songplay_id = models.IntegerField(default=0, editable=False)
+    # custom manager
+    objects = SongPlayHourManager()
+    
+    class Meta:
+        ordering = ['-hour']
+        unique_together = ('song', 'hour')
+        
+    def __unicode__(self):
+        return self.song.title + " plays at: " + unicode(self.hour) + ": " + \
+            unicode(self.num_plays)
+
+
+class SongRankManager(models.Manager):
+    """
+    Description: Custom model manager needed to add table-level operations on
+                 the SongRank model.
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    
+    def decay(self, now, start):
+        """
+        Description: Recompute every song rank's score at a new time, from its
+                     stored play count and last play time, with one UPDATE.
+                     This is the same formula as SongRank.set_score. Ranks of
+                     songs not played since `start` have left heavy rotation
+                     so they are deleted.
+        
+        Arguments:   - now:   reference for time since last play
+                     - start: datetime heavy rotation starts from
+        Return:      None
+          
+        Author:      Nnoduka Eruchalu
+        """
+        qn = connection.ops.quote_name
+        self.filter(last_play__lt=start).delete()
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE %s SET %s = %s / POW(TIMESTAMPDIFF(SECOND, %s, %%s) / "
+            "3600.0 + 2.0, %%s)" % (
+                qn(self.model._meta.db_table), qn('score'), qn('num_plays'),
+                qn('last_play')),
+            [now, settings.SONG_RANK_GRAVITY])
+
+
 class SongRank(models.Model):
     """
     Description: This model represents the popularity of the songs. The `score`
@@ -490,6 +1167,14 @@ class SongRank(models.Model):
     song = models.OneToOneField(Song, related_name="rank", primary_key=True,
                                 editable=False)
     score = models.FloatField(default=0.0, editable=False)
+    # the song play stats the score was computed from
+    num_plays = models.IntegerField(default=0, editable=False)
+    last_play = models.DateTimeField(default=datetime.now, editable=False)
+    # id of the newest SongPlay when the play stats were counted, which is
+    # where an incremental rank_songs run picks up
+    last_songplay_id = models.IntegerField(default=0, editable=False)
+    # custom manager
+    objects = SongRankManager()
     
     class Meta:
         ordering = ['-score']
@@ -518,7 +1203,14 @@ class SongRank(models.Model):
                                   
         Author:      Nnoduka Eruchalu
         """
+        self.num_plays = num_plays
+        self.last_play = last_play_date
         # rememeber we actually want time since last play in hours
-        time_since_play = (now - last_play_date).seconds/3600.0
+        time_since_play = (now - last_play_date).total_seconds()/3600.0
         self.score = \
             num_plays / (time_since_play + 2.0)**settings.SONG_RANK_GRAVITY
+
+
+# connect the signal
+m2m_changed.connect(song_featuring_handler, sender=Song.featuring.through,
+                    dispatch_uid="noddymix.apps.audio.models")
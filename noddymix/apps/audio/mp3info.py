@@ -0,0 +1,279 @@
+"""
+Description:
+  Get the length of a remote MP3 file without downloading all of it.
+
+  The length of an MP3 file can be found from its first few KB:
+    - The ID3v2 tag header gives the size of the tag, and so where the audio
+      starts.
+    - VBR files (and CBR files encoded by LAME) have a Xing/Info or VBRI header
+      in their first MPEG frame holding the total number of frames, and every
+      frame holds a fixed number of samples.
+    - CBR files without those headers have a fixed bitrate, so the length
+      follows from the size of the audio data. The total file size is given
+      by the Content-Range header of a range request.
+
+  So the leading bytes are fetched with HTTP Range requests, and the file is
+  only downloaded in full (and handed over to mutagen) when the server doesn't
+  support range requests or the headers can't be made sense of.
+
+Table Of Contents:
+  - mp3_length:      get the length of a remote MP3 file
+  - parse_length:    get an MP3 file's length from its leading bytes
+  - download_length: get the length of a remote MP3 file by downloading it
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from mutagen.mp3 import MP3
+from tempfile import NamedTemporaryFile
+import urllib2, shutil, struct, re
+
+# number of leading bytes fetched with the first range request
+HEAD_BYTES = 16 * 1024
+
+# number of bytes fetched after a large ID3 tag, enough to hold the first frame
+# (and its Xing/VBRI header) and the header of the frame after it.
+FRAME_BYTES = 8 * 1024
+
+# bitrates in kbps, by (MPEG version is 1, layer)
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384,
+                416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320,
+                384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256,
+                320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224,
+                 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144,
+                 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144,
+                 160],
+}
+
+# MPEG-1 sample rates in Hz. MPEG-2 halves these and MPEG-2.5 quarters them.
+SAMPLE_RATES = [44100, 48000, 32000]
+
+
+class MP3InfoError(Exception):
+    """
+    Description: Raised when an MP3 file's length can't be found from its
+                 leading bytes.
+
+    Author:      Nnoduka Eruchalu
+    """
+    pass
+
+
+def id3_size(data):
+    """
+    Description: Get the size of an ID3v2 tag at the start of some data
+
+    Arguments:   - data: (str) leading bytes of a file
+    Return:      (int) size of tag in bytes [including its header and footer],
+                 0 if there's no tag
+
+    Author:      Nnoduka Eruchalu
+    """
+    if len(data) < 10 or data[:3] != 'ID3':
+        return 0
+
+    # tag size is a 28-bit "syncsafe" integer: 7 bits in each of 4 bytes
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (ord(byte) & 0x7f)
+
+    # header is 10 bytes, and there's a 10 byte footer if flag bit 4 is set
+    footer = 10 if ord(data[5]) & 0x10 else 0
+    return 10 + size + footer
+
+
+def frame_header(data, offset):
+    """
+    Description: Parse the MPEG audio frame header at an offset
+
+    Arguments:   - data:   (str) bytes of file
+                 - offset: index of frame header in `data`
+    Return:      dictionary with keys:
+                 - mpeg1:       is this an MPEG-1 frame?
+                 - mono:        is this a single channel frame?
+                 - bitrate:     bitrate in bps
+                 - sample_rate: sample rate in Hz
+                 - samples:     number of samples in frame
+                 - size:        size of frame in bytes
+                 or None if there's no valid frame header at `offset`
+
+    Author:      Nnoduka Eruchalu
+    """
+    if offset + 4 > len(data):
+        return None
+
+    header = struct.unpack('>I', data[offset:offset+4])[0]
+    version = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xf
+    sample_rate_index = (header >> 10) & 0x3
+    if ((header >> 21) & 0x7ff) != 0x7ff or version == 1 or layer == 4 or \
+            bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    # version is 3 for MPEG-1, 2 for MPEG-2 and 0 for MPEG-2.5
+    mpeg1 = (version == 3)
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[sample_rate_index] >> {3:0, 2:1, 0:2}[version]
+    padding = (header >> 9) & 0x1
+
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (mpeg1 or layer == 2) else 576
+        size = (samples // 8) * bitrate // sample_rate + padding
+
+    return {'mpeg1': mpeg1, 'mono': ((header >> 6) & 0x3) == 3,
+            'bitrate': bitrate, 'sample_rate': sample_rate,
+            'samples': samples, 'size': size}
+
+
+def parse_length(data, audio_start, file_size):
+    """
+    Description: Get an MP3 file's length from its leading bytes
+
+    Arguments:   - data:        (str) leading bytes of file, starting at
+                                `audio_start`
+                 - audio_start: offset of `data` in file [i.e. ID3 tag size]
+                 - file_size:   total size of file in bytes
+    Return:      (float) length in seconds
+
+    Raises:      MP3InfoError if no frame header could be found, or the file
+                 has to be read in full to find its length.
+
+    Author:      Nnoduka Eruchalu
+    """
+    # find the first frame, checking the frame after it to rule out bytes
+    # that just happen to look like a frame header
+    for match in re.finditer('\xff', data):
+        offset = match.start()
+        frame = frame_header(data, offset)
+        if frame is not None and \
+                frame_header(data, offset + frame['size']) is not None:
+            break
+    else:
+        raise MP3InfoError('no MPEG frame found')
+
+    # Xing/Info header sits right after the side information
+    if frame['mpeg1']:
+        xing_offset = offset + (21 if frame['mono'] else 36)
+    else:
+        xing_offset = offset + (13 if frame['mono'] else 21)
+    if data[xing_offset:xing_offset+4] in ('Xing', 'Info'):
+        flags = struct.unpack('>I', data[xing_offset+4:xing_offset+8])[0]
+        if flags & 0x1:
+            num_frames = struct.unpack(
+                '>I', data[xing_offset+8:xing_offset+12])[0]
+            return float(num_frames) * frame['samples'] / frame['sample_rate']
+
+    # VBRI header is at a fixed offset of 32 bytes after the frame header
+    vbri_offset = offset + 36
+    if data[vbri_offset:vbri_offset+4] == 'VBRI':
+        num_frames = struct.unpack(
+            '>I', data[vbri_offset+14:vbri_offset+18])[0]
+        return float(num_frames) * frame['samples'] / frame['sample_rate']
+
+    # no VBR header, so treat it as CBR
+    if data[xing_offset:xing_offset+4] == 'Xing':
+        raise MP3InfoError('VBR file without frame count')
+    audio_size = file_size - audio_start - offset
+    return audio_size * 8.0 / frame['bitrate']
+
+
+def fetch_range(url, start, end, timeout):
+    """
+    Description: Fetch a range of bytes of a remote file
+
+    Arguments:   - url:     URL of file
+                 - start:   offset of first byte
+                 - end:     offset of last byte [included]
+                 - timeout: seconds to wait on server
+    Return:      tuple of (bytes fetched, total file size) if the server
+                 honoured the range, or (response, None) if it's sending the
+                 whole file instead.
+
+    Author:      Nnoduka Eruchalu
+    """
+    request = urllib2.Request(url, headers={'Range':'bytes=%d-%d' % (start,
+                                                                     end)})
+    response = urllib2.urlopen(request, timeout=timeout)
+    if response.getcode() != 206:
+        return response, None
+
+    try:
+        # Content-Range: bytes <start>-<end>/<total size>
+        content_range = response.info().getheader('Content-Range', '')
+        file_size = int(content_range.rsplit('/', 1)[1])
+        return response.read(), file_size
+    except (IndexError, ValueError):
+        raise MP3InfoError('bad Content-Range: %r' % content_range)
+    finally:
+        response.close()
+
+
+def download_length(url, timeout, response=None):
+    """
+    Description: Get the length of a remote MP3 file by downloading it to a
+                 temporary local file and reading it with mutagen.
+
+    Arguments:   - url:      URL of file
+                 - timeout:  seconds to wait on server
+                 - response: response already sending the file, optional
+    Return:      (float) length in seconds
+
+    Author:      Nnoduka Eruchalu
+    """
+    if response is None:
+        response = urllib2.urlopen(url, timeout=timeout)
+    try:
+        with NamedTemporaryFile() as local_file:
+            # stream to disk rather than hold the whole file in memory
+            shutil.copyfileobj(response, local_file)
+            local_file.flush()
+            return MP3(local_file.name).info.length
+    finally:
+        response.close()
+
+
+def mp3_length(url, timeout=30):
+    """
+    Description: Get the length of a remote MP3 file, fetching as little of it
+                 as possible.
+
+    Arguments:   - url:     URL of file
+                 - timeout: seconds to wait on server
+    Return:      (float) length in seconds
+
+    Author:      Nnoduka Eruchalu
+    """
+    try:
+        data, file_size = fetch_range(url, 0, HEAD_BYTES-1, timeout)
+        if file_size is None:
+            # server doesn't do range requests, so it's sending the whole file
+            return download_length(url, timeout, data)
+        
+        audio_start = id3_size(data)
+        if audio_start + FRAME_BYTES > len(data) and \
+                audio_start + FRAME_BYTES <= file_size:
+            # ID3 tag (probably with album art) is too big for the first
+            # request, so fetch the bytes after it
+            data, file_size = fetch_range(url, audio_start,
+                                          audio_start + FRAME_BYTES - 1,
+                                          timeout)
+            if file_size is None:
+                return download_length(url, timeout, data)
+        else:
+            data = data[audio_start:]
+
+        return parse_length(data, audio_start, file_size)
+
+    except MP3InfoError:
+        return download_length(url, timeout)
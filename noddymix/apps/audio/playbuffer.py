@@ -0,0 +1,174 @@
+"""
+Description:
+  Write-behind buffer of song play events kept in redis.
+
+  Every song play used to cost a song row update, a SongPlay insert and (for
+  signed in users) an Activity insert before the request returned. Instead,
+  song_play now appends a small event to a redis list and returns, and the
+  `flush_plays` management command periodically drains the list and applies
+  the events in bulk:
+    - one num_plays increment query per distinct play count in the batch
+    - one SongPlay bulk insert
+    - one Activity insert per "played" activity, so each one's id is known
+  Those activities are queued to be added to followers' timelines and
+  published to the realtime feed once the batch is committed.
+
+  Events are JSON encoded lists: [song id, user id or null, unix timestamp]
+
+  New events are pushed on the left of the `<key>` list. A flush moves the
+  oldest events, from the right, onto the `<key>:processing` list and only
+  deletes them from there once the database transaction has committed, so a
+  flush that fails or is killed loses nothing. Events left in the processing
+  list are put back on the buffer by `recover` when flush_plays starts. There
+  is only one processing list, so only one flush_plays process should run
+  (its watchdog script makes sure of that). An event can be applied twice if
+  the flusher dies between the commit and the delete, but never lost.
+
+Table Of Contents:
+  - push:    buffer a song play event
+  - depth:   number of buffered song play events
+  - recover: put events of an unfinished flush back on the buffer
+  - flush:   apply a batch of buffered song play events to the database
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis
+from django.db import transaction
+from django.db.models import F
+from django.contrib.contenttypes.models import ContentType
+import datetime, json, time
+
+# redis connection used for the play buffer
+conn = get_redis()
+
+
+def processing_key():
+    return settings.PLAY_BUFFER_REDIS_KEY + ':processing'
+
+
+def push(song_id, user_id=None, play_time=None):
+    """
+    Description: Buffer a song play event
+
+    Arguments:   - song_id:   id of Song object that was played
+                 - user_id:   id of User object that played it, None if the
+                              user isn't signed in
+                 - play_time: unix timestamp of play, defaults to now
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    if play_time is None:
+        play_time = time.time()
+    conn.lpush(settings.PLAY_BUFFER_REDIS_KEY,
+               json.dumps([song_id, user_id, play_time]))
+
+
+def depth():
+    """
+    Description: Get the number of buffered song play events
+
+    Arguments:   None
+    Return:      (int) number of events waiting to be flushed
+
+    Author:      Nnoduka Eruchalu
+    """
+    return conn.llen(settings.PLAY_BUFFER_REDIS_KEY)
+
+
+def recover():
+    """
+    Description: Put the events of a flush that never finished, left in the
+                 processing list, back on the buffer to be flushed again.
+                 This is only safe while no flush is running.
+
+    Arguments:   None
+    Return:      (int) number of events put back
+
+    Author:      Nnoduka Eruchalu
+    """
+    num_events = 0
+    while conn.rpoplpush(processing_key(), settings.PLAY_BUFFER_REDIS_KEY):
+        num_events += 1
+    return num_events
+
+
+def flush(batch_size=None):
+    """
+    Description: Move a batch of the oldest buffered song play events to the
+                 processing list and apply them to the database in one
+                 transaction. They are deleted from the processing list once
+                 the transaction has committed.
+                 Events of songs or users that have since been deleted are
+                 dropped.
+
+    Arguments:   - batch_size: max number of events to flush, defaults to
+                               `PLAY_BUFFER_BATCH_SIZE`
+    Return:      (int) number of events taken off the buffer
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.audio.models import Song, SongPlay
+    from noddymix.apps.account.models import User
+    from noddymix.apps.activity.models import Activity
+    from noddymix.apps.activity.utils import publish_activity
+
+    if batch_size is None:
+        batch_size = settings.PLAY_BUFFER_BATCH_SIZE
+
+    # move the batch in one transaction, oldest events first
+    pipe = conn.pipeline()
+    for i in range(batch_size):
+        pipe.rpoplpush(settings.PLAY_BUFFER_REDIS_KEY, processing_key())
+    events = [json.loads(event) for event in pipe.execute()
+              if event is not None]
+    if not events:
+        return 0
+
+    songs = Song.objects.in_bulk(set(event[0] for event in events))
+    users = User.objects.in_bulk(set(event[1] for event in events
+                                     if event[1] is not None))
+
+    play_counts = {}
+    songplays = []
+    activities = []
+    song_type = ContentType.objects.get_for_model(Song)
+    for song_id, user_id, play_time in events:
+        if song_id not in songs:
+            continue
+        date_added = datetime.datetime.fromtimestamp(play_time)
+        play_counts[song_id] = play_counts.get(song_id, 0) + 1
+        songplays.append(SongPlay(song_id=song_id, date_added=date_added))
+        if user_id in users:
+            activities.append(Activity(
+                    actor=users[user_id], verb="played",
+                    target_content_type=song_type, target_id=song_id,
+                    date_added=date_added))
+
+    # songs with the same number of plays in this batch share an update
+    song_ids_by_count = {}
+    for song_id, num_plays in play_counts.items():
+        song_ids_by_count.setdefault(num_plays, []).append(song_id)
+
+    with transaction.atomic():
+        for num_plays, song_ids in song_ids_by_count.items():
+            Song.objects.filter(id__in=song_ids).update(
+                num_plays=F('num_plays') + num_plays)
+        SongPlay.objects.bulk_create(songplays)
+        # bulk inserts don't set ids on mysql, so save each activity to know
+        # exactly which ones to fan out
+        for act in activities:
+            act.save()
+
+    # the batch is in the db, so it can go
+    conn.delete(processing_key())
+
+    # now that the activities are saved, put them on followers' timelines and
+    # the realtime feed
+    for act in activities:
+        publish_activity(act)
+
+    return len(events)
@@ -0,0 +1,111 @@
+"""
+Description:
+  Recent song plays of signed in users kept in redis.
+
+  Each user's play history is a capped redis list of song ids, most recently
+  played first and without duplicates:
+    - `<key>:<user id>`
+  song_play moves the song to the front of the list, so reading a history is
+  one range read and the songs are loaded with one query. A cold history is
+  loaded from the user's "played" activities first, so it is never cut short
+  by a play. The id 0 (song ids start at 1) marks a loaded history with no
+  songs, and is ignored on reads.
+
+  Histories expire `PLAY_HISTORY_CACHE_TIMEOUT` seconds after the user's last
+  song play.
+
+Table Of Contents:
+  - db_song_ids: ids of songs in a user's history, from the db
+  - push:        put a song at the front of a user's history
+  - song_ids:    ids of songs in a user's history
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis, list_dedup
+
+# redis connection used for play histories
+conn = get_redis()
+
+# id cached with an empty history, marking it as loaded
+SENTINEL = 0
+
+
+def history_key(user_id):
+    return '%s:%d' % (settings.PLAY_HISTORY_REDIS_KEY, user_id)
+
+
+def db_song_ids(user_id):
+    """
+    Description: Get the ids of songs in a user's play history from their
+                 "played" activities. The last `SONGS_PER_PAGE` plays are read,
+                 so there can be fewer songs once duplicates are dropped.
+
+    Arguments:   - user_id: id of User
+    Return:      list of song ids, most recently played first
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.activity.models import Activity
+    from noddymix.apps.audio.models import Song
+    from django.contrib.contenttypes.models import ContentType
+
+    return list_dedup(list(Activity.objects.filter(
+                actor=user_id, verb="played",
+                target_content_type=ContentType.objects.get_for_model(Song)
+                ).values_list('target_id', flat=True)[:settings.SONGS_PER_PAGE]))
+
+
+def ensure(user_id):
+    """
+    Description: Make sure a user's play history is cached
+
+    Arguments:   - user_id: id of User
+    Return:      (str) key of history
+
+    Author:      Nnoduka Eruchalu
+    """
+    key = history_key(user_id)
+    if not conn.exists(key):
+        pipe = conn.pipeline()
+        pipe.delete(key)
+        pipe.rpush(key, *(db_song_ids(user_id) or [SENTINEL]))
+        pipe.expire(key, settings.PLAY_HISTORY_CACHE_TIMEOUT)
+        pipe.execute()
+    return key
+
+
+def push(user_id, song_id):
+    """
+    Description: Put a song at the front of a user's play history, dropping
+                 any earlier play of it and the oldest songs past
+                 `SONGS_PER_PAGE`.
+
+    Arguments:   - user_id: id of User that played the song
+                 - song_id: id of Song that was played
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    key = ensure(user_id)
+    pipe = conn.pipeline()
+    pipe.lrem(key, 0, song_id)
+    pipe.lpush(key, song_id)
+    pipe.ltrim(key, 0, settings.SONGS_PER_PAGE-1)
+    pipe.expire(key, settings.PLAY_HISTORY_CACHE_TIMEOUT)
+    pipe.execute()
+
+
+def song_ids(user_id):
+    """
+    Description: Get the ids of songs in a user's play history
+
+    Arguments:   - user_id: id of User
+    Return:      list of song ids, most recently played first
+
+    Author:      Nnoduka Eruchalu
+    """
+    return [int(song_id) for song_id in conn.lrange(ensure(user_id), 0, -1)
+            if int(song_id) != SENTINEL]
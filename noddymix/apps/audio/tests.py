@@ -1,11 +1,38 @@
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
+Description:
+  Tests of the audio app.
 
-Replace this with more appropriate tests for your application.
+  Tests of features kept in redis use the local redis server (`REDIS_HOST`,
+  `REDIS_PORT`) as a stand-in for the production one, with their keys under a
+  `test:` prefix. They are skipped if it isn't running.
+
+  Tests of remote MP3 files serve them from a local HTTP file server.
+
+Table Of Contents:
+  - SimpleTest:                demo test
+  - TrendingTest:              realtime trending scores
+  - HeavyRotationFallbackTest: heavy rotation while redis is down
+  - RollupSongPlaysTest:       hourly rollups of song plays
+  - ReorderPlaylistTest:       sparse reordering of playlist songs
+  - MP3ParseLengthTest:        MP3 lengths from leading bytes
+  - MP3LengthTest:             MP3 lengths from a file server
+
+Author:
+  Nnoduka Eruchalu
 """
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.conf import settings
+from noddymix.apps.audio.models import Artist, Album, Song, SongRank, \
+    SongPlay, SongPlayHour, Playlist, Playlist_Songs
+from noddymix.apps.account.models import User
+from noddymix.apps.audio import trending, mp3info
+from datetime import datetime, timedelta
+from StringIO import StringIO
+import BaseHTTPServer, json, re, redis, struct, threading
 
 
 class SimpleTest(TestCase):
@@ -14,3 +41,505 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+@override_settings(TRENDING_REDIS_KEY='test:trending')
+class TrendingTest(TestCase):
+    """
+    Description: Tests of the realtime trending scores (trending.py)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    # unix time the tests are run at
+    now = 1400000000
+
+    def setUp(self):
+        try:
+            trending.conn.ping()
+        except redis.exceptions.RedisError:
+            self.skipTest('local redis server is not running')
+        self.clear()
+
+    def tearDown(self):
+        self.clear()
+
+    def clear(self):
+        trending.conn.delete(trending.score_key(), trending.last_play_key())
+
+    def play(self, song_id, hours_ago=0, times=1):
+        for i in range(times):
+            trending.record_play(song_id, self.now - hours_ago*3600)
+
+
+    def test_record_play_increments_score(self):
+        """
+        Each play adds the score of a song played just now, 1/2^G
+        """
+        self.play(1, times=2)
+        self.assertAlmostEqual(
+            trending.conn.zscore(trending.score_key(), 1),
+            2 / 2.0**settings.SONG_RANK_GRAVITY)
+        self.assertEqual(
+            float(trending.conn.hget(trending.last_play_key(), 1)), self.now)
+
+
+    def test_scores_decay(self):
+        """
+        Scores decay with the time since a song's last play
+        """
+        self.play(1, hours_ago=48, times=3)
+        self.play(2)
+        self.assertEqual(trending.top_songs(2, self.now), [2, 1])
+
+        # but plays still count for more than recency
+        self.play(3, hours_ago=1, times=10)
+        self.assertEqual(trending.top_songs(3, self.now), [3, 2, 1])
+
+
+    def test_old_plays_leave_heavy_rotation(self):
+        """
+        Songs not played in the last `HEAVY_ROTATION_DAYS` days aren't trending
+        """
+        self.play(1, hours_ago=(settings.HEAVY_ROTATION_DAYS + 1)*24, times=5)
+        self.play(2, hours_ago=24)
+        self.assertEqual(trending.top_songs(10, self.now), [2])
+
+
+    def test_top_songs_limit(self):
+        """
+        Only the requested number of songs is returned, highest scores first
+        """
+        for song_id in range(1, 6):
+            self.play(song_id, times=song_id)
+        self.assertEqual(trending.top_songs(2, self.now), [5, 4])
+
+
+    def test_rebuild(self):
+        """
+        Rebuilt scores replace the current ones
+        """
+        self.play(1)
+        last_play = datetime.fromtimestamp(self.now)
+        self.assertEqual(trending.rebuild([
+                    {'song':5, 'num_plays':1, 'last_play':last_play},
+                    {'song':6, 'num_plays':4, 'last_play':last_play}]), 2)
+        self.assertEqual(trending.top_songs(10, self.now), [6, 5])
+
+        self.assertEqual(trending.rebuild([]), 0)
+        self.assertEqual(trending.top_songs(10, self.now), [])
+
+
+class HeavyRotationFallbackTest(TestCase):
+    """
+    Description: Tests of heavy rotation falling back to the song ranks in the
+                 db when redis is down
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        # no redis server listens on this port
+        self.trending_conn = trending.conn
+        trending.conn = redis.StrictRedis(port=1, socket_timeout=0.1)
+
+    def tearDown(self):
+        trending.conn = self.trending_conn
+
+
+    def test_falls_back_to_song_ranks(self):
+        artist = Artist.objects.create(name='artist')
+        album = Album.objects.create(title='album')
+        # bulk_create skips Song.save, which reads the length of the mp3 file
+        Song.objects.bulk_create([
+                Song(title=title, artist=artist, album=album,
+                     mp3='songs/%s.mp3' % title) for title in ('one', 'two')])
+        one, two = Song.objects.get(title='one'), Song.objects.get(title='two')
+        SongRank.objects.create(song=one, score=1.0)
+        SongRank.objects.create(song=two, score=2.0)
+
+        response = self.client.get(reverse('heavy_rotation'),
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [song['id'] for song in json.loads(response.content)['songs']],
+            [two.id, one.id])
+
+
+class RollupSongPlaysTest(TestCase):
+    """
+    Description: Tests of the rollup_songplays command
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        artist = Artist.objects.create(name='artist')
+        album = Album.objects.create(title='album')
+        # bulk_create skips Song.save, which reads the length of the mp3 file
+        Song.objects.bulk_create([Song(title='one', artist=artist, album=album,
+                                       mp3='songs/one.mp3')])
+        self.song = Song.objects.get(title='one')
+        self.hour = SongPlayHour.objects.hour_of(
+            datetime.now() - timedelta(hours=3))
+
+    def play(self, minutes=0):
+        SongPlay.objects.create(song=self.song, date_added=self.hour +
+                                timedelta(minutes=minutes))
+
+    def rollup(self, *args):
+        call_command('rollup_songplays', *args, stdout=StringIO())
+
+    def num_plays(self):
+        return SongPlayHour.objects.get(song=self.song,
+                                        hour=self.hour).num_plays
+
+
+    def test_rolls_up_complete_hours(self):
+        self.play(10)
+        self.play(20)
+        self.rollup('--no-prune')
+        self.assertEqual(self.num_plays(), 2)
+        self.assertEqual(SongPlayHour.objects.rolled_up_to_id(),
+                         SongPlay.objects.latest('id').id)
+
+        # rolling up again changes nothing
+        self.rollup('--no-prune')
+        self.assertEqual(self.num_plays(), 2)
+
+    def test_late_plays_are_counted(self):
+        """
+        Plays recorded after their hour was rolled up are added to its count
+        """
+        self.play(10)
+        self.rollup('--no-prune')
+        self.play(50)
+        self.rollup('--no-prune')
+        self.assertEqual(self.num_plays(), 2)
+
+    @override_settings(SONGPLAY_RETENTION_DAYS=0)
+    def test_only_rolled_up_plays_are_pruned(self):
+        self.play(10)
+        self.rollup()
+        self.assertEqual(SongPlay.objects.count(), 0)
+
+        # a late play is counted before it is pruned
+        self.play(50)
+        self.rollup()
+        self.assertEqual(self.num_plays(), 2)
+        self.assertEqual(SongPlay.objects.count(), 0)
+
+
+class ReorderPlaylistTest(TestCase):
+    """
+    Description: Tests of reordering playlist songs (Playlist_SongsManager)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        artist = Artist.objects.create(name='artist')
+        album = Album.objects.create(title='album')
+        titles = ('a', 'b', 'c', 'd', 'e')
+        # bulk_create skips Song.save, which reads the length of the mp3 file
+        Song.objects.bulk_create([
+                Song(title=title, artist=artist, album=album,
+                     mp3='songs/%s.mp3' % title) for title in titles])
+        songs = dict(Song.objects.values_list('title', 'id'))
+        self.a, self.b, self.c, self.d, self.e = [songs[t] for t in titles]
+        owner = User.objects.create(username='owner')
+        self.playlist = Playlist.objects.create(owner=owner)
+
+    def add(self, *song_ids):
+        Playlist_Songs.objects.add_songs(self.playlist, list(song_ids))
+
+    def song_ids(self):
+        return list(Playlist_Songs.objects.filter(
+                playlist=self.playlist).values_list('song', flat=True))
+
+    def orders(self):
+        return dict(Playlist_Songs.objects.filter(
+                playlist=self.playlist).values_list('song', 'order'))
+
+
+    def test_move_one_song_writes_one_row(self):
+        self.add(self.a, self.b, self.c, self.d, self.e)
+        orders = self.orders()
+        self.assertEqual(Playlist_Songs.objects.reorder(
+                self.playlist, [self.a, self.c, self.d, self.b, self.e]), 1)
+        self.assertEqual(self.song_ids(),
+                         [self.a, self.c, self.d, self.b, self.e])
+
+        # only the moved song got a new key
+        new_orders = self.orders()
+        self.assertNotEqual(new_orders.pop(self.b), orders.pop(self.b))
+        self.assertEqual(new_orders, orders)
+
+    def test_order_matches_song_ids(self):
+        self.add(self.a, self.b, self.c, self.d, self.e)
+        Playlist_Songs.objects.reorder(
+            self.playlist, [self.e, self.d, self.c, self.b, self.a])
+        self.assertEqual(self.song_ids(),
+                         [self.e, self.d, self.c, self.b, self.a])
+
+    def test_reorder_run_of_songs(self):
+        """
+        A run of songs, such as a page of them, is reordered in the positions
+        it occupies and the rest of the playlist stays put
+        """
+        self.add(self.a, self.b, self.c, self.d, self.e)
+        self.assertEqual(Playlist_Songs.objects.reorder(
+                self.playlist, [self.d, 0, self.c, self.b]), 2)
+        self.assertEqual(self.song_ids(),
+                         [self.a, self.d, self.c, self.b, self.e])
+
+    def test_rebalances_when_out_of_room(self):
+        """
+        Keys with no room between them are spread out before a song is moved
+        between them
+        """
+        self.add(self.a, self.b, self.c)
+        for order, song_id in enumerate((self.a, self.b, self.c)):
+            Playlist_Songs.objects.filter(
+                playlist=self.playlist, song=song_id).update(order=order)
+
+        self.assertEqual(Playlist_Songs.objects.reorder(
+                self.playlist, [self.a, self.c, self.b]), 1)
+        self.assertEqual(self.song_ids(), [self.a, self.c, self.b])
+        orders = self.orders()
+        self.assertEqual(orders[self.b], settings.PLAYLIST_ORDER_GAP)
+        self.assertEqual(orders[self.c], settings.PLAYLIST_ORDER_GAP // 2)
+
+    @override_settings(PLAYLIST_ORDER_GAP=1)
+    def test_shuffles_keys_when_still_out_of_room(self):
+        """
+        If rebalancing doesn't make room, the songs swap keys instead
+        """
+        self.add(self.a, self.b, self.c)
+        self.assertEqual(Playlist_Songs.objects.reorder(
+                self.playlist, [self.a, self.c, self.b]), 2)
+        self.assertEqual(self.song_ids(), [self.a, self.c, self.b])
+        self.assertEqual(sorted(self.orders().values()), [0, 1, 2])
+
+    def test_increasing_subsequence(self):
+        subsequence = Playlist_Songs.objects._increasing_subsequence
+        self.assertEqual(subsequence([]), set())
+        self.assertEqual(subsequence([0, 3, 1, 2]), set([0, 2, 3]))
+        self.assertEqual(subsequence([3, 2, 1]), set([2]))
+
+    def test_fill_gaps(self):
+        fill_gaps = Playlist_Songs.objects._fill_gaps
+        self.assertEqual(fill_gaps([0, 30, 10, 20], set([0, 2, 3]), -10, 40),
+                         [0, 5, 10, 20])
+        self.assertEqual(fill_gaps([20, 0, 10], set([1, 2]), -30, 40),
+                         [-15, 0, 10])
+        # moved entries at the end are spread out up to the upper bound
+        self.assertEqual(fill_gaps([0, 10, 5], set([0, 1]), -10, 40),
+                         [0, 10, 25])
+        # no room between kept keys
+        self.assertEqual(fill_gaps([0, 2, 1], set([0, 2]), -10, 10), None)
+
+
+# header of a 128kbps, 44.1kHz, stereo MPEG-1 layer III frame and its size
+FRAME_HEADER = struct.pack('>I', 0xfffb9000)
+FRAME_SIZE = 417
+
+def make_id3_tag(size):
+    """
+    Description: Make an ID3v2 tag of a given size (excluding its header)
+    """
+    if not size:
+        return ''
+    syncsafe = ''.join(chr((size >> shift) & 0x7f) for shift in (21, 14, 7, 0))
+    return 'ID3\x03\x00\x00' + syncsafe + '\x00'*size
+
+
+def make_mp3(num_frames, first_frame='', tag_size=0):
+    """
+    Description: Make an MP3 file of silent frames, with an optional ID3 tag
+                 and data (such as a Xing header) after the header of the
+                 first frame.
+    """
+    frames = [FRAME_HEADER + first_frame.ljust(FRAME_SIZE - 4, '\x00')]
+    frames += [FRAME_HEADER + '\x00'*(FRAME_SIZE - 4)] * (num_frames - 1)
+    return make_id3_tag(tag_size) + ''.join(frames)
+
+
+def xing_header(tag, num_frames):
+    # the header follows 32 bytes of side information
+    return '\x00'*32 + tag + struct.pack('>II', 0x1, num_frames)
+
+
+def vbri_header(num_frames):
+    # the header is 32 bytes after the frame header. Its version, delay,
+    # quality and number of bytes come before the number of frames
+    return '\x00'*32 + 'VBRI' + '\x00'*10 + struct.pack('>I', num_frames)
+
+
+class MP3ParseLengthTest(TestCase):
+    """
+    Description: Tests of getting MP3 lengths from their leading bytes
+                 (mp3info.parse_length)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def parse_length(self, data):
+        audio_start = mp3info.id3_size(data)
+        return mp3info.parse_length(data[audio_start:mp3info.HEAD_BYTES],
+                                    audio_start, len(data))
+
+    def test_id3_size(self):
+        self.assertEqual(mp3info.id3_size(make_id3_tag(1000)), 1010)
+        self.assertEqual(mp3info.id3_size(make_mp3(2)), 0)
+
+    def test_cbr(self):
+        """
+        Length of a CBR file follows from its size and bitrate
+        """
+        self.assertAlmostEqual(self.parse_length(make_mp3(100)),
+                               100 * FRAME_SIZE * 8 / 128000.0)
+
+    def test_cbr_after_id3_tag(self):
+        self.assertAlmostEqual(self.parse_length(make_mp3(100, tag_size=1000)),
+                               100 * FRAME_SIZE * 8 / 128000.0)
+
+    def test_xing(self):
+        """
+        Length of a VBR file follows from the frame count of its Xing header
+        """
+        self.assertAlmostEqual(
+            self.parse_length(make_mp3(100, xing_header('Xing', 5000))),
+            5000 * 1152 / 44100.0)
+
+    def test_info(self):
+        """
+        LAME writes an Info header with the frame count into CBR files
+        """
+        self.assertAlmostEqual(
+            self.parse_length(make_mp3(100, xing_header('Info', 100))),
+            100 * 1152 / 44100.0)
+
+    def test_vbri(self):
+        self.assertAlmostEqual(
+            self.parse_length(make_mp3(100, vbri_header(5000))),
+            5000 * 1152 / 44100.0)
+
+    def test_xing_without_frame_count(self):
+        """
+        A VBR file without a frame count has to be read in full
+        """
+        first_frame = '\x00'*32 + 'Xing' + struct.pack('>I', 0)
+        self.assertRaises(mp3info.MP3InfoError, self.parse_length,
+                          make_mp3(100, first_frame))
+
+    def test_no_frame(self):
+        self.assertRaises(mp3info.MP3InfoError, self.parse_length,
+                          make_id3_tag(1000) + '\x00'*5000)
+
+
+class FileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Description: Request handler of the local file server, which serves the
+                 server's `files` and honours range requests if its `ranges`
+                 is True.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        byte_range = self.headers.getheader('Range')
+        self.server.requests.append(byte_range)
+        match = re.match(r'bytes=(\d+)-(\d+)$', byte_range or '')
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1)
+            body = data[start:end+1]
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MP3LengthTest(TestCase):
+    """
+    Description: Tests of getting the lengths of MP3 files on a file server
+                 (mp3info.mp3_length)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.bytes_sent = 0
+        self.server.ranges = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve(self, data):
+        self.server.files['/song.mp3'] = data
+        return 'http://127.0.0.1:%d/song.mp3' % self.server.server_port
+
+
+    def test_fetches_leading_bytes(self):
+        """
+        Only the first range of the file is fetched
+        """
+        url = self.serve(make_mp3(1000, xing_header('Xing', 1000)))
+        self.assertAlmostEqual(mp3info.mp3_length(url), 1000 * 1152 / 44100.0)
+        self.assertEqual(self.server.requests,
+                         ['bytes=0-%d' % (mp3info.HEAD_BYTES - 1)])
+        self.assertEqual(self.server.bytes_sent, mp3info.HEAD_BYTES)
+
+    def test_large_id3_tag(self):
+        """
+        The frame after an ID3 tag bigger than the first range is fetched with
+        a second range request
+        """
+        url = self.serve(make_mp3(1000, xing_header('Xing', 1000),
+                                  tag_size=20000))
+        self.assertAlmostEqual(mp3info.mp3_length(url), 1000 * 1152 / 44100.0)
+        self.assertEqual(self.server.requests,
+                         ['bytes=0-%d' % (mp3info.HEAD_BYTES - 1),
+                          'bytes=20010-%d' % (20010 + mp3info.FRAME_BYTES - 1)])
+
+    def test_cbr_file_size(self):
+        """
+        The size of a CBR file comes from the Content-Range of a range request
+        """
+        url = self.serve(make_mp3(1000))
+        self.assertAlmostEqual(mp3info.mp3_length(url),
+                               1000 * FRAME_SIZE * 8 / 128000.0)
+        self.assertEqual(self.server.bytes_sent, mp3info.HEAD_BYTES)
+
+    def test_no_range_support(self):
+        """
+        Files of servers that ignore range requests are downloaded in full
+        """
+        self.server.ranges = False
+        data = make_mp3(1000)
+        url = self.serve(data)
+        self.assertAlmostEqual(mp3info.mp3_length(url),
+                               1000 * FRAME_SIZE * 8 / 128000.0, places=1)
+        self.assertEqual(self.server.bytes_sent, len(data))
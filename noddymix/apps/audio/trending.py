@@ -0,0 +1,154 @@
+"""
+Description:
+  Realtime heavy rotation scores kept in redis.
+
+  Songs are scored with the same model as SongRank.set_score:
+      Score = (P)/(T+2)^G
+  where,
+    P = number of song plays of an item
+    T = time (in hours) since last song play
+    G = Gravity
+
+  Right after a song is played T is 0, so its score is P/2^G and each play
+  simply adds 1/2^G to it. That is what the `<key>:score` sorted set holds:
+  every song's score as of its last play. The `<key>:last` hash holds the
+  last play time of each song.
+
+  A song's score only decays after its last play, so the stored score is an
+  upper bound of its current score. To get the top songs we walk the sorted
+  set from the top, decaying each score to the current time, and stop once
+  the stored scores drop below the current scores we already have.
+
+  Play counts accumulate until the data is rebuilt from the SongPlay table by
+  the `rebuild_trending` management command.
+
+Table Of Contents:
+  - record_play: account for a song play in the trending scores
+  - top_songs:   get ids of the top trending songs
+  - rebuild:     rebuild trending scores from song play counts
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis
+import heapq, time
+
+# redis connection used for the trending scores
+conn = get_redis()
+
+
+def score_key():
+    return settings.TRENDING_REDIS_KEY + ':score'
+
+def last_play_key():
+    return settings.TRENDING_REDIS_KEY + ':last'
+
+
+def record_play(song_id, play_time=None):
+    """
+    Description: Account for a song play in the trending scores
+
+    Arguments:   - song_id:   id of Song object that was played
+                 - play_time: unix timestamp of play, defaults to now
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    if play_time is None:
+        play_time = time.time()
+
+    pipe = conn.pipeline()
+    pipe.zincrby(score_key(), song_id, 1 / 2.0**settings.SONG_RANK_GRAVITY)
+    pipe.hset(last_play_key(), song_id, play_time)
+    pipe.execute()
+
+
+def top_songs(num_songs, now=None):
+    """
+    Description: Get the ids of the top trending songs, i.e. those with the
+                 highest current scores and played in the last
+                 `HEAVY_ROTATION_DAYS` days.
+
+    Arguments:   - num_songs: number of songs to get
+                 - now:       unix timestamp to compute scores at
+    Return:      list of Song object ids, highest scores first
+
+    Author:      Nnoduka Eruchalu
+    """
+    if now is None:
+        now = time.time()
+    start = now - settings.HEAVY_ROTATION_DAYS*24*60*60
+
+    # min-heap of the (current score, song id) of the top songs so far
+    top = []
+    offset = 0
+    while True:
+        scores = conn.zrevrange(score_key(), offset, offset+num_songs-1,
+                                withscores=True)
+        if not scores:
+            break
+        last_plays = conn.hmget(last_play_key(), [s[0] for s in scores])
+
+        for (song_id, score), last_play in zip(scores, last_plays):
+            if len(top) == num_songs and score <= top[0][0]:
+                # stored scores are upper bounds of current scores so no
+                # other song can make it to the top
+                return [int(s[1]) for s in sorted(top, reverse=True)]
+
+            if last_play is None or float(last_play) < start:
+                continue
+
+            # decay the score from its last play time to now
+            hours = (now - float(last_play))/3600.0
+            score *= (2.0/(hours + 2.0))**settings.SONG_RANK_GRAVITY
+            if len(top) < num_songs:
+                heapq.heappush(top, (score, song_id))
+            else:
+                heapq.heappushpop(top, (score, song_id))
+
+        offset += num_songs
+
+    return [int(s[1]) for s in sorted(top, reverse=True)]
+
+
+def rebuild(play_counts):
+    """
+    Description: Replace the trending scores with scores computed from song
+                 play counts. The new data is built on temporary keys then
+                 swapped in, so readers never see it partially built.
+
+    Arguments:   - play_counts: iterable of dictionaries with keys:
+                   - song:      id of Song object
+                   - num_plays: number of plays
+                   - last_play: datetime of last play
+    Return:      (int) number of songs with trending scores
+
+    Author:      Nnoduka Eruchalu
+    """
+    tmp_score_key = score_key() + ':tmp'
+    tmp_last_play_key = last_play_key() + ':tmp'
+    conn.delete(tmp_score_key, tmp_last_play_key)
+
+    num_songs = 0
+    pipe = conn.pipeline(transaction=False)
+    for play_count in play_counts:
+        pipe.zadd(tmp_score_key, play_count['num_plays'] /
+                  2.0**settings.SONG_RANK_GRAVITY, play_count['song'])
+        pipe.hset(tmp_last_play_key, play_count['song'],
+                  time.mktime(play_count['last_play'].timetuple()))
+        num_songs += 1
+        if num_songs % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+
+    # swap in the new data [renaming a missing key is an error]
+    pipe = conn.pipeline()
+    if num_songs:
+        pipe.rename(tmp_score_key, score_key())
+        pipe.rename(tmp_last_play_key, last_play_key())
+    else:
+        pipe.delete(score_key(), last_play_key())
+    pipe.execute()
+    return num_songs
@@ -0,0 +1,77 @@
+"""
+Description:
+  Utility functions associated with the audio app
+
+Table Of Contents:
+  - song_json_cache_key:    cache key of a song's serialized player json
+  - invalidate_song_json:   drop the cached player json of some songs
+  - song_featuring_handler: invalidate cached json on featured artist changes
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.cache import cache
+
+
+def song_json_cache_key(song_id, is_mobile):
+    """
+    Description: Get the cache key of a song's serialized player json. Mobile
+                 and desktop clients get different posters so are cached
+                 separately.
+
+    Arguments:   - song_id:   id of Song object
+                 - is_mobile: is this the json for a mobile device?
+    Return:      (str) cache key
+
+    Author:      Nnoduka Eruchalu
+    """
+    return 'song_json:%s:%d' % ('mobile' if is_mobile else 'desktop', song_id)
+
+
+def invalidate_song_json(song_ids):
+    """
+    Description: Drop the cached player json (both mobile and desktop variants)
+                 of the given songs so it's rebuilt on next request.
+
+    Arguments:   - song_ids: iterable of Song object ids
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    keys = []
+    for song_id in song_ids:
+        keys.append(song_json_cache_key(song_id, True))
+        keys.append(song_json_cache_key(song_id, False))
+    cache.delete_many(keys)
+
+
+def song_featuring_handler(sender, instance, action, reverse, model, pk_set,
+                           **kwargs):
+    """
+    Description: Receiver function for m2m_changed signal of Song.featuring.
+                 A song's artist string includes its featured artists so any
+                 change to that set invalidates the song's cached json.
+
+    Arguments:   - sender:   intermediate model of Song.featuring
+                 - instance: Song (or Artist, if reverse) being changed
+                 - action:   type of update done on the relation
+                 - reverse:  is the relation updated from the Artist side?
+                 - model:    class of objects added/removed from relation
+                 - pk_set:   primary keys of those objects
+                 - **kwargs
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_song_json([instance.pk])
+
+    elif action in ('post_add', 'post_remove'):
+        invalidate_song_json(pk_set)
+
+    elif action == 'pre_clear':
+        # an artist is being removed from all songs it's featured on, so grab
+        # those songs while they can still be found.
+        invalidate_song_json(instance.song_set.values_list('id', flat=True))
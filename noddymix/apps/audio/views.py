@@ -4,21 +4,26 @@ from django.template import RequestContext
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.contrib.auth.decorators import login_required
 from django.template.loader import render_to_string
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.core.cache import cache
 import urllib, json
 
 from noddymix.apps.audio.models import Song, Playlist, Playlist_Songs, Album, \
     SongPlay, SongRank
 from noddymix.apps.account.models import User
-from noddymix.apps.relationship.models import Following
-from noddymix.apps.activity.models import Activity
+from noddymix.apps.relationship.views import get_following_statuses
 from noddymix.apps.activity import activity
-from noddymix.utils import users_helper, list_dedup
+from noddymix.apps.audio.utils import song_json_cache_key
+from noddymix.apps.audio import trending, playbuffer, playhistory
+from noddymix.utils import users_helper, list_dedup, get_cursor, \
+    keyset_helper
 
 #imports for pagination
 from django.conf import settings
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
-import copy
+import copy, redis
 
 
 def check_session_playlists(request):
@@ -181,13 +186,15 @@ def get_session_history(request):
     """
     # first ensure the history exists
     check_session_history(request)
+    # histories saved before plays were deduped on update could have repeats
     return list_dedup(request.session['history'])[:settings.SONGS_PER_PAGE]
 
 
 def update_session_history(request, song):
     """
     Description: Update the given session object's history with the id of a song
-                 that has just been played
+                 that has just been played. An earlier play of the song is
+                 dropped from the history.
                  
     Arguments:   - request:  HttpRequest object
                  - song:     id of song to add to history
@@ -197,10 +204,12 @@ def update_session_history(request, song):
     """
     # first ensure the history exists
     check_session_history(request)
-    # then update the history with new song (id) addition
-    request.session['history'].insert(0, song)
-    request.session['history'] = \
-        request.session['history'][:settings.SONGS_PER_PAGE]
+    # then move the song (id) to the front of the history, so it never has
+    # repeats
+    history = [song_id for song_id in request.session['history'] 
+               if song_id != song]
+    history.insert(0, song)
+    request.session['history'] = history[:settings.SONGS_PER_PAGE]
 
 
 def get_song_artists(song):
@@ -285,30 +294,144 @@ def setup_song_json(song, is_mobile):
     return song_json
 
 
+def prefetch_songs(songs):
+    """
+    Description: Load the artist, album and featured artists of a collection of
+                 Song objects in a constant number of queries, so serializing
+                 them doesn't cost 3 queries per song.
+                 - A QuerySet is simply evaluated with its relations joined in
+                   and featured artists prefetched.
+                 - Any other iterable of Song objects (search results, heavy
+                   rotation, history) is reloaded in bulk by id and returned
+                   in the original order.
+                 
+    Arguments:   - songs: QuerySet or list of Song objects
+    Return:      list of Song objects with related objects already loaded
+    
+    Author:      Nnoduka Eruchalu
+    """
+    if isinstance(songs, QuerySet):
+        return list(songs.select_related('artist', 'album')
+                    .prefetch_related('featuring'))
+    
+    songs = list(songs)
+    songs_map = Song.objects.select_related('artist', 'album')\
+        .prefetch_related('featuring').in_bulk([song.id for song in songs])
+    # songs could have been deleted since being listed, so skip those
+    return [songs_map[song.id] for song in songs if song.id in songs_map]
+
+
 def setup_songs_json(songs, is_mobile):
     """
     Description: Parse a QuerySet of Songs into a list of json representations
                  for each song.
+                 Song representations are cached, so all songs on the page are
+                 fetched from the cache in one round-trip. Only the songs that
+                 missed are built, and all their related objects are loaded up
+                 front so the cost of this doesn't grow with the number of
+                 songs.
                  
-    Arguments:   - songs: QuerySet of Song objects
+    Arguments:   - songs: QuerySet or list of Song objects
                  - is_mobile: is request coming from a mobile device?
     Return:      list of song representation dictionaries.
     
     Author:      Nnoduka Eruchalu
     """
+    songs = list(songs)
+    keys = dict((song.id, song_json_cache_key(song.id, is_mobile))
+                for song in songs)
+    cached = cache.get_many(keys.values())
+    
+    # build and cache the representations of songs that missed
+    missing = [song for song in songs if keys[song.id] not in cached]
+    if missing:
+        built = {}
+        for song in prefetch_songs(missing):
+            built[keys[song.id]] = setup_song_json(song, is_mobile)
+        cache.set_many(built, settings.SONG_JSON_CACHE_TIMEOUT)
+        cached.update(built)
+    
     songs_json = []
     for song in songs:
-        songs_json.append(setup_song_json(song, is_mobile))
+        if keys[song.id] in cached:
+            songs_json.append(cached[keys[song.id]])
     return songs_json
 
 
-def songs_helper_json(request, songs_list):
+def get_row_songs(rows, song_field):
+    """
+    Description: Get the Song objects referenced by a list of objects
+                 
+    Arguments:   - rows:       list of objects
+                 - song_field: name of field that references a Song object on
+                               each of `rows`. If None, `rows` are Songs.
+    Return:      list of Song objects
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    if song_field is None:
+        return rows
+    return [getattr(row, song_field) for row in rows]
+
+
+def songs_keyset_helper_json(request, songs_list, ordering, song_field=None):
+    """
+    Description: Paginate a QuerySet of Song objects by cursor (see
+                 keyset_helper) and generate the properly formatted response
+                 object.
+                 The total number of pages is never counted, and the page
+                 numbers are those given by the client in GET param `page`.
+                 
+    Arguments:   - request:    HttpRequest object
+                 - songs_list: QuerySet of Song objects, or of objects that
+                               reference Song objects
+                 - ordering:   fields to order `songs_list` by
+                 - song_field: name of field that references a Song object on
+                               objects of `songs_list`, if they aren't Songs.
+    Return:      Dictionary with following keys:
+                 - songs: JSON-formatted representation of Song objects that
+                          made it to current page
+                 - curr_page:   current page
+                 - prev_page:   previous page [0 if on first page]
+                 - next_page:   next page [0 if on last page]
+                 - next_cursor: cursor of next page ['' if on last page]
+                 
+    Author:      Nnoduka Eruchalu
+    """
+    context = keyset_helper(request, songs_list, ordering,
+                            settings.SONGS_PER_PAGE)
+    
+    try:
+        page = max(int(request.GET.get('page')), 1)
+    except (TypeError, ValueError):
+        page = 1
+    
+    songs = get_row_songs(context['objects'], song_field)
+    return {
+        'songs':setup_songs_json(songs, request.mobile),
+        'curr_page':page,
+        'prev_page':page - 1,
+        'next_page':page + 1 if context['next_cursor'] else 0,
+        'next_cursor':context['next_cursor'],
+        }
+
+
+def songs_helper_json(request, songs_list, ordering=None, song_field=None):
     """
     Description: Paginate a list of Song objects and generate the properly
                  formatted response object
+                 If the list can be paginated by cursor (i.e. `ordering` is
+                 provided), then a GET param `cursor` switches to cursor
+                 pagination (see songs_keyset_helper_json), and page number
+                 responses include the cursor of the next page.
                  
     Arguments:   - request:    HttpRequest object
-                 - songs_list: list of Song objects
+                 - songs_list: list of Song objects, or QuerySet of objects that
+                               reference Song objects
+                 - ordering:   fields to order `songs_list` by, if it can be
+                               paginated by cursor
+                 - song_field: name of field that references a Song object on
+                               objects of `songs_list`, if they aren't Songs.
     Return:      Dictionary with following keys:
                  - songs: JSON-formatted representation of Song objects that
                           made it to current page
@@ -316,9 +439,17 @@ def songs_helper_json(request, songs_list):
                  - prev_page: previous page [1-indexed, and 0 if on first page]
                  - next_page: next page [1-indexed, and 0 if on last page]
                  - num_pages: total number of pages
+                 - next_cursor: cursor of next page ['' if on last page]. Only
+                                present if `ordering` is provided.
                  
     Author:      Nnoduka Eruchalu
     """
+    if ordering:
+        if 'cursor' in request.GET:
+            return songs_keyset_helper_json(request, songs_list, ordering,
+                                            song_field)
+        songs_list = songs_list.order_by(*ordering)
+    
     paginator = Paginator(songs_list, settings.SONGS_PER_PAGE)
     
     page = request.GET.get('page')
@@ -344,30 +475,44 @@ def songs_helper_json(request, songs_list):
     else:
         prev_page_num = 0
     
-    songs = songs.object_list
-    songs_json = setup_songs_json(songs, request.mobile)
-    return {
+    rows = list(songs.object_list)
+    songs_json = setup_songs_json(get_row_songs(rows, song_field),
+                                  request.mobile)
+    songs_json_dict = {
         'songs':songs_json,
         'curr_page':page,
         'prev_page':prev_page_num,
         'next_page':next_page_num,
         'num_pages':paginator.num_pages,
         }
+    
+    if ordering:
+        # let clients switch to cursor pagination from here on
+        songs_json_dict['next_cursor'] = \
+            get_cursor(rows[-1], ordering) if next_page_num else ''
+    
+    return songs_json_dict
 
 
-def songs_helper(request, songs_list):
+def songs_helper(request, songs_list, ordering=None, song_field=None):
     """
     Description: Paginate a list of Song objects, generate the properly
                  formatted response object and return it as a json HttpResponse
                  - see songs_helper_json
                  
     Arguments:   - request:    HttpRequest object
-                 - songs_list: list of Song objects
+                 - songs_list: list of Song objects, or QuerySet of objects that
+                               reference Song objects
+                 - ordering:   fields to order `songs_list` by, if it can be
+                               paginated by cursor
+                 - song_field: name of field that references a Song object on
+                               objects of `songs_list`, if they aren't Songs.
     Return:      HttpResponse with json data
                  
     Author:      Nnoduka Eruchalu
     """
-    songs_json_dict = songs_helper_json(request, songs_list)
+    songs_json_dict = songs_helper_json(request, songs_list, ordering,
+                                        song_field)
     
     json_response = json.dumps(songs_json_dict)
     return HttpResponse(json_response, content_type="application/json")
@@ -445,29 +590,71 @@ def playlists_helper(request, playlists_list):
 
 def setup_playlists_json(playlists, request):
     """
-    parse a list of playlists into the format expected by a mobile client
-    escription: Parse a QuerySet of Playlists into a list of json-formatted
-               representations for each Playlist object.
+    Description: Parse a list of Playlists into a list of json-formatted
+                 representations for each Playlist object.
+                 This is done in a fixed number of queries, regardless of the
+                 number of playlists:
+                 - owners and cover albums not already loaded (such as with
+                   select_related) are each fetched in one query
+                 - the requesting user's subscriptions among the playlists
+                   are fetched in one query
                  
-    Arguments:   - songs: QuerySet of Playlist objects
-                 - request: HttpRequest object.
+    Arguments:   - playlists: list or QuerySet of Playlist objects
+                 - request:   HttpRequest object.
     Return:      list of playlist representation dictionaries.
     
     Author:      Nnoduka Eruchalu
     """
+    playlists = list(playlists)
+    prefetch_playlist_relations(playlists)
+    
+    subscribed_ids = set()
+    if request.user.is_authenticated() and playlists:
+        subscribed_ids = set(request.user.subscriptions.filter(
+                id__in=[playlist.id for playlist in playlists]).values_list(
+                'id', flat=True))
+    
     playlists_json = []
     for playlist in playlists:
-        playlists_json.append(setup_playlist_json(playlist, request))
+        playlists_json.append(setup_playlist_json(
+                playlist, request, playlist.id in subscribed_ids))
     return playlists_json
 
 
-def setup_playlist_json(playlist, request):
+def prefetch_playlist_relations(playlists):
+    """
+    Description: Load the owner and cover album of each of a list of playlists
+                 with one query per relation, skipping those already loaded.
+                 
+    Arguments:   - playlists: list of Playlist objects
+    Return:      None
+    
+    Author:      Nnoduka Eruchalu
+    """
+    for field, cache_name, model in (
+        ('owner_id', '_owner_cache', User),
+        ('cover_album_id', '_cover_album_cache', Album)):
+        missing = [playlist for playlist in playlists
+                   if not hasattr(playlist, cache_name)]
+        ids = set(getattr(playlist, field) for playlist in missing)
+        ids.discard(None)
+        objects = model.objects.in_bulk(list(ids)) if ids else {}
+        for playlist in missing:
+            related_id = getattr(playlist, field)
+            if related_id is None or related_id in objects:
+                setattr(playlist, cache_name, objects.get(related_id))
+
+
+def setup_playlist_json(playlist, request, subscribed=None):
     """
     Description: Convert a Playlist object to a json representation for a mobile
                  client.
                  
-    Arguments:   - playlist: Playlist object instance
-                 - request:  HttpRequest object
+    Arguments:   - playlist:   Playlist object instance
+                 - request:    HttpRequest object
+                 - subscribed: is request's user subscribed to this playlist?
+                               If None this is looked up in the db. Pass it in
+                               when serializing many playlists.
     Return:      Dictionary representation of Song object with keys:
                  - id:          Playlist Id in db
                  - title:       Playlist title
@@ -480,23 +667,23 @@ def setup_playlist_json(playlist, request):
     
     Author:      Nnoduka Eruchalu
     """
-    subscribed = False # start by assuming requesting user isn't subscribed
-    
     # subscription and public/private status only apply to authenticated users
-    if request.user.is_authenticated():
-        if (request.user != playlist.owner):
-            # subscription status only applies to users that dont own playlist
-            if (playlist in request.user.subscriptions.all()):
-                subscribed = True
-    
+    # and subscription status only applies to users that dont own playlist
+    if request.user.is_authenticated() and \
+            request.user.id != playlist.owner_id:
+        if subscribed is None:
+            subscribed = request.user.subscriptions.filter(
+                id=playlist.id).exists()
+    else:
+        subscribed = False
         
     playlist_json = {
         'id':playlist.id,
         'num_songs':playlist.num_songs,
         'title':playlist.title,
         'owner':playlist.owner.get_full_name(),
-        'owner_id':playlist.owner.id,
-        'subscribed':subscribed,
+        'owner_id':playlist.owner_id,
+        'subscribed':bool(subscribed),
         'is_public':playlist.is_public
         }
             
@@ -596,8 +783,9 @@ def new_releases(request):
     Author:      Nnoduka Eruchalu
     """    
     if request.is_ajax():
-        songs_list = Song.objects.all().order_by('-date_added')
-        return songs_helper(request, songs_list)
+        # newest songs first, with id breaking ties for cursor pagination
+        songs_list = Song.objects.all()
+        return songs_helper(request, songs_list, ordering=('-date_added','-id'))
     
     if request.mobile:
         return render_to_response('index.html')
@@ -610,6 +798,9 @@ def heavy_rotation(request):
     """
     Description: Heavy rotation songs: i.e. top played songs over the last few
                  days.
+                 These come from the realtime trending scores in redis. If
+                 redis is unavailable (or has no scores yet) fall back to the
+                 song ranks periodically computed in the db.
                  
                  A mobile page will be redirected to the homepage
     
@@ -619,11 +810,20 @@ def heavy_rotation(request):
     Author:      Nnoduka Eruchalu
     """
     if request.is_ajax():
-        # use select_related('song') so as to only hit the database when getting
-        # the SongRank objects
-        songs_list = [songrank.song for songrank in
-                      SongRank.objects.select_related('song').all()
-                      .order_by('-score')[:settings.SONGS_PER_PAGE]]
+        try:
+            song_ids = trending.top_songs(settings.SONGS_PER_PAGE)
+        except redis.exceptions.RedisError:
+            song_ids = []
+        
+        if song_ids:
+            songs_map = Song.objects.in_bulk(song_ids)
+            songs_list = [songs_map[id] for id in song_ids if id in songs_map]
+        else:
+            # use select_related('song') so as to only hit the database when
+            # getting the SongRank objects
+            songs_list = [songrank.song for songrank in
+                          SongRank.objects.select_related('song').all()
+                          .order_by('-score')[:settings.SONGS_PER_PAGE]]
         return songs_helper(request, songs_list)
     
     # a mobile page shouldn't make a direct request here
@@ -645,8 +845,8 @@ def top_playlists(request):
                                   
     Author:      Nnoduka Eruchalu
     """
-    playlists_list = Playlist.objects.all().order_by('-num_subscribers',
-                                                     '-num_songs')
+    playlists_list = Playlist.objects.select_related(
+        'owner', 'cover_album').order_by('-num_subscribers', '-num_songs')
     playlists_context = playlists_helper(request, playlists_list)
     
     if request.is_ajax():
@@ -683,7 +883,9 @@ def favorites(request):
     Author:      Nnoduka Eruchalu
     """
     if request.user.is_authenticated():
-        playlists_list = request.user.subscriptions.filter(is_public=True).order_by('title', '-num_songs')
+        playlists_list = request.user.subscriptions.filter(
+            is_public=True).select_related('owner', 'cover_album').order_by(
+            'title', '-num_songs')
     else:
         playlists_list = [] 
     playlists_context = playlists_helper(request, playlists_list)
@@ -724,7 +926,9 @@ def playlists(request):
         
         if request.user.is_authenticated():
             # handle authenticated users
-            playlists_list = Playlist.objects.filter(owner=request.user).order_by('-date_added')
+            playlists_list = Playlist.objects.filter(
+                owner=request.user).select_related(
+                'owner', 'cover_album').order_by('-date_added')
             playlists_context = playlists_helper(request, playlists_list)
             playlists_context['playlists'] = \
                 setup_playlists_json(playlists_context['playlists'], request)
@@ -752,7 +956,7 @@ def playlists(request):
 def history(request):
     """
     Description: History: i.e. a user's recently played songs
-                 For authenticated users this is in the Activity table
+                 For authenticated users this is in redis (see playhistory)
                  For anonymous users this is in request.session
                              
     Arguments:   - request: HttpRequest object
@@ -762,19 +966,20 @@ def history(request):
     """
     if request.is_ajax():
         if request.user.is_authenticated():
-            # for logged in users get from Activity table
-            play_activities = Activity.objects.filter(
-                actor=request.user, verb="played")[:settings.SONGS_PER_PAGE]
-            songs_list = [a.target for a in play_activities]
-            # mysql cant do SELECT DISTINCT ON, so do this:
-            songs_list = list_dedup(songs_list)
+            # for logged in users get from their redis play history, which is
+            # deduped as it's updated (mysql cant do SELECT DISTINCT ON)
+            try:
+                song_ids = playhistory.song_ids(request.user.id)
+            except redis.exceptions.RedisError:
+                song_ids = playhistory.db_song_ids(request.user.id)
         else:
             # for anonymous users, history in session
-            session_history = get_session_history(request)
-            songs_list = Song.objects.filter(id__in=session_history)
-            # __in doesn't maintain the order of playlist['songs'] so fix that
-            songs_list = list(songs_list)
-            songs_list.sort(key=lambda song: session_history.index(song.id))
+            song_ids = get_session_history(request)
+        
+        # in_bulk doesn't maintain the order of the history so fix that
+        songs = Song.objects.in_bulk(song_ids)
+        songs_list = [songs[song_id] for song_id in song_ids 
+                      if song_id in songs]
         return songs_helper(request, songs_list)        
     
     # a mobile page shouldn't make a direct request here
@@ -822,7 +1027,8 @@ def userplaylists(request, id):
     
     if request.is_ajax():
         # only a mobile page will call this
-        playlists_list = Playlist.objects.filter(owner=user)
+        playlists_list = Playlist.objects.filter(owner=user).select_related(
+            'owner', 'cover_album')
         playlists_context = playlists_helper(request, playlists_list)
         playlists_context['playlists'] = \
             setup_playlists_json(playlists_context['playlists'], request)
@@ -873,6 +1079,8 @@ def song_play(request, id):
     """
     Description: Callback for handling a song being played.
                  Increments play count for that song.
+                 With `PLAY_BUFFER_ENABLED` the play is buffered in redis and
+                 the database writes are left to the flush_plays command.
                  Has to be an ajax and POST request
                              
     Arguments:   - request: HttpRequest object
@@ -883,17 +1091,44 @@ def song_play(request, id):
     """
     if request.is_ajax() and (request.method=="POST"):
         song = get_object_or_404(Song, id=id)
-        song.num_plays += 1
-        song.save()
+        try:
+            trending.record_play(song.id)
+        except redis.exceptions.RedisError:
+            # rebuild_trending will catch up on this play
+            pass
         
-        # account for this song play
-        SongPlay.objects.create(song=song)
+        user_id = request.user.id if request.user.is_authenticated() else None
+        buffered = False
+        if settings.PLAY_BUFFER_ENABLED:
+            # leave the database writes to the flush_plays command
+            try:
+                playbuffer.push(song.id, user_id)
+                buffered = True
+            except redis.exceptions.RedisError:
+                pass
         
-        # log this activity in the activity streams
-        if request.user.is_authenticated():
-            activity.send(request.user, verb="played", target=song)
-        else:
+        if not buffered:
+            # play counts aren't part of a song's cached json, so update the
+            # count directly instead of going through Song.save()
+            Song.objects.filter(id=song.id).update(
+                num_plays=F('num_plays') + 1)
+            
+            # account for this song play
+            SongPlay.objects.create(song=song)
+            
+            # log this activity in the activity streams
+            if user_id is not None:
+                activity.send(request.user, verb="played", target=song)
+        
+        if user_id is None:
             update_session_history(request, song.id)
+        else:
+            try:
+                playhistory.push(user_id, song.id)
+            except redis.exceptions.RedisError:
+                # history is read from the db while redis is down, and a
+                # history that missed plays is rebuilt once it expires
+                pass
         return HttpResponse(json.dumps({}), content_type="application/json")
             
     # this can only be called via ajax
@@ -917,14 +1152,18 @@ def playlist(request, id):
     playlist = get_object_or_404(Playlist, id=id)
     
     if request.is_ajax():
+        # paginate the playlist's entries (in playlist order) so they can be
+        # paginated by cursor
         if playlist.is_public or (playlist.owner==request.user):
-            songs_list = playlist.songs.all().order_by(
-                "playlist_songs", "-date_added")
+            songs_list = Playlist_Songs.objects.filter(
+                playlist=playlist).select_related('song')
         else:
-            songs_list = []
+            songs_list = Playlist_Songs.objects.none()
         
         # get song details dictionary
-        songs_json_dict = songs_helper_json(request, songs_list)
+        songs_json_dict = songs_helper_json(request, songs_list,
+                                            ordering=('order', 'id'),
+                                            song_field='song')
         songs_json_dict['header'] = render_to_string(
             'audio/header_playlist.html',
             {'playlist':playlist,
@@ -969,10 +1208,13 @@ def playlist_details_json(request, id):
     # check for playlist object to throw a 404 early on (if necessary)
     playlist = get_object_or_404(Playlist, id=id)
     
-    songs_list = playlist.songs.all().order_by("playlist_songs", "-date_added")
+    songs_list = Playlist_Songs.objects.filter(
+        playlist=playlist).select_related('song')
             
     # get song details dictionary
-    songs_json_dict = songs_helper_json(request, songs_list)
+    songs_json_dict = songs_helper_json(request, songs_list,
+                                        ordering=('order', 'id'),
+                                        song_field='song')
     songs_json_dict['title'] = playlist.title
                     
     json_response = json.dumps(songs_json_dict)
@@ -1109,8 +1351,9 @@ def playlist_temp_new(request):
 def playlist_order_songs(request, id):
     """
     Description: Reorder the songs in a playlist to match the given order of
-                 song ids (in a POST parameter). When ordering keep the 
-                 current page in mind.
+                 song ids (in a POST parameter). These are the songs of the
+                 current page, and they are reordered amongst the positions
+                 they already occupy so the other pages are left alone.
                  Only an authenticated user that owns the playlist can actually
                  reorder songs.
                  This view function expects all calls to be ajax and POSTs.
@@ -1130,43 +1373,10 @@ def playlist_order_songs(request, id):
         # convert this to integer list
         songs = map(int, songs)
         
-        # get page of results
-        page = request.POST.get('page')
-        try:
-            page = int(page)
-        except ValueError:
-            page = 1
-        
-        # get playlist_songs m2m intermediary object for this playlist
-        playlist_songs = Playlist_Songs.objects.filter(
-            playlist=playlist).order_by('order')
-        
-        # get the `order` offset for the songs to be sorted
-        order_offset = 0
-        if page > 1:
-            try:
-                order_offset = \
-                    playlist_songs[settings.SONGS_PER_PAGE*(page-1)-1].order \
-                    + 1;
-            except IndexError:
-                pass
-        
-        # now limit the intermediary page object to the songs to be sorted
-        playlist_songs = playlist_songs.filter(song_id__in=songs)
-        # loop through them, and update the `order` to the index in the received
-        # songs array
-        for playlist_song in playlist_songs:
-            try:
-                # when saving the order keep in mind that playlists could be
-                # paginated
-                playlist_song.order = songs.index(playlist_song.song.id) + \
-                    order_offset
-                playlist_song.save()
-            except ValueError:
-                pass
-                
-        # in the event that songs were deleted, refresh playlist
-        playlist.save()
+        # only the songs that moved are written
+        if Playlist_Songs.objects.reorder(playlist, songs):
+            # the first song might have changed
+            playlist.refresh_cover_album()
         
         return HttpResponse(json.dumps({}), content_type="application/json")
     
@@ -1245,21 +1455,25 @@ def playlist_add_songs(request, id):
         songs =  request.POST.getlist('songs[]')
         # convert this to integer list
         songs = map(int, songs)
-        # now loop through and create these songs if necessary
-        for song in songs:        
-            Playlist_Songs.objects.get_or_create(
-                playlist=playlist, song_id=song)
+        # now add the songs that aren't in the playlist already, in one go
+        added = Playlist_Songs.objects.add_songs(playlist, songs)
         
-        # and now refresh playlist
-        playlist.save()
-        # log this activity
-        if len(songs)==1:
-            activity.send(request.user, verb="added",
-                          object=Song.objects.get(id=songs[0]), target=playlist)
-        else:
-            activity.send(request.user, verb="updated", target=playlist)
+        if added:
+            # and now refresh playlist's stats
+            Playlist.objects.increment('num_songs', [playlist.id], len(added))
+            playlist.num_songs += len(added)
+            if playlist.num_songs == len(added):
+                # these are the playlist's first songs so it needs a cover
+                playlist.refresh_cover_album()
+            
+            # log this activity, once for all the songs
+            if len(added)==1:
+                activity.send(request.user, verb="added",
+                              object=Song.objects.get(id=added[0]),
+                              target=playlist)
+            else:
+                activity.send(request.user, verb="updated", target=playlist)
         
-                
         return HttpResponse(json.dumps({'num_songs':playlist.num_songs}), 
                             content_type="application/json")
     
@@ -1327,13 +1541,14 @@ def playlist_delete_songs(request, id):
         # convert this to integer list
         songs = map(int, songs)
                 
-        # get playlist_songs to delete for this playlist
-        playlist_songs = Playlist_Songs.objects.filter(
-            playlist=playlist, song_id__in=songs)
-        # delete these songs
-        playlist_songs.delete()
-        # and now refresh playlist
-        playlist.save()
+        # delete these songs from this playlist
+        num_removed = Playlist_Songs.objects.remove_songs(playlist, songs)
+        if num_removed:
+            # and now refresh playlist's stats
+            Playlist.objects.increment('num_songs', [playlist.id], 
+                                       -num_removed)
+            playlist.num_songs -= num_removed
+            playlist.refresh_cover_album()
 
         return HttpResponse(json.dumps({'num_songs':playlist.num_songs}), 
                             content_type="application/json")
@@ -1401,7 +1616,7 @@ def playlist_rename(request, id):
             # only save new title if it actually has content
             try:
                 playlist.title = new_title
-                playlist.save()
+                playlist.save(update_fields=['title'])
             except:
                 # if that failed, then reset playlist title because
                 # this has to be returned
@@ -1514,7 +1729,7 @@ def playlist_lock(request, id):
     if request.is_ajax() and (request.method=="POST") and \
             (request.user==playlist.owner):
         playlist.is_public = False
-        playlist.save()
+        playlist.save(update_fields=['is_public'])
         json_response = json.dumps({
                 'status': 'public' if playlist.is_public else 'private',
                 })
@@ -1542,7 +1757,7 @@ def playlist_unlock(request, id):
     if request.is_ajax() and (request.method=="POST") and \
             (request.user==playlist.owner):
         playlist.is_public = True
-        playlist.save()
+        playlist.save(update_fields=['is_public'])
         json_response = json.dumps({
                 'status': 'public' if playlist.is_public else 'private',
                 })
@@ -1571,13 +1786,7 @@ def playlist_subscribers(request, id):
         # subscribers with information on if this user is following them
         subscribers_all = playlist.subscribers.all()
         template_context = users_helper(request, subscribers_all)
-        following_list = template_context['users']
-        following_status = []
-        for followed in following_list:
-            following_status.append(
-                Following.objects.is_following(request.user.id, followed))
-        
-        following = zip(following_list, following_status)
+        following = get_following_statuses(request, template_context['users'])
         del template_context['users']
         
         template_context['content'] = render_to_string(
@@ -1614,13 +1823,13 @@ def playlist_subscribe(request, id):
     
     if request.is_ajax() and (request.method=="POST") and \
             (request.user!=playlist.owner):
-        playlist.subscribers.add(request.user)
-        playlist.save()
+        subscribed = playlist.subscribe(request.user)
         json_response = json.dumps({
                 'status': 'subscribed',
                 })
         # log this activity
-        activity.send(request.user, verb="favorited", target=playlist)        
+        if subscribed:
+            activity.send(request.user, verb="favorited", target=playlist)
         return HttpResponse(json_response, content_type="application/json")
     
     # coming this far isnt legit
@@ -1645,8 +1854,7 @@ def playlist_unsubscribe(request, id):
     
     if request.is_ajax() and (request.method=="POST") and \
             (request.user!=playlist.owner):
-        playlist.subscribers.remove(request.user)
-        playlist.save()
+        playlist.unsubscribe(request.user)
         json_response = json.dumps({
                 'status': 'subscribe',
                 })
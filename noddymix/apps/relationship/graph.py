@@ -0,0 +1,376 @@
+"""
+Description:
+  Social graph cache kept in redis.
+
+  Each user's following and followers are cached as redis sets of user ids:
+    - `<key>:following:<user id>`: ids of users the user follows
+    - `<key>:followers:<user id>`: ids of users following the user
+  Every cached set also holds the id 0 (user ids start at 1), so a user with
+  no followers still has a set and a missing set means the cache is cold for
+  that user. Cold sets are loaded from the db on first read, and expire after
+  `RELATIONSHIP_CACHE_TIMEOUT` seconds so any drift is short-lived.
+
+  Following.save/delete keep the cached sets up to date. Writes only touch
+  sets that are already cached, so a partially loaded set is never mistaken
+  for a complete one. Writes also bump a version counter of each set they
+  touch, `<set key>:version`, whether it is cached or not, and cold sets are
+  loaded under a WATCH of their version. So a set read from the db before a
+  follow or unfollow was saved isn't cached over the change: the load is
+  retried with fresh ids.
+
+  These sets are also read by the Node.js feed (nodejs/feed.js) to find the
+  rooms a user should join. Follows and unfollows are published to the
+  realtime feed's channel, so the Server-Sent Events gateway
+  (gateway/gateway.py) can apply them to the user's open streams.
+
+Table Of Contents:
+  - add:             cache a new follow
+  - remove:          uncache a follow
+  - remove_user:     uncache all follows of a deleted user
+  - publish_follow:  tell the realtime feed gateway about a follow change
+  - following_ids:   ids of users a user follows
+  - follower_ids:    ids of users following a user
+  - is_following:    is a user following another?
+  - followed_subset: which of a list of users is a user following?
+  - mutual_ids:      ids of users a user follows that follow them back
+  - rebuild:         reload the whole graph from the db
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.conf import settings
+from noddymix.utils import get_redis
+import json, redis
+
+# redis connection used for the social graph
+conn = get_redis()
+
+# id cached with every set, marking it as loaded
+SENTINEL = 0
+
+# attempts at loading a set while follows keep changing it
+LOAD_ATTEMPTS = 3
+
+# add members to those of the given sets that are cached
+# KEYS: sets, ARGV: member to add to the set with the same index
+sadd_if_cached = conn.register_script("""
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('SADD', key, ARGV[i])
+    end
+end
+""")
+
+
+def following_key(user_id):
+    return '%s:following:%d' % (settings.RELATIONSHIP_REDIS_KEY, user_id)
+
+def followers_key(user_id):
+    return '%s:followers:%d' % (settings.RELATIONSHIP_REDIS_KEY, user_id)
+
+def version_key(key):
+    return '%s:version' % key
+
+
+def bump_versions(pipe, keys):
+    """
+    Description: Bump the version counters of sets, so loads of them that are
+                 under way start over
+
+    Arguments:   - pipe: redis pipeline to queue the commands on
+                 - keys: keys of sets
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    for key in keys:
+        pipe.incr(version_key(key))
+        pipe.expire(version_key(key), settings.RELATIONSHIP_CACHE_TIMEOUT)
+
+
+def add(follower_id, followed_id):
+    """
+    Description: Cache a new follow
+
+    Arguments:   - follower_id: id of User doing the following
+                 - followed_id: id of User being followed
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    keys = [following_key(follower_id), followers_key(followed_id)]
+    pipe = conn.pipeline()
+    sadd_if_cached(keys=keys, args=[followed_id, follower_id], client=pipe)
+    bump_versions(pipe, keys)
+    pipe.execute()
+
+
+def remove(follower_id, followed_id):
+    """
+    Description: Uncache a follow
+
+    Arguments:   - follower_id: id of User doing the following
+                 - followed_id: id of User being followed
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    pipe = conn.pipeline()
+    pipe.srem(following_key(follower_id), followed_id)
+    pipe.srem(followers_key(followed_id), follower_id)
+    bump_versions(pipe, [following_key(follower_id),
+                         followers_key(followed_id)])
+    pipe.execute()
+
+
+def remove_user(user_id, following, followers):
+    """
+    Description: Uncache all follows of a user being deleted
+
+    Arguments:   - user_id:   id of User being deleted
+                 - following: ids of users the user follows
+                 - followers: ids of users following the user
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    keys = [following_key(user_id), followers_key(user_id)]
+    pipe = conn.pipeline()
+    for followed_id in following:
+        pipe.srem(followers_key(followed_id), user_id)
+        keys.append(followers_key(followed_id))
+    for follower_id in followers:
+        pipe.srem(following_key(follower_id), user_id)
+        keys.append(following_key(follower_id))
+    pipe.delete(following_key(user_id), followers_key(user_id))
+    bump_versions(pipe, keys)
+    pipe.execute()
+
+
+def publish_follow(follower_id, followed_id, following):
+    """
+    Description: Publish a follow or unfollow to the realtime feed's channel,
+                 so the follower's open event streams start or stop getting
+                 the followed user's activities
+
+    Arguments:   - follower_id: id of User doing the following
+                 - followed_id: id of User being followed
+                 - following:   True for a follow, False for an unfollow
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    conn.publish(settings.ACTIVITY_REDIS_CHANNEL, json.dumps(
+            {'follower':follower_id, 'followed':followed_id,
+             'following':following}))
+
+
+def load(key, user_ids):
+    """
+    Description: Cache a set of user ids loaded from the db.
+                 The ids are read with the set's version watched, and read
+                 again if a follow changes the set before it is cached.
+                 Should follows keep changing it, the last ids read are
+                 cached anyway, and any drift expires with the set.
+
+    Arguments:   - key:      key of set
+                 - user_ids: QuerySet of ids of users in set
+    Return:      None
+
+    Author:      Nnoduka Eruchalu
+    """
+    pipe = conn.pipeline()
+    try:
+        for attempt in range(LOAD_ATTEMPTS):
+            if attempt < LOAD_ATTEMPTS - 1:
+                pipe.watch(version_key(key))
+            # evaluate a fresh queryset on each attempt
+            ids = list(user_ids.all())
+            pipe.multi()
+            pipe.delete(key)
+            pipe.sadd(key, SENTINEL, *ids)
+            pipe.expire(key, settings.RELATIONSHIP_CACHE_TIMEOUT)
+            try:
+                pipe.execute()
+                return
+            except redis.exceptions.WatchError:
+                continue
+    finally:
+        pipe.reset()
+
+
+def ensure_following(user_id):
+    """
+    Description: Make sure the set of users a user follows is cached
+
+    Arguments:   - user_id: id of User
+    Return:      (str) key of set
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.relationship.models import Following
+    key = following_key(user_id)
+    if not conn.exists(key):
+        load(key, Following.objects.filter(follower=user_id).values_list(
+                'followed', flat=True))
+    return key
+
+
+def ensure_followers(user_id):
+    """
+    Description: Make sure the set of users following a user is cached
+
+    Arguments:   - user_id: id of User
+    Return:      (str) key of set
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.relationship.models import Following
+    key = followers_key(user_id)
+    if not conn.exists(key):
+        load(key, Following.objects.filter(followed=user_id).values_list(
+                'follower', flat=True))
+    return key
+
+
+def members(key):
+    """
+    Description: Get the user ids in a cached set
+
+    Arguments:   - key: key of set
+    Return:      set of user ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    return set(int(member) for member in conn.smembers(key)) - set([SENTINEL])
+
+
+def following_ids(user_id):
+    """
+    Description: Get the ids of users a user follows
+
+    Arguments:   - user_id: id of User
+    Return:      set of user ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    return members(ensure_following(user_id))
+
+
+def follower_ids(user_id):
+    """
+    Description: Get the ids of users following a user
+
+    Arguments:   - user_id: id of User
+    Return:      set of user ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    return members(ensure_followers(user_id))
+
+
+def num_following(user_id):
+    """
+    Description: Get the number of users a user follows
+
+    Arguments:   - user_id: id of User
+    Return:      (int) number of users
+
+    Author:      Nnoduka Eruchalu
+    """
+    return conn.scard(ensure_following(user_id)) - 1
+
+
+def num_followers(user_id):
+    """
+    Description: Get the number of users following a user
+
+    Arguments:   - user_id: id of User
+    Return:      (int) number of users
+
+    Author:      Nnoduka Eruchalu
+    """
+    return conn.scard(ensure_followers(user_id)) - 1
+
+
+def is_following(follower_id, followed_id):
+    """
+    Description: Is user `follower_id` following user `followed_id`?
+
+    Arguments:   - follower_id: id of User doing the following
+                 - followed_id: id of User being followed
+    Return:      Boolean: True/False
+
+    Author:      Nnoduka Eruchalu
+    """
+    return conn.sismember(ensure_following(follower_id), followed_id)
+
+
+def followed_subset(follower_id, user_ids):
+    """
+    Description: Which of a list of users is user `follower_id` following?
+
+    Arguments:   - follower_id: id of User doing the following
+                 - user_ids:    list of ids of candidate Users being followed
+    Return:      set of ids of users in `user_ids` that are followed
+
+    Author:      Nnoduka Eruchalu
+    """
+    key = ensure_following(follower_id)
+    pipe = conn.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.sismember(key, user_id)
+    return set(user_id for user_id, followed in zip(user_ids, pipe.execute())
+               if followed)
+
+
+def mutual_ids(user_id):
+    """
+    Description: Get the ids of users a user follows, that follow them back
+
+    Arguments:   - user_id: id of User
+    Return:      set of user ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    keys = [ensure_following(user_id), ensure_followers(user_id)]
+    return set(int(member) for member in conn.sinter(keys)) - set([SENTINEL])
+
+
+def rebuild():
+    """
+    Description: Reload the cached sets of every user from the db.
+
+    Arguments:   None
+    Return:      (int) number of follows cached
+
+    Author:      Nnoduka Eruchalu
+    """
+    from noddymix.apps.relationship.models import Following
+    from noddymix.apps.account.models import User
+
+    following = {}
+    followers = {}
+    num_follows = 0
+    for follower_id, followed_id in Following.objects.values_list(
+        'follower', 'followed').order_by().iterator():
+        following.setdefault(follower_id, []).append(followed_id)
+        followers.setdefault(followed_id, []).append(follower_id)
+        num_follows += 1
+
+    # every user gets a set, so no user is cold after this
+    pipe = conn.pipeline(transaction=False)
+    for index, user_id in enumerate(User.objects.values_list(
+            'id', flat=True).order_by().iterator()):
+        for key, user_ids in ((following_key(user_id),
+                               following.get(user_id, [])),
+                              (followers_key(user_id),
+                               followers.get(user_id, []))):
+            pipe.delete(key)
+            pipe.sadd(key, SENTINEL, *user_ids)
+            pipe.expire(key, settings.RELATIONSHIP_CACHE_TIMEOUT)
+        if index % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+    return num_follows
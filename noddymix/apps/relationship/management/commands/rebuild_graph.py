@@ -0,0 +1,36 @@
+"""
+Description:
+  Manangement command module for rebuilding the social graph cache (kept in
+  redis) from the follows in db
+  
+Author: 
+  Nnoduka Eruchalu
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from noddymix.apps.relationship import graph
+import redis
+
+
+class Command(BaseCommand):
+    help = 'rebuild the social graph cache from follows'
+    
+    def handle(self, *args, **options):
+        """
+        Description: Replace the cached followers and following sets of every
+                     user with ones loaded from the db. The cache loads cold
+                     sets by itself, so this is only needed to warm it up or
+                     to fix drift.
+                                 
+        Arguments:   *args, **options
+        Return:      None
+        
+        Author:      Nnoduka Eruchalu
+        """
+        try:
+            num_follows = graph.rebuild()
+        except redis.exceptions.RedisError:
+            raise CommandError('redis server is unavailable')
+        
+        self.stdout.write('rebuilt social graph cache of %d follows' % 
+                          num_follows)
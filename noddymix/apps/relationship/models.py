@@ -1,5 +1,8 @@
 from django.db import models
 from noddymix.apps.account.models import User
+from noddymix.apps.relationship import graph
+from noddymix.apps.activity import timeline
+import redis
 
 # Create your models here.
 class FollowingManager(models.Manager):
@@ -13,19 +16,57 @@ class FollowingManager(models.Manager):
     def is_following(self, follower, followed):
         """
         Description: Is user `follower` following user `followed`?
+                     This is answered by the redis graph cache if possible.
         
-        Arguments:   - follower: User doing the following 
-                     - followed: User being followed
+        Arguments:   - follower: User doing the following (or their id)
+                     - followed: User being followed (or their id)
         Return:      Boolean: True/False
           
         Author:      Nnoduka Eruchalu
         """
+        follower_id = getattr(follower, 'id', follower)
+        followed_id = getattr(followed, 'id', followed)
+        if follower_id is None:
+            return False
+        
+        try:
+            return graph.is_following(follower_id, followed_id)
+        except redis.exceptions.RedisError:
+            pass
+        
         try:
             following_exact = self.get(follower=follower, followed=followed)
             return True
         except self.model.DoesNotExist:
             return False
     
+    def followed_subset(self, follower, user_ids):
+        """
+        Description: Which of a list of users is user `follower` following?
+                     This is answered by the redis graph cache if possible,
+                     and otherwise takes one query however many users there
+                     are.
+        
+        Arguments:   - follower: User doing the following (or their id, which
+                                 is None for anonymous users)
+                     - user_ids: list of ids of candidate Users being followed
+        Return:      set of ids of users in `user_ids` that are followed
+          
+        Author:      Nnoduka Eruchalu
+        """
+        follower_id = getattr(follower, 'id', follower)
+        if follower_id is None or not user_ids:
+            return set()
+        
+        try:
+            return graph.followed_subset(follower_id, user_ids)
+        except redis.exceptions.RedisError:
+            pass
+        
+        return set(self.filter(follower=follower_id, 
+                               followed__in=user_ids).values_list(
+                'followed', flat=True))
+    
     def follow(self, follower, followed):
         """
         Description: If User `follower` not already following `followed`, then
@@ -87,17 +128,24 @@ class Following(models.Model):
                      Again we go through this because we choose to have these
                      summary statistics logged in the User table to speed up
                      processes that would otherwise run count() queries.
+                     Then remove the relationship from the redis graph cache,
+                     drop the follower's timeline of activities and tell the
+                     realtime feed gateway.
         
         Arguments:   *arg, **kwargs
         Return:      None
           
         Author:      Nnoduka Eruchalu
         """
-        self.follower.num_following -=1
-        self.follower.save()
-        self.followed.num_followers -=1
-        self.followed.save()
+        User.objects.increment('num_following', [self.follower_id], -1)
+        User.objects.increment('num_followers', [self.followed_id], -1)
         super(Following, self).delete(*args, **kwargs) # call "real" delete()
+        try:
+            graph.remove(self.follower_id, self.followed_id)
+            timeline.invalidate(self.follower_id)
+            graph.publish_follow(self.follower_id, self.followed_id, False)
+        except redis.exceptions.RedisError:
+            pass
         
         
     def save(self, *args, **kwargs):
@@ -107,15 +155,27 @@ class Following(models.Model):
                      Again we go through this because we choose to have these
                      summary statistics logged in the User table to speed up
                      processes that would otherwise run count() queries.
+                     Then add the relationship to the redis graph cache, drop
+                     the follower's timeline of activities and tell the
+                     realtime feed gateway.
         
         Arguments:   *arg, **kwargs
         Return:      None
           
         Author:      Nnoduka Eruchalu
         """
-        if self.pk is None:
+        is_new = self.pk is None
+        if is_new:
+            User.objects.increment('num_following', [self.follower_id])
             self.follower.num_following += 1
-            self.follower.save()
+            User.objects.increment('num_followers', [self.followed_id])
             self.followed.num_followers += 1
-            self.followed.save()
         super(Following, self).save(*args, **kwargs) # call "real" save()
+        
+        if is_new:
+            try:
+                graph.add(self.follower_id, self.followed_id)
+                timeline.invalidate(self.follower_id)
+                graph.publish_follow(self.follower_id, self.followed_id, True)
+            except redis.exceptions.RedisError:
+                pass
@@ -1,11 +1,26 @@
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
+Description:
+  Tests of the relationship app.
 
-Replace this with more appropriate tests for your application.
+  Tests of the social graph cache use the local redis server (`REDIS_HOST`,
+  `REDIS_PORT`) as a stand-in for the production one, with their keys under a
+  `test:` prefix. They are skipped if it isn't running.
+
+Table Of Contents:
+  - SimpleTest:        demo test
+  - GraphTest:         social graph cache
+  - GraphFallbackTest: follow lookups while redis is down
+
+Author:
+  Nnoduka Eruchalu
 """
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from noddymix.apps.account.models import User
+from noddymix.apps.relationship.models import Following
+from noddymix.apps.relationship import graph
+import redis
 
 
 class SimpleTest(TestCase):
@@ -14,3 +29,154 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class RacingIds(object):
+    """
+    Description: Stand-in for a QuerySet of user ids, whose first
+                 `num_races` reads run a function (such as a follow) and
+                 return the ids from before it ran.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, ids_before, ids_after, race, num_races=1):
+        self.ids_before = ids_before
+        self.ids_after = ids_after
+        self.race = race
+        self.num_races = num_races
+        self.num_reads = 0
+
+    def all(self):
+        self.num_reads += 1
+        if self.num_reads <= self.num_races:
+            self.race()
+            return list(self.ids_before)
+        return list(self.ids_after)
+
+
+@override_settings(RELATIONSHIP_REDIS_KEY='test:graph',
+                   TIMELINE_REDIS_KEY='test:timeline')
+class GraphTest(TestCase):
+    """
+    Description: Tests of the social graph cache (graph.py)
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        try:
+            graph.conn.ping()
+        except redis.exceptions.RedisError:
+            self.skipTest('local redis server is not running')
+        self.clear()
+        self.one, self.two, self.three = [
+            User.objects.create(username=username)
+            for username in ('one', 'two', 'three')]
+
+    def tearDown(self):
+        self.clear()
+
+    def clear(self):
+        keys = graph.conn.keys('test:graph:*') + \
+            graph.conn.keys('test:timeline:*')
+        if keys:
+            graph.conn.delete(*keys)
+
+
+    def test_cold_sets_load_from_db(self):
+        """
+        Missing sets are loaded from the db, with the sentinel
+        """
+        Following.objects.follow(self.one, self.two)
+        self.clear()
+        self.assertEqual(graph.following_ids(self.one.id), set([self.two.id]))
+        self.assertEqual(graph.follower_ids(self.two.id), set([self.one.id]))
+        self.assertTrue(graph.conn.sismember(graph.following_key(self.one.id),
+                                             graph.SENTINEL))
+        self.assertEqual(graph.num_following(self.one.id), 1)
+
+    def test_empty_set_is_cached(self):
+        """
+        A user with no followers still gets a set, holding only the sentinel
+        """
+        self.assertEqual(graph.follower_ids(self.three.id), set())
+        self.assertEqual(
+            graph.conn.smembers(graph.followers_key(self.three.id)),
+            set([str(graph.SENTINEL)]))
+        self.assertEqual(graph.num_followers(self.three.id), 0)
+
+    def test_add_only_touches_cached_sets(self):
+        """
+        A follow is added to cached sets, and cold sets are left cold
+        """
+        graph.ensure_following(self.one.id)
+        graph.add(self.one.id, self.two.id)
+        self.assertEqual(
+            graph.members(graph.following_key(self.one.id)),
+            set([self.two.id]))
+        self.assertFalse(graph.conn.exists(graph.followers_key(self.two.id)))
+
+    def test_follow_and_unfollow(self):
+        graph.ensure_following(self.one.id)
+        graph.ensure_followers(self.two.id)
+        Following.objects.follow(self.one, self.two)
+        self.assertTrue(graph.is_following(self.one.id, self.two.id))
+        self.assertEqual(graph.followed_subset(
+                self.one.id, [self.two.id, self.three.id]), set([self.two.id]))
+
+        Following.objects.unfollow(self.one, self.two)
+        self.assertFalse(graph.is_following(self.one.id, self.two.id))
+        self.assertEqual(graph.follower_ids(self.two.id), set())
+
+    def test_load_retries_after_follow(self):
+        """
+        A set read from the db before a follow is saved is read again, rather
+        than cached without the follow
+        """
+        key = graph.following_key(self.one.id)
+        user_ids = RacingIds(
+            [], [self.two.id], lambda: graph.add(self.one.id, self.two.id))
+        graph.load(key, user_ids)
+        self.assertEqual(user_ids.num_reads, 2)
+        self.assertEqual(graph.members(key), set([self.two.id]))
+
+    def test_load_gives_up_watching(self):
+        """
+        A set that keeps changing while it is read is cached all the same
+        """
+        key = graph.following_key(self.one.id)
+        follow = lambda: graph.add(self.one.id, self.two.id)
+        user_ids = RacingIds([self.two.id], [self.two.id], follow,
+                             num_races=graph.LOAD_ATTEMPTS)
+        graph.load(key, user_ids)
+        self.assertEqual(user_ids.num_reads, graph.LOAD_ATTEMPTS)
+        self.assertEqual(graph.members(key), set([self.two.id]))
+
+
+class GraphFallbackTest(TestCase):
+    """
+    Description: Tests of follow lookups falling back to the db when redis is
+                 down
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        # no redis server listens on this port
+        self.graph_conn = graph.conn
+        graph.conn = redis.StrictRedis(port=1, socket_timeout=0.1)
+
+    def tearDown(self):
+        graph.conn = self.graph_conn
+
+
+    def test_falls_back_to_db(self):
+        one, two, three = [User.objects.create(username=username)
+                           for username in ('one', 'two', 'three')]
+        Following.objects.follow(one, two)
+        self.assertTrue(Following.objects.is_following(one, two))
+        self.assertFalse(Following.objects.is_following(one, three))
+        self.assertEqual(
+            Following.objects.followed_subset(one, [two.id, three.id]),
+            set([two.id]))
@@ -45,20 +45,45 @@ def setup_user_json(request, user, is_following):
     return user_json
     
 
-def setup_users_json(request, users_followings):
+def get_following_statuses(request, users):
     """
-    Description: Parse a list of user_following objects into a list of json
-                 representations for each user.
+    Description: Get the follow status of request.user for each of a list of
+                 users, with at most one query. Statuses are cached on the
+                 request so users seen before in this request cost nothing.
                  
-    Arguments:   - request:         HttpRequst object
-                 - user_followings: List of objects where each has the format:
-                                    (<User>, <boolean is_following status>)
+    Arguments:   - request: HttpRequst object
+                 - users:   List of User objects
+    Return:      List of objects where each has the format:
+                 (<User>, <boolean is_following status>)
+    
+    Author:      Nnoduka Eruchalu
+    """
+    statuses = getattr(request, '_following_statuses', None)
+    if statuses is None:
+        statuses = request._following_statuses = {}
+    
+    missing = [user.id for user in users if user.id not in statuses]
+    if missing:
+        followed = Following.objects.followed_subset(request.user.id, missing)
+        for user_id in missing:
+            statuses[user_id] = user_id in followed
+    
+    return [(user, statuses[user.id]) for user in users]
+
+
+def setup_users_json(request, users):
+    """
+    Description: Parse a list of users into a list of json representations for
+                 each user, with request.user's follow status of each.
+                 
+    Arguments:   - request: HttpRequst object
+                 - users:   List of User objects
     Return:      list of user representation dictionaries.
     
     Author:      Nnoduka Eruchalu
     """
     users_json = []
-    for user, is_following in users_followings:
+    for user, is_following in get_following_statuses(request, users):
         users_json.append(setup_user_json(request, user, is_following))
     return users_json
 
@@ -78,8 +103,7 @@ def get_user_json(id, request):
     try:
         user = User.objects.get(id=id)
         # is requesting user currently following profile?
-        is_following = Following.objects.is_following(
-            request.user.id,user)
+        is_following = get_following_statuses(request, [user])[0][1]
         user_json = setup_user_json(request, user, is_following)
     except User.DoesNotExist:
         user_json = False
@@ -104,23 +128,19 @@ def followers(request, id):
     
     if request.is_ajax():
         # is requesting user currently following profile?
-        user_following_status = Following.objects.is_following(
-            request.user.id,user)
+        user_following_status = get_following_statuses(request, [user])[0][1]
     
         # users that follow this user
-        followers_all = user.followers.all().order_by('-id')
+        followers_all = user.followers.all().select_related(
+            'follower').order_by('-id')
         template_context = users_helper(request, followers_all)
         followers_list = [u.follower for u in template_context['users']]
-        followers_status = []
-        for follower in followers_list:
-            followers_status.append(
-                Following.objects.is_following(request.user.id, follower))
-        
-        followers = zip(followers_list, followers_status)
+        followers = get_following_statuses(request, followers_list)
         del template_context['users']
         
         if request.mobile:
-            template_context['users'] = setup_users_json(request, followers)
+            template_context['users'] = setup_users_json(request, 
+                                                         followers_list)
         
         else:
             template_context['content'] = render_to_string(
@@ -158,23 +178,19 @@ def following(request, id):
     
     if request.is_ajax():
         # is requesting user currently following profile?
-        user_following_status = Following.objects.is_following(
-            request.user.id,user)
+        user_following_status = get_following_statuses(request, [user])[0][1]
     
         # users that this user is following
-        followings_all = user.following.all().order_by('-id')
+        followings_all = user.following.all().select_related(
+            'followed').order_by('-id')
         template_context = users_helper(request, followings_all)
         following_list = [u.followed for u in template_context['users']]
-        following_status = []
-        for followed in following_list:
-            following_status.append(
-                Following.objects.is_following(request.user.id, followed))
-        
-        following = zip(following_list, following_status)
+        following = get_following_statuses(request, following_list)
         del template_context['users']
                 
         if request.mobile:
-            template_context['users'] = setup_users_json(request, following)
+            template_context['users'] = setup_users_json(request, 
+                                                         following_list)
             
         else:
             template_context['content'] = render_to_string(
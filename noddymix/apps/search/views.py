@@ -9,11 +9,11 @@ from haystack.forms import SearchForm
 from haystack.query import EmptySearchQuerySet, SearchQuerySet 
 from noddymix.apps.audio.models import Song, Playlist
 from noddymix.apps.account.models import User
-from noddymix.apps.relationship.models import Following
 from noddymix.apps.audio.views import songs_helper_json, playlists_helper, \
-    setup_playlists_json
+    setup_playlists_json, prefetch_playlist_relations
 from noddymix.utils import users_helper, list_dedup
-from noddymix.apps.relationship.views import setup_users_json
+from noddymix.apps.relationship.views import setup_users_json, \
+    get_following_statuses
 
 import json
 
@@ -108,6 +108,8 @@ def search_playlists(request):
                 setup_playlists_json(playlists_context['playlists'], request)
         
         else:
+            # search results are loaded without their owners and cover albums
+            prefetch_playlist_relations(playlists_context['playlists'])
             playlists_context['content'] = render_to_string(
                 'search/content_playlists.html',
                 playlists_context,
@@ -138,18 +140,14 @@ def search_users(request):
         template_context = search_helper(
             request, SearchQuerySet().models(User), users_helper)
         following_list = template_context['users']
-        following_status = []
-        for followed in following_list:
-            following_status.append(
-                Following.objects.is_following(request.user.id, followed))
-        
-        following = zip(following_list, following_status)
         
         if request.mobile:
-            template_context['users'] = setup_users_json(request, following)
+            template_context['users'] = setup_users_json(request, 
+                                                         following_list)
             
         else:
-            template_context['users'] = following
+            template_context['users'] = get_following_statuses(
+                request, following_list)
             template_context['content'] = render_to_string(
                 'search/content_users.html',
                 template_context,
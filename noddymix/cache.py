@@ -0,0 +1,153 @@
+"""
+Description:
+  Django cache backend that stores entries in the same Redis server used for
+  the realtime feed. Unlike the default local-memory cache, entries are shared
+  by every process serving the site, so invalidating an entry in one process
+  is seen by all the others.
+
+  Redis outages are treated as cache misses, so the site keeps working (just
+  slower) when the redis server is down.
+
+Table Of Contents:
+  - RedisCache: cache backend class
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.six.moves import cPickle as pickle
+import redis
+
+
+class RedisCache(BaseCache):
+    """
+    Description: Cache backend storing pickled values in Redis.
+                 LOCATION is given as "<host>:<port>" and an optional
+                 OPTIONS['DB'] picks the redis database.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, server, params):
+        super(RedisCache, self).__init__(params)
+        host, port = server.split(':')
+        options = params.get('OPTIONS', {})
+        self._client = redis.StrictRedis(
+            host=host, port=int(port), db=int(options.get('DB', 0)),
+            socket_timeout=options.get('SOCKET_TIMEOUT', 0.5))
+
+
+    def _get_timeout(self, timeout):
+        """
+        Description: Get the expiry (in seconds) to use for a cache entry
+
+        Arguments:   - timeout: timeout passed to a cache operation
+        Return:      (int) seconds before entry expires or None if it never
+                     expires
+
+        Author:      Nnoduka Eruchalu
+        """
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(int(timeout), 1)
+
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            added = self._client.setnx(key, pickle.dumps(value, -1))
+            timeout = self._get_timeout(timeout)
+            if added and timeout is not None:
+                self._client.expire(key, timeout)
+            return bool(added)
+        except redis.exceptions.RedisError:
+            return False
+
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            value = self._client.get(key)
+        except redis.exceptions.RedisError:
+            value = None
+        return default if value is None else pickle.loads(value)
+
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            self._client.set(key, pickle.dumps(value, -1),
+                             ex=self._get_timeout(timeout))
+        except redis.exceptions.RedisError:
+            pass
+
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            self._client.delete(key)
+        except redis.exceptions.RedisError:
+            pass
+
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        # map actual redis keys back to the keys we were given
+        redis_keys = [self.make_key(key, version=version) for key in keys]
+        try:
+            values = self._client.mget(redis_keys)
+        except redis.exceptions.RedisError:
+            return {}
+
+        return dict((key, pickle.loads(value)) for key, value in
+                    zip(keys, values) if value is not None)
+
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._get_timeout(timeout)
+        try:
+            # one round trip for the whole batch
+            pipe = self._client.pipeline(transaction=False)
+            for key, value in data.items():
+                pipe.set(self.make_key(key, version=version),
+                         pickle.dumps(value, -1), ex=timeout)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        if not keys:
+            return
+        try:
+            self._client.delete(*keys)
+        except redis.exceptions.RedisError:
+            pass
+
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            return self._client.exists(key)
+        except redis.exceptions.RedisError:
+            return False
+
+
+    def clear(self):
+        # only clear this cache's keys; redis also holds realtime feed data
+        try:
+            keys = self._client.keys(self.make_key('*'))
+            if keys:
+                self._client.delete(*keys)
+        except redis.exceptions.RedisError:
+            pass
@@ -0,0 +1,199 @@
+"""
+Description:
+  Session engine and serializer that cut down session writes to MySQL.
+
+  Every request saves its session (`SESSION_SAVE_EVERY_REQUEST`) to refresh its
+  expiry, and the default db engine rewrites the session's row each time. This
+  engine keeps sessions in the cache (redis) with database write-through, like
+  django.contrib.sessions.backends.cached_db, but skips the write when the
+  session content hasn't changed since it was loaded, unless the row hasn't
+  been written for `SESSION_WRITE_INTERVAL` seconds. So the row's expiry date
+  is never more than that far behind.
+
+  Sessions are serialized as compact JSON instead of pickles. The anonymous
+  user's play `history` and temporary `playlists` are the bulk of a session so
+  they are packed:
+    - lists of song ids are varint encoded, then base64 encoded.
+    - the playlists dict, keyed by int ids that JSON can't represent, is
+      stored as a list of [id, title, song ids, cover album id]
+  Sessions with values JSON can't represent, or that don't come back the same
+  from JSON (such as other dicts keyed by ints, or tuples), are pickled as
+  before. Pickled sessions (including those saved before this serializer) are
+  still read.
+
+Table Of Contents:
+  - encode_ids:        varint and base64 encode a list of ids
+  - decode_ids:        decode a list of ids encoded by encode_ids
+  - CompactSerializer: session serializer
+  - SessionStore:      session engine
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.contrib.sessions.backends.cached_db import SessionStore \
+    as CachedDBStore
+from django.conf import settings
+from django.utils.six.moves import cPickle as pickle
+import base64, copy, json, time
+
+# session key of the unix time the session was last written to the db
+WRITTEN_KEY = '_session_written'
+
+
+def encode_ids(ids):
+    """
+    Description: Encode a list of non-negative integer ids as varints (7 bits
+                 per byte, high bit set on all but an id's last byte), then as
+                 url-safe base64.
+
+    Arguments:   - ids: list of ids
+    Return:      (str) encoded ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    encoded = bytearray()
+    for id in ids:
+        if not isinstance(id, (int, long)) or isinstance(id, bool) or id < 0:
+            raise ValueError('ids must be non-negative integers')
+        while id > 0x7f:
+            encoded.append((id & 0x7f) | 0x80)
+            id >>= 7
+        encoded.append(id)
+    return base64.urlsafe_b64encode(bytes(encoded))
+
+
+def decode_ids(encoded):
+    """
+    Description: Decode a list of ids encoded by encode_ids
+
+    Arguments:   - encoded: encoded ids
+    Return:      list of ids
+
+    Author:      Nnoduka Eruchalu
+    """
+    ids = []
+    id = shift = 0
+    for byte in bytearray(base64.urlsafe_b64decode(str(encoded))):
+        id |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            ids.append(id)
+            id = shift = 0
+    return ids
+
+
+class CompactSerializer(object):
+    """
+    Description: Session serializer writing compact JSON, and pickles for
+                 sessions that JSON can't represent.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def dumps(self, obj):
+        try:
+            data = json.dumps(self.pack(obj), separators=(',', ':'),
+                              sort_keys=True)
+            # JSON turns int keys into strings and tuples into lists, so
+            # only keep it if the session comes back the same
+            if self.loads(data) == obj:
+                return data
+        except (TypeError, ValueError, KeyError):
+            pass
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        if data[:1] == b'{':
+            return self.unpack(json.loads(data))
+        return pickle.loads(data)
+
+    def pack(self, obj):
+        """
+        Description: Pack the history and playlists of a session
+
+        Arguments:   - obj: session dictionary
+        Return:      packed copy of session dictionary
+
+        Author:      Nnoduka Eruchalu
+        """
+        packed = dict(obj)
+        if 'history' in packed:
+            packed['history'] = encode_ids(packed['history'])
+        if 'playlists' in packed:
+            playlists = []
+            for id, playlist in sorted(packed['playlists'].items()):
+                if id != playlist['id'] or \
+                        playlist['num_songs'] != len(playlist['songs']):
+                    raise ValueError('playlist can not be packed')
+                playlists.append([id, playlist['title'],
+                                  encode_ids(playlist['songs']),
+                                  playlist['cover_album']])
+            packed['playlists'] = playlists
+        return packed
+
+    def unpack(self, packed):
+        """
+        Description: Unpack the history and playlists of a session packed by
+                     pack
+
+        Arguments:   - packed: packed session dictionary
+        Return:      session dictionary
+
+        Author:      Nnoduka Eruchalu
+        """
+        if 'history' in packed:
+            packed['history'] = decode_ids(packed['history'])
+        if 'playlists' in packed:
+            playlists = {}
+            for id, title, songs, cover_album in packed['playlists']:
+                songs = decode_ids(songs)
+                playlists[id] = {
+                    'id':id,
+                    'title':title,
+                    'songs':songs,
+                    'num_songs':len(songs),
+                    'cover_album':cover_album
+                    }
+            packed['playlists'] = playlists
+        return packed
+
+
+class SessionStore(CachedDBStore):
+    """
+    Description: Cached database session engine that skips writing sessions
+                 that haven't changed.
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(session_key)
+        # copy of session as loaded, to compare against on save
+        self._loaded_session = None
+
+    def load(self):
+        data = super(SessionStore, self).load()
+        self._loaded_session = copy.deepcopy(data)
+        return data
+
+    def save(self, must_create=False):
+        """
+        Description: Save the session to the db and cache, unless it is
+                     unchanged since it was loaded and was written recently.
+
+        Arguments:   - must_create: create a new session instead of saving an
+                                    existing one
+        Return:      None
+
+        Author:      Nnoduka Eruchalu
+        """
+        data = self._get_session(no_load=must_create)
+        now = int(time.time())
+        if not must_create and data == self._loaded_session and \
+                now - data.get(WRITTEN_KEY, 0) < settings.SESSION_WRITE_INTERVAL:
+            return
+
+        data[WRITTEN_KEY] = now
+        super(SessionStore, self).save(must_create)
+        self._loaded_session = copy.deepcopy(data)
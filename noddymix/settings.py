@@ -193,6 +193,10 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'ERROR',
+            'class': 'logging.StreamHandler'
         }
     },
     'loggers': {
@@ -201,6 +205,12 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # errors of background work, such as the activity publisher thread
+        'noddymix': {
+            'handlers': ['console', 'mail_admins'],
+            'level': 'ERROR',
+            'propagate': True,
+        },
     }
 }
 
@@ -349,6 +359,10 @@ MAX_IMAGE_SIZE = 25 * 1024 * 1024
 IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY ='imagekit.cachefiles.strategies.Optimistic'
 IMAGEKIT_CACHEFILE_DIR = 'cache'
 IMAGEKIT_SPEC_CACHEFILE_NAMER ='imagekit.cachefiles.namers.source_name_as_path'
+# number of worker processes generating album art derivatives in the background
+ALBUM_ART_WORKERS = 2
+# redis key of the set of album art files waiting for their derivatives
+ALBUM_ART_REDIS_KEY = 'albumart_pending'
 
 
 # ---------------------------------------------------------------------------- #
@@ -363,13 +377,38 @@ SONGS_PER_PAGE = 100
 # pagination: number of playlists per page. This should be multiples of 12 
 # because each row either has 3 or 4 albums per page [lcm(3,4) = 12]
 PLAYLISTS_PER_PAGE = 36 
+# spacing of the `order` keys of songs in a playlist. Songs are moved by giving
+# them keys in between, so larger gaps mean fewer rebalancing passes.
+PLAYLIST_ORDER_GAP = 1024
+# sessions are kept in the cache with db write-through, and unchanged sessions
+# are only written to the db every `SESSION_WRITE_INTERVAL` seconds
+SESSION_ENGINE = 'noddymix.sessions'
+SESSION_WRITE_INTERVAL = 60 * 60
 # need to support non-string keys in request.session. Ints are keys of temporary
-# playlists in their collections.
-SESSION_SERIALIZER = 'django.contrib.sessions.serializers.PickleSerializer'
+# playlists in their collections. This serializer packs those (and the play
+# history) into compact JSON, and falls back to pickles.
+SESSION_SERIALIZER = 'noddymix.sessions.CompactSerializer'
 # number of days to evaluate heavy rotation songs from
 HEAVY_ROTATION_DAYS = 7
 # gravity value to use when determining song score
 SONG_RANK_GRAVITY = 1.8
+# number of days raw song plays are kept for. Older song plays are only kept as
+# hourly play counts by the rollup_songplays command.
+SONGPLAY_RETENTION_DAYS = 30
+# prefix of redis keys holding realtime song trending scores
+TRENDING_REDIS_KEY = 'trending'
+# how long (in seconds) a song's serialized player json stays cached. Entries
+# are invalidated whenever the song, its album or its artists change.
+SONG_JSON_CACHE_TIMEOUT = 60 * 60 * 24
+# buffer song plays in redis and write them to the database in batches with the
+# flush_plays command [which must be kept running when this is enabled]
+PLAY_BUFFER_ENABLED = True
+# redis key of the list of buffered song plays
+PLAY_BUFFER_REDIS_KEY = 'play_buffer'
+# seconds between flushes of buffered song plays
+PLAY_BUFFER_FLUSH_INTERVAL = 5
+# max number of buffered song plays written to the database in one transaction
+PLAY_BUFFER_BATCH_SIZE = 500
 
 
 # ---------------------------------------------------------------------------- #
@@ -377,6 +416,19 @@ SONG_RANK_GRAVITY = 1.8
 # ---------------------------------------------------------------------------- #
 # max number of activities displayed on page load
 ACTIVITY_LIMIT = 20
+# number of activities on a page of a user's activities
+ACTIVITIES_PER_PAGE = 50
+# number of activities read at a time when exporting a user's activities
+ACTIVITY_EXPORT_BATCH_SIZE = 500
+# prefix of redis keys holding users' precomputed activity timelines
+TIMELINE_REDIS_KEY = 'timeline'
+# max number of activity ids kept in a user's timeline
+TIMELINE_LENGTH = 100
+# activities of users with more followers than this aren't added to followers'
+# timelines, but are merged into them when read
+TIMELINE_FANOUT_LIMIT = 1000
+# how long (in seconds) a user's timeline is kept before being rebuilt
+TIMELINE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 # ensure session cookie is sent on every request
 SESSION_SAVE_EVERY_REQUEST = True
 # allow client-side javascript access session cookie
@@ -385,7 +437,42 @@ SESSION_COOKIE_HTTPONLY = False
 # redis specific
 REDIS_PORT = 25373
 REDIS_HOST = 'localhost'
+# max seconds to wait on the redis server before giving up
+REDIS_SOCKET_TIMEOUT = 1
 ACTIVITY_REDIS_CHANNEL = 'feed'
+# max number of activities waiting to be published to the realtime feed by a
+# process. Activities beyond this are spooled.
+ACTIVITY_PUBLISH_QUEUE_SIZE = 1000
+# seconds between checks of whether the redis server is back after an outage
+ACTIVITY_PUBLISH_RETRY_INTERVAL = 5
+# directory of spooled realtime feed messages that couldn't be published
+ACTIVITY_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+# spooled realtime feed messages older than this (in seconds) aren't replayed
+ACTIVITY_SPOOL_MAX_AGE = 60 * 60
+# seconds a realtime feed subscription token is valid for. FEED_TOKEN_SECRET,
+# used to sign these, comes from settings_secret.py
+FEED_TOKEN_TIMEOUT = 5 * 60
+# prefix of redis keys holding the social graph cache. This is also hardcoded in
+# nodejs/feed.js
+RELATIONSHIP_REDIS_KEY = 'graph'
+# how long (in seconds) a user's cached followers/following sets are kept
+RELATIONSHIP_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# ---------------------------------------------------------------------------- #
+# cache settings
+# ---------------------------------------------------------------------------- #
+# share the cache across all processes by keeping it in redis
+CACHES = {
+    'default': {
+        'BACKEND': 'noddymix.cache.RedisCache',
+        'LOCATION': '%s:%d' % (REDIS_HOST, REDIS_PORT),
+        'KEY_PREFIX': 'noddymix',
+        'OPTIONS': {
+            'DB': 1,
+        },
+    }
+}
 
 
 # ---------------------------------------------------------------------------- #
@@ -15,6 +15,10 @@ DATABASES_MYSQL_PASSWORD = 'mysql_db_password'
 # Make this unique, and don't share it with anybody.
 SECRET_KEY = 'generated_by_django'
 
+# Key signing realtime feed subscription tokens. This must match 
+# config.feed_token_secret in apps/activity/nodejs/config.js
+FEED_TOKEN_SECRET = 'random string shared with the Node.js feed server'
+
 
 # Amazon Web Services properties
 AWS_ACCESS_KEY_ID             = 'Amazon Web Services access key'
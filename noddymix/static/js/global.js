@@ -702,25 +702,103 @@ $(document).ready(function(){ // container for entire script
     });
     
     
-    /* socket.io functionality [for live feed]
+    /* Server-Sent Events functionality [for live feed]
      * ---------------------------
      */
-    // only attempt this if socket.io.js was successfully downloaded
-    if(typeof io !== 'undefined') {
+    // the feed gateway [see apps/activity/gateway] is used where the browser
+    // has EventSource, and socket.io otherwise.
+    // A stream lasts as long as its token, which also lists the followings
+    // it's subscribed to, so a stream that ends or fails is reopened with a
+    // fresh token: EventSource's own reconnect would reuse the old one.
+    var feedStream = null;
+    var feedRetryDelay = 1000;
+    
+    function retryFeedStream() {
+        setTimeout(openFeedStream, feedRetryDelay);
+        feedRetryDelay = Math.min(feedRetryDelay*2, 60000);
+    }
+    
+    function openFeedStream() {
+        $.ajax({
+            type:'GET',
+            url:'/activity/feed-token/',
+            success:function(data) {
+                // anonymous users have no followings
+                if (!data.token) return;
+                var stream = new EventSource(
+                    FEED_GATEWAY_BASEURL + '/feed?token=' +
+                        encodeURIComponent(data.token));
+                feedStream = stream;
+                
+                var reopen = function(delayed) {
+                    // only reopen the current stream, and only once
+                    if (feedStream !== stream) return;
+                    stream.close();
+                    feedStream = null;
+                    if (delayed) {
+                        retryFeedStream();
+                    } else {
+                        openFeedStream();
+                    }
+                };
+                stream.addEventListener('open', function() {
+                    feedRetryDelay = 1000;
+                });
+                stream.addEventListener('feedupdate', function(e) {
+                    addFeedUpdate(e.data);
+                });
+                // the gateway closes streams of expired tokens
+                stream.addEventListener('expired', function() {
+                    reopen(false);
+                });
+                stream.addEventListener('error', function() {
+                    reopen(true);
+                });
+            },
+            error:function(data) {
+                retryFeedStream();
+            },
+            dataType: 'json'
+        });
+    }
+    
+    function addFeedUpdate(message) {
+        // get activity update
+        var activity_update = $("<li>"+message+"</li>");
+        // put at the top of the activity feed
+        $("ul.activity-feed").prepend(activity_update);
+        // limit the total number of visible activities
+        $(".activity-feed").find("li:gt("+(ACTIVITY_LIMIT-1)+")").remove();
+    }
+    
+    /* socket.io functionality [for live feed without EventSource]
+     * ---------------------------
+     */
+    if (typeof EventSource !== 'undefined') {
+        openFeedStream();
+    } else if(typeof io !== 'undefined') {
+        // only attempt this if socket.io.js was successfully downloaded
         var socket = io.connect(NODE_BASEURL + '/feed')
         socket.on('connect', function() {
             // on connection to the nodejs server, subscribe to followings for
-            // feed updates. Server needs unique identifier, so use sessionid
-            socket.emit('subscribe', {sessionid:getSessionId()});
-        });
-        socket.on('feedupdate', function(message) {
-            // get activity update
-            activity_update = $("<li>"+message+"</li>");
-            // put at the top of the activity feed
-            $("ul.activity-feed").prepend(activity_update);
-            // limit the total number of visible activities
-            $(".activity-feed").find("li:gt("+(ACTIVITY_LIMIT-1)+")").remove();
+            // feed updates. Server needs to know who they are, so get a signed
+            // token listing them [anonymous users have no followings].
+            // Fall back to the sessionid if the token can't be had.
+            $.ajax({
+                type:'GET',
+                url:'/activity/feed-token/',
+                success:function(data) {
+                    if (data.token) {
+                        socket.emit('subscribe', {token:data.token});
+                    }
+                },
+                error:function(data) {
+                    socket.emit('subscribe', {sessionid:getSessionId()});
+                },
+                dataType: 'json'
+            });
         });
+        socket.on('feedupdate', addFeedUpdate);
     }
     
     /* actions specific to music pages
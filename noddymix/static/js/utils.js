@@ -10,12 +10,15 @@ var DEBUG = (typeof DEBUG === 'undefined') ? false : DEBUG;
 BASEURL = "http://noddymix.com";
 
 NODE_PORT = '16637'
+FEED_GATEWAY_PORT = '8001'
 
-// base url of node.js server
+// base urls of node.js server and Server-Sent Events feed gateway
 if (DEBUG) {
     NODE_BASEURL = 'http://127.0.0.1'+':'+NODE_PORT;
+    FEED_GATEWAY_BASEURL = 'http://127.0.0.1'+':'+FEED_GATEWAY_PORT;
 } else {
     NODE_BASEURL = 'http://173.192.122.232'+':'+NODE_PORT;
+    FEED_GATEWAY_BASEURL = 'http://173.192.122.232'+':'+FEED_GATEWAY_PORT;
 }
 
 // setup constants that serve as URL prefixes and suffixes
@@ -0,0 +1,98 @@
+"""
+Description:
+  Tests of the project-wide modules.
+
+Table Of Contents:
+  - EncodeIdsTest:         varint encoding of lists of ids
+  - CompactSerializerTest: compact JSON session serializer
+
+Author:
+  Nnoduka Eruchalu
+"""
+
+from django.test import TestCase
+from django.utils.six.moves import cPickle as pickle
+from noddymix.sessions import encode_ids, decode_ids, CompactSerializer
+
+
+class EncodeIdsTest(TestCase):
+    """
+    Description: Tests of encode_ids and decode_ids
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def test_round_trip(self):
+        for ids in ([], [0], [1, 127, 128, 300, 16383, 16384],
+                    [2**40, 5, 2**40]):
+            self.assertEqual(decode_ids(encode_ids(ids)), ids)
+
+    def test_compact(self):
+        """
+        Ids under 128 take one byte each, before base64 encoding
+        """
+        self.assertEqual(len(encode_ids(range(120))), 160)
+
+    def test_invalid_ids(self):
+        for ids in ([-1], [True], ['1'], [1.0]):
+            self.assertRaises(ValueError, encode_ids, ids)
+
+
+class CompactSerializerTest(TestCase):
+    """
+    Description: Tests of the CompactSerializer session serializer
+
+    Author:      Nnoduka Eruchalu
+    """
+
+    def setUp(self):
+        self.serializer = CompactSerializer()
+
+    def round_trip(self, session):
+        data = self.serializer.dumps(session)
+        self.assertEqual(self.serializer.loads(data), session)
+        return data
+
+    def is_json(self, data):
+        return data[:1] == b'{'
+
+
+    def test_history_and_playlists(self):
+        session = {
+            '_auth_user_id': 1,
+            'history': [3, 1, 200, 3],
+            'playlists': {
+                1: {'id':1, 'title':u'one', 'songs':[5, 300],
+                    'num_songs':2, 'cover_album':7},
+                2: {'id':2, 'title':u'two', 'songs':[], 'num_songs':0,
+                    'cover_album':None},
+                }
+            }
+        self.assertTrue(self.is_json(self.round_trip(session)))
+        self.assertTrue(self.is_json(self.round_trip({})))
+
+    def test_int_keys_are_pickled(self):
+        """
+        Dicts keyed by ints, other than the playlists, aren't corrupted by JSON
+        """
+        self.assertFalse(self.is_json(self.round_trip({'x': {1: 2}})))
+        self.assertFalse(self.is_json(self.round_trip({'x': [{1: 'a'}]})))
+
+    def test_tuples_are_pickled(self):
+        self.assertFalse(self.is_json(self.round_trip({'x': (1, 2)})))
+
+    def test_unpackable_playlist_is_pickled(self):
+        session = {'playlists': {
+                1: {'id':1, 'title':u'one', 'songs':[5], 'num_songs':2,
+                    'cover_album':None}}}
+        self.assertFalse(self.is_json(self.round_trip(session)))
+
+    def test_unrepresentable_values_are_pickled(self):
+        self.assertFalse(self.is_json(self.round_trip({'x': set([1])})))
+
+    def test_reads_pickled_sessions(self):
+        session = {'history': [1, 2], 'x': {1: 2}}
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            self.assertEqual(
+                self.serializer.loads(pickle.dumps(session, protocol)),
+                session)
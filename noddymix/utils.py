@@ -7,17 +7,25 @@ Table Of Contents:
   - get_upload_path: determine a unique upload path for a given file
   - users_helper:    paginate the list of users
   - list_dedup:      dedup a list and preserve order of elements
+  - encode_cursor:   encode ordering values into an opaque pagination cursor
+  - decode_cursor:   decode an opaque pagination cursor
+  - get_cursor:      get pagination cursor pointing just after an object
+  - keyset_filter:   filter a QuerySet to objects after ordering field values
+  - keyset_helper:   paginate a QuerySet by cursor instead of page number
+  - get_redis:       get a redis client sharing the process' connection pool
 
 Author: 
   Nnoduka Eruchalu
 """
 
 from datetime import datetime
-import os, re, unicodedata
+import os, re, unicodedata, base64, json, redis
 
 #imports for pagination
 from django.conf import settings
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 
 
 def slugify(string):
@@ -123,3 +131,155 @@ def list_dedup(in_list):
     """
     seen = set()
     return [s for s in in_list if s not in seen and not seen.add(s)]
+
+
+def encode_cursor(values):
+    """    
+    Description: Encode a list of ordering field values into an opaque, url-safe
+                 pagination cursor.
+                 Datetimes are stored as strings which Django's DateTimeField
+                 lookups accept as is.
+          
+    Arguments:   - values: list of ordering field values
+    Return:      (str) pagination cursor
+        
+    Author:      Nnoduka Eruchalu
+    """
+    values = [unicode(v) if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor, model, ordering):
+    """    
+    Description: Decode a pagination cursor created by encode_cursor, checking
+                 it has a valid value for each ordering field.
+          
+    Arguments:   - cursor:   pagination cursor string
+                 - model:    model class of the objects being paginated
+                 - ordering: list of field names the objects are ordered by,
+                             with a '-' prefix for descending fields.
+    Return:      list of ordering field values or None if cursor is invalid
+        
+    Author:      Nnoduka Eruchalu
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    
+    try:
+        values = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                  for field, value in zip(ordering, values)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+    return values if None not in values else None
+
+
+def get_cursor(obj, ordering):
+    """    
+    Description: Get the pagination cursor that points just after a given
+                 object in a list ordered by `ordering`
+          
+    Arguments:   - obj:      model instance
+                 - ordering: list of field names the list is ordered by, with
+                             a '-' prefix for descending fields.
+    Return:      (str) pagination cursor
+        
+    Author:      Nnoduka Eruchalu
+    """
+    return encode_cursor([getattr(obj, field.lstrip('-')) for field in ordering])
+
+
+def keyset_filter(objects_list, ordering, values):
+    """    
+    Description: Filter a QuerySet to the objects that come after given values
+                 of its ordering fields.
+          
+    Arguments:   - objects_list: QuerySet to be filtered
+                 - ordering:     list of field names the QuerySet is ordered by,
+                                 with a '-' prefix for descending fields.
+                 - values:       list of values of the ordering fields
+    Return:      filtered QuerySet
+        
+    Author:      Nnoduka Eruchalu
+    """
+    # objects after the values are those where the first field that differs
+    # from the values is past the value for that field
+    after = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        q = Q(**{name + lookup: values[i]})
+        for prev_field, value in zip(ordering[:i], values[:i]):
+            q &= Q(**{prev_field.lstrip('-'): value})
+        after |= q
+    return objects_list.filter(after)
+
+
+def keyset_helper(request, objects_list, ordering, per_page):
+    """
+    Description: Paginate a QuerySet using an opaque cursor (in GET param 
+                 `cursor`) that points just after the last object of the
+                 previous page.
+                 Unlike Paginator, this doesn't need a COUNT(*) or an OFFSET
+                 scan so each page costs the same no matter how deep it is.
+                 The last field of `ordering` has to make the ordering unique
+                 (e.g. 'id').
+                 An empty or invalid cursor gets the first page.
+    
+    Arguments:   - request:      HttpRequest object [might contain cursor]
+                 - objects_list: QuerySet to be paginated
+                 - ordering:     list of field names to order by, with a '-'
+                                 prefix for descending fields.
+                 - per_page:     number of objects on a page
+    Return:      Dictionary with following keys:
+                 - objects:     list of objects that made it to current page
+                 - next_cursor: cursor of next page ['' if on last page]
+        
+    Author:      Nnoduka Eruchalu
+    """
+    objects_list = objects_list.order_by(*ordering)
+    
+    values = decode_cursor(request.GET.get('cursor', ''), objects_list.model,
+                           ordering)
+    if values:
+        objects_list = keyset_filter(objects_list, ordering, values)
+    
+    # grab one extra object to find out if there's another page
+    objects = list(objects_list[:per_page+1])
+    if len(objects) > per_page:
+        objects = objects[:per_page]
+        next_cursor = get_cursor(objects[-1], ordering)
+    else:
+        next_cursor = '' # way of indicating no more pages
+    
+    return {
+        'objects':objects,
+        'next_cursor':next_cursor,
+        }
+
+
+# connection pool shared by every redis client of this process
+_redis_pool = None
+
+def get_redis():
+    """    
+    Description: Get a redis client using the process-wide connection pool, so
+                 connections to the redis server are reused across requests
+                 and modules rather than each client keeping its own.
+                 Connecting times out after `REDIS_SOCKET_TIMEOUT` seconds, so
+                 a redis outage can't hold up a request for long.
+          
+    Arguments:   None
+    Return:      redis.StrictRedis instance
+        
+    Author:      Nnoduka Eruchalu
+    """
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = redis.ConnectionPool(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT)
+    return redis.StrictRedis(connection_pool=_redis_pool)